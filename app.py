@@ -1,19 +1,50 @@
 # main.py
+import sys
+
+if __name__ == "__main__":
+    # `python app.py`: run serve.py before anything below is built. Spawned processes re-import
+    # the main module, so it has to be the side-effect-free serve.py, not this file
+    import serve
+
+    sys.modules["__main__"] = serve
+    serve.main()
+    sys.exit()
+
 import os
-import json
-import uvicorn
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-import redis
+import time
+import shutil
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+import redis as redis_sync
+import redis.asyncio as redis
 import asyncio
+import aiofiles
 
 from core.pipeline import ChunkerPipeline
+from core.storage.segment_store import SnapshotConflict
+from core.snapshot_watcher import SnapshotWatcher
+from core.retriever.semantic_cache import SemanticQueryCache, normalize_query
+from core.retriever.fusion import FUSION_METHODS
+from core.jobs.ingest_jobs import JobStore, IngestJobManager
+from utility.worker_pool import BoundedWorkerPool, PoolSaturated
+from utility.query_cache import QueryCache
+from utility import metrics
 from config.settings import (
     REDIS_URL,
     EMBED_PROVIDER,
     MODEL_NAME,
     FILE_STORAGE_PATH,
-    INDEX_PERSISTENCE_STORAGE_PATH
+    INDEX_PERSISTENCE_STORAGE_PATH,
+    SEARCH_WORKERS,
+    SEARCH_MAX_QUEUE,
+    INGEST_WORKERS,
+    INGEST_MAX_QUEUE,
+    UPLOAD_CHUNK_SIZE,
+    SERVE_ROLE,
+    WRITER_AUTOSAVE,
+    SEMANTIC_CACHE_ENABLED,
+    FUSION_METHOD,
+    SERVER_TIMING,
 )
 
 
@@ -21,96 +52,333 @@ r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 
 app = FastAPI()
 
-pipeline = ChunkerPipeline(embed_provider=EMBED_PROVIDER, model_name=MODEL_NAME)
+# readers serve searches from memory-mapped snapshots published by the writer process
+READ_ONLY = SERVE_ROLE == "reader"
+AUTOSAVE = SERVE_ROLE == "writer" and WRITER_AUTOSAVE
 
+pipeline = ChunkerPipeline(embed_provider=EMBED_PROVIDER, model_name=MODEL_NAME, read_only=READ_ONLY)
+watcher = SnapshotWatcher(pipeline, INDEX_PERSISTENCE_STORAGE_PATH) if READ_ONLY else None
 
-# Simple in-memory lock for request coalescing (per query) using Redis SETNX
-async def get_cached_or_compute(key, ttl, compute_coro):
-    # check cache
-    cached = r.get(key)
-    if cached:
-        return json.loads(cached)
-    lock_key = f"lock:{key}"
-    got_lock = r.set(lock_key, "1", nx=True, ex=30)
-    if not got_lock:
-        # someone else is computing; poll for result
-        for _ in range(30):
-            await asyncio.sleep(0.2)
-            cached = r.get(key)
-            if cached:
-                return json.loads(cached)
-        raise HTTPException(status_code=504, detail="Timeout waiting for cached result")
+# separate pools so heavy ingests cannot starve quick searches
+search_pool = BoundedWorkerPool("search", SEARCH_WORKERS, SEARCH_MAX_QUEUE)
+ingest_pool = BoundedWorkerPool("ingest", INGEST_WORKERS, INGEST_MAX_QUEUE)
+
+# search results: in-process LRU + Redis, keyed by index generation
+cache = QueryCache(r)
+# paraphrases of recent deep searches reuse their results
+semantic = SemanticQueryCache() if SEMANTIC_CACHE_ENABLED else None
+
+
+def _ratio(hits, total):
+    return hits / total if total else 0.0
+
+
+def register_metrics():
+    """Index sizes, cache and pool state, read at scrape time."""
+    collect = metrics.REGISTRY.collect
+    collect("rag_index_vectors", "Vectors in the FAISS index", pipeline.faiss.ntotal)
+    collect("rag_index_bm25_docs", "Chunks in the BM25 index", lambda: pipeline.bm25.doc_count)
+    collect("rag_chunks", "Chunks in the store", lambda: len(pipeline.store))
+    collect("rag_chunks_deleted", "Tombstoned chunks", lambda: pipeline.store.deleted_count)
+    collect("rag_documents", "Indexed documents", lambda: len(pipeline.documents))
+    collect("rag_index_generation", "Loaded snapshot version", lambda: pipeline.generation)
+    # memory/redis hits, computed, coalesced (waited on a local computation), wakeups/timeouts (waited on a peer)
+    collect("rag_query_cache_events_total", "Query cache lookups by outcome", lambda: dict(cache.stats), "counter", "event")
+    collect("rag_query_cache_hit_ratio", "Share of query cache lookups answered from memory or Redis",
+            lambda: _ratio(cache.stats["memory_hits"] + cache.stats["redis_hits"],
+                           cache.stats["memory_hits"] + cache.stats["redis_hits"] + cache.stats["computed"]))
+    if semantic:
+        collect("rag_semantic_cache_hit_ratio", "Share of deep searches answered by a cached paraphrase",
+                lambda: semantic.info()["hit_rate"])
+    if pipeline.embed_mgr.cache:
+        collect("rag_embedding_cache_hit_ratio", "Embedding cache hit ratio",
+                lambda: pipeline.embed_mgr.cache.info()["hit_ratio"])
+    collect("rag_pool_pending", "Running + queued jobs per worker pool",
+            lambda: {p.name: p.info()["running"] + p.info()["queued"] for p in (search_pool, ingest_pool)},
+            label="pool")
+
+
+def after_ingest(job):
+    if not any(f["status"] == "done" and not f.get("skipped") for f in job["files"]):
+        return
+    if AUTOSAVE:
+        pipeline.save(INDEX_PERSISTENCE_STORAGE_PATH)
+    # cached results predate the new chunks
+    cache.bump_threadsafe()
+
+
+# ingest jobs run in the background; their state lives in Redis (written from worker threads)
+jobs = IngestJobManager(
+    pipeline, ingest_pool, JobStore(redis_sync.Redis.from_url(REDIS_URL, decode_responses=True)),
+    after_job=after_ingest,
+)
+
+
+@app.middleware("http")
+async def timing(request: Request, call_next):
+    token = metrics.start_request()
+    start = time.perf_counter()
     try:
-        result = await compute_coro()
-        r.set(key, json.dumps(result), ex=ttl)
-        return result
+        response = await call_next(request)
     finally:
-        r.delete(lock_key)
+        timings = metrics.end_request(token)
+    total = time.perf_counter() - start
+    route = request.scope.get("route")
+    # route template, not the raw path, to keep label cardinality bounded
+    metrics.REQUEST_SECONDS.observe(total, request.method, route.path if route else "unmatched", response.status_code)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing(timings, total)
+    return response
+
+
+@app.on_event("startup")
+async def startup():
+    register_metrics()
+    await cache.start()
+    if READ_ONLY:
+        # open the current snapshot now, then follow new generations
+        await asyncio.to_thread(watcher.check)
+        watcher.start()
+    else:
+        # continue the snapshot on disk: saving without it would fork the manifest
+        try:
+            await asyncio.to_thread(pipeline.load, INDEX_PERSISTENCE_STORAGE_PATH)
+        except FileNotFoundError:
+            pass
+        await asyncio.to_thread(jobs.resume)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # embedding cache entries newer than the last periodic write-back
+    if pipeline.embed_mgr.cache is not None:
+        await asyncio.to_thread(pipeline.embed_mgr.cache.flush)
+
+
+def require_writer():
+    if READ_ONLY:
+        raise HTTPException(status_code=403, detail="Read-only replica, send writes to the writer")
+
+
+async def run_search(fn, *args, **kwargs):
+    try:
+        return await search_pool.run(fn, *args, **kwargs)
+    except PoolSaturated:
+        raise HTTPException(status_code=429, detail="Too many concurrent searches", headers={"Retry-After": "1"})
+
+
+async def run_ingest(fn, *args, **kwargs):
+    try:
+        return await ingest_pool.run(fn, *args, **kwargs)
+    except PoolSaturated:
+        raise HTTPException(status_code=503, detail="Ingest queue is full", headers={"Retry-After": "30"})
+
+
+# Request coalescing (per query): local LRU, then Redis with a SETNX lock and pub/sub wakeups
+async def get_cached_or_compute(key, ttl, compute_coro):
+    try:
+        return await cache.get_or_compute(key, ttl, compute_coro)
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+@app.post("/ingest", status_code=202)
+async def ingest(files: list[UploadFile] = File(...), doc_ids: list[str] | None = Form(None)):
+    """
+    Queue files for ingest. Each file is stored under a document id: the matching entry of
+    `doc_ids` if given, else its file name. Uploading to an existing id replaces that
+    document (an unchanged file is skipped), so files that share a name need distinct ids.
+    """
+    require_writer()
+    if doc_ids is not None and len(doc_ids) != len(files):
+        raise HTTPException(status_code=400, detail="doc_ids needs one id per file")
+    ids = doc_ids or [os.path.basename(file.filename) for file in files]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Duplicate document ids in one upload, pass distinct doc_ids")
+    if not ingest_pool.has_capacity():
+        raise HTTPException(status_code=503, detail="Ingest queue is full", headers={"Retry-After": "30"})
+    job_id = jobs.new_job_id()
+    job_dir = os.path.join(FILE_STORAGE_PATH, job_id)
+    saved = []
+    try:
+        for i, (file, doc_id) in enumerate(zip(files, ids)):
+            name = os.path.basename(file.filename)
+            # a directory per file: uploads may share a name
+            os.makedirs(os.path.join(job_dir, str(i)), exist_ok=True)
+            temp_path = os.path.join(job_dir, str(i), name)
+            # stream to disk in fixed-size chunks instead of reading the whole upload
+            with metrics.span("upload_write"):
+                async with aiofiles.open(temp_path, "wb") as f_out:
+                    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                        await f_out.write(chunk)
+            saved.append((name, temp_path, doc_id))
+        job = await asyncio.to_thread(jobs.submit, job_id, saved)
+    except BaseException as e:
+        # no job will read the upload: the pool filled up meanwhile, or the upload broke off
+        await asyncio.to_thread(shutil.rmtree, job_dir, True)
+        if isinstance(e, PoolSaturated):
+            raise HTTPException(status_code=503, detail="Ingest queue is full", headers={"Retry-After": "30"})
+        raise
+    return {"status": job["status"], "job_id": job_id, "files": [name for name, _, _ in saved],
+            "doc_ids": [doc_id for _, _, doc_id in saved]}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await asyncio.to_thread(jobs.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
-@app.post("/ingest")
-async def ingest(files: list[UploadFile] = File(...)):
-    results = []
-    os.makedirs(FILE_STORAGE_PATH, exist_ok=True)
-    for file in files:
-        temp_path = os.path.join(FILE_STORAGE_PATH, file.filename)
-        with open(temp_path, "wb") as f_out:
-            f_out.write(await file.read())
-        result = pipeline.ingest_file(temp_path)
-        results.append({"file": file.filename, "chunks": result["ingested"]})
-    return JSONResponse({"status": "ok", "results": results})
+@app.get("/documents")
+async def list_documents():
+    return {"documents": pipeline.documents.list()}
+
+
+@app.delete("/documents/{doc_id}")
+async def delete_document(doc_id: str):
+    require_writer()
+    removed = await run_ingest(pipeline.delete_document, doc_id)
+    if removed is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if AUTOSAVE:
+        await run_ingest(pipeline.save, INDEX_PERSISTENCE_STORAGE_PATH)
+    await cache.bump()
+    return {"deleted": True, "doc_id": doc_id, "chunks": removed}
 
 
 @app.get("/search/quick")
-async def search_quick(q: str, top_k: int = 5):
+async def search_quick(q: str, top_k: int = 5, nprobe: int | None = None, ef_search: int | None = None):
+    # the cache key is the text that is searched, so equal keys mean equal results
+    q = normalize_query(q)
     # check redis cache first
-    key = f"quick:{q}:{top_k}"
-    async def do_search():
+    # generation of the shared cache + snapshot loaded here (read replicas may lag the writer)
+    key = cache.key("quick", pipeline.generation, q, top_k, nprobe, ef_search)
+    def quick():
         # bm25 -> quick lexical search; we return both bm25 and faiss top 1 as quick hybrid
         bm = pipeline.query_bm25(q, top_k=top_k)
         if not bm:
             # fallback to faiss
-            fa = pipeline.query_faiss(q, top_k=top_k)
+            fa = pipeline.query_faiss(q, top_k=top_k, nprobe=nprobe, ef_search=ef_search)
             return {"source":"faiss", "results": fa}
         return {"source":"bm25", "results": bm}
+    async def do_search():
+        return await run_search(quick)
     result = await get_cached_or_compute(key, ttl=60, compute_coro=do_search)
     return result
 
 
+def deep_search(q, faiss_k, rerank_k, nprobe, ef_search, fusion, qvec = None):
+    # the query has to be embedded anyway, so look for a cached paraphrase first
+    if qvec is None:
+        qvec = pipeline.embed_mgr.embed_query(q)
+    def search():
+        res = pipeline.query_deep(q, faiss_k=faiss_k, rerank_k=rerank_k, nprobe=nprobe, ef_search=ef_search, qvec=qvec, fusion=fusion)
+        return {"source":"hybrid", "results": res}
+    if semantic is None:
+        return search()
+    namespace = cache.key("deep", pipeline.generation, faiss_k, rerank_k, nprobe, ef_search, fusion)
+    hit = semantic.lookup(namespace, qvec)
+    if hit is not None:
+        cached_query, result, similarity = hit
+        if not semantic.should_sample():
+            return {**result, "semantic_hit": {"query": cached_query, "similarity": similarity}}
+        # sampled hit: serve a fresh search and record whether the cached one would have matched
+        fresh = search()
+        semantic.record_check(result["results"], fresh["results"])
+        return fresh
+    result = search()
+    semantic.insert(namespace, q, qvec, result)
+    return result
+
+
 @app.get("/search/deep")
-async def search_deep(q: str, faiss_k: int = 500, rerank_k: int = 10):
-    key = f"deep:{q}:{faiss_k}:{rerank_k}"
+async def search_deep(q: str, faiss_k: int = 500, rerank_k: int = 10, nprobe: int | None = None, ef_search: int | None = None,
+                      fusion: str = FUSION_METHOD):
+    if fusion not in FUSION_METHODS:
+        raise HTTPException(status_code=400, detail=f"fusion must be one of {', '.join(FUSION_METHODS)}")
+    q = normalize_query(q)
+    key = cache.key("deep", pipeline.generation, q, faiss_k, rerank_k, nprobe, ef_search, fusion)
     async def do_deep():
-        res = pipeline.query_deep(q, faiss_k=faiss_k, rerank_k=rerank_k)
-        return {"source":"hybrid", "results": res}
+        qvec = None
+        if pipeline.embed_mgr.is_async:
+            # API-backed embeddings are awaited here instead of blocking a search worker
+            qvec = await pipeline.embed_mgr.aembed_query(q)
+        return await run_search(deep_search, q, faiss_k, rerank_k, nprobe, ef_search, fusion, qvec)
     result = await get_cached_or_compute(key, ttl=30, compute_coro=do_deep)
     return result
 
 
 @app.post("/save")
-def save_index():
-    pipeline.faiss.save(INDEX_PERSISTENCE_STORAGE_PATH)
-    bm_25_filepath = os.path.join(INDEX_PERSISTENCE_STORAGE_PATH, "bm25.pkl")
-    pipeline.bm25.save(bm_25_filepath)
-    return {"saved": True}
+async def save_index():
+    require_writer()
+    try:
+        manifest = await run_ingest(pipeline.save, INDEX_PERSISTENCE_STORAGE_PATH)
+    except SnapshotConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"saved": True, "version": manifest["version"], "segments": len(manifest["segments"])}
 
 
 @app.post("/load")
-def load_index():
-    pipeline.faiss.load(INDEX_PERSISTENCE_STORAGE_PATH)
-    bm_25_filepath = os.path.join(INDEX_PERSISTENCE_STORAGE_PATH, "bm25.pkl")
-    pipeline.bm25.load(bm_25_filepath)
-    return {"loaded": True}
+async def load_index():
+    try:
+        manifest = await run_ingest(pipeline.load, INDEX_PERSISTENCE_STORAGE_PATH)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not READ_ONLY:
+        await cache.bump()
+    return {"loaded": True, "version": manifest["version"]}
+
+
+@app.get("/snapshots")
+async def list_snapshots():
+    return {"snapshots": await asyncio.to_thread(pipeline.snapshots, INDEX_PERSISTENCE_STORAGE_PATH)}
+
+
+@app.post("/snapshots/{version}/rollback")
+async def rollback_snapshot(version: int):
+    require_writer()
+    try:
+        manifest = await run_ingest(pipeline.rollback, version, INDEX_PERSISTENCE_STORAGE_PATH)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    await cache.bump()
+    return {"rolled_back": True, "version": manifest["version"]}
+
+
+@app.post("/compact")
+async def compact_index():
+    require_writer()
+    manifest = await run_ingest(pipeline.compact, INDEX_PERSISTENCE_STORAGE_PATH)
+    return {"compacted": manifest is not None, "version": manifest["version"] if manifest else None}
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/status")
 def status():
     return {
-        "faiss_vectors": pipeline.faiss.index.ntotal if pipeline.faiss.index is not None else 0,
-        "bm25_corpus": len(pipeline.bm25.meta) if pipeline.bm25.bm25 is not None else 0,
-        "embed_provider": pipeline.embed_mgr.provider
+        "faiss_vectors": pipeline.faiss.ntotal(),
+        "faiss_memory": pipeline.faiss.memory_info(),
+        "bm25_corpus": pipeline.bm25.doc_count,
+        "shards": pipeline.faiss.n_shards,
+        "role": SERVE_ROLE,
+        "generation": pipeline.generation,
+        "watcher": watcher.info() if watcher else None,
+        "query_cache": cache.info(),
+        "semantic_cache": semantic.info() if semantic else None,
+        "chunks": len(pipeline.store),
+        "deleted_chunks": pipeline.store.deleted_count,
+        "documents": len(pipeline.documents),
+        "embed_provider": pipeline.embed_mgr.provider,
+        "embed_parity": getattr(pipeline.embed_mgr.embedder, "parity", None),
+        "embed_client": pipeline.embed_mgr.embedder.info() if hasattr(pipeline.embed_mgr.embedder, "info") else None,
+        "embedding_cache": pipeline.embed_mgr.cache.info() if pipeline.embed_mgr.cache else None,
+        "query_batcher": pipeline.embed_mgr.batcher.info() if pipeline.embed_mgr.batcher else None,
+        "pools": {"search": search_pool.info(), "ingest": ingest_pool.info()}
     }
 
-
-if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
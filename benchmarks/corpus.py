@@ -0,0 +1,114 @@
+import os
+import textwrap
+import numpy as np
+
+# documents per format and their size; "paragraphs" is per section
+SCALES = {
+    "small": {"docs": 4, "sections": 4, "paragraphs": 5},
+    "medium": {"docs": 20, "sections": 8, "paragraphs": 8},
+    "large": {"docs": 100, "sections": 12, "paragraphs": 10},
+}
+
+FORMATS = ("txt", "docx", "pdf")
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "shi", "pre", "dor", "gal", "tem", "bis", "ux", "on", "ar"]
+
+
+def make_vocab(size, rng):
+    """Pronounceable pseudo-words and Zipf-like sampling weights (a few very common terms, a long tail)."""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES, size=rng.integers(2, 5))))
+    words = np.array(sorted(words))
+    rng.shuffle(words)
+    weights = 1.0 / np.arange(1, size + 1) ** 1.1
+    return words, weights / weights.sum()
+
+
+def _sentence(rng, words, weights):
+    text = " ".join(rng.choice(words, size=rng.integers(6, 20), p=weights))
+    return text[0].upper() + text[1:] + "."
+
+
+def make_document(rng, words, weights, sections, paragraphs):
+    """[(heading, [paragraph, ...]), ...]"""
+    doc = []
+    for s in range(sections):
+        heading = f"{s + 1} " + " ".join(rng.choice(words[:200], size=2)).upper()
+        paras = [" ".join(_sentence(rng, words, weights) for _ in range(rng.integers(3, 9))) for _ in range(paragraphs)]
+        doc.append((heading, paras))
+    return doc
+
+
+def write_txt(path, doc):
+    with open(path, "w", encoding="utf-8") as f:
+        for heading, paras in doc:
+            f.write(heading + "\n\n")
+            for p in paras:
+                f.write(p + "\n\n")
+
+
+def write_docx(path, doc):
+    from docx import Document
+
+    d = Document()
+    for heading, paras in doc:
+        d.add_heading(heading.title(), level=1)
+        for p in paras:
+            d.add_paragraph(p)
+    # one small table, the processors handle tables separately
+    table = d.add_table(rows=4, cols=3)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = doc[r % len(doc)][0] if c == 0 else str(r * 3 + c)
+    d.save(path)
+
+
+def write_pdf(path, doc, lines_per_page = 55):
+    import fitz  # PyMuPDF
+
+    lines = []
+    for heading, paras in doc:
+        lines += [heading, ""]
+        for p in paras:
+            lines += textwrap.wrap(p, 95) + [""]
+    pdf = fitz.open()
+    for start in range(0, len(lines), lines_per_page):
+        page = pdf.new_page()
+        y = 50
+        for line in lines[start:start + lines_per_page]:
+            page.insert_text((50, y), line, fontsize=10)
+            y += 13
+    pdf.save(path)
+    pdf.close()
+
+
+WRITERS = {"txt": write_txt, "docx": write_docx, "pdf": write_pdf}
+
+
+def generate_corpus(out_dir, scale = "small", formats = FORMATS, seed = 0, vocab_size = 5000):
+    """Write a deterministic corpus (same seed -> same files) and return the file paths."""
+    size = SCALES[scale]
+    rng = np.random.default_rng(seed)
+    words, weights = make_vocab(vocab_size, rng)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for fmt in formats:
+        for i in range(size["docs"]):
+            doc = make_document(rng, words, weights, size["sections"], size["paragraphs"])
+            path = os.path.join(out_dir, f"doc-{i:04d}.{fmt}")
+            WRITERS[fmt](path, doc)
+            paths.append(path)
+    return paths
+
+
+def sample_queries(texts, n, seed = 0):
+    """Queries made of 2-6 consecutive words of random chunks, so most have lexical and dense matches."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(texts), size=n):
+        words = texts[i].split()
+        k = int(rng.integers(2, 7))
+        start = int(rng.integers(0, max(1, len(words) - k)))
+        queries.append(" ".join(words[start:start + k]))
+    return queries
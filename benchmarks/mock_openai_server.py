@@ -0,0 +1,164 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint, to exercise the client's batching,
+rate-limit handling and retries without network access or quota:
+
+    python -m benchmarks.mock_openai_server --port 8089 --rpm 600 --tpm 200000 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=test EMBED_PROVIDER=openai ...
+
+Vectors come from StubEmbeddings. Requests beyond the per-minute request/token limits
+get a 429 with retry-after, like the real API; every response carries the
+x-ratelimit-* headers. Empty inputs are rejected with a 400, a wrong key (with --api-key)
+with a 401. GET /stats returns counters.
+"""
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from benchmarks.stub_embedder import StubEmbeddings
+
+
+def count_tokens(text):
+    return len(text) // 4 + 1
+
+
+class Quota:
+    """Requests and tokens per fixed window (one minute, like the API limits)."""
+
+    def __init__(self, rpm, tpm, window = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._start = time.monotonic()
+        self._requests = 0
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+
+    def take(self, tokens):
+        """(allowed, headers)"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._start >= self.window:
+                self._start, self._requests, self._tokens = now, 0, 0
+            reset = self.window - (now - self._start)
+            allowed = self._requests + 1 <= self.rpm and self._tokens + tokens <= self.tpm
+            if allowed:
+                self._requests += 1
+                self._tokens += tokens
+            headers = {
+                "x-ratelimit-limit-requests": str(self.rpm),
+                "x-ratelimit-remaining-requests": str(self.rpm - self._requests),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                "x-ratelimit-limit-tokens": str(self.tpm),
+                "x-ratelimit-remaining-tokens": str(self.tpm - self._tokens),
+                "x-ratelimit-reset-tokens": f"{reset:.3f}s",
+            }
+            if not allowed:
+                headers["retry-after-ms"] = str(int(reset * 1000))
+            return allowed, headers
+
+
+def make_handler(args, quota, embedder, stats):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body, headers = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+
+        def _error(self, status, message, headers = None):
+            with lock:
+                stats[str(status)] = stats.get(str(status), 0) + 1
+            self._send(status, {"error": {"message": message, "type": "mock_error", "code": None}}, headers)
+
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                with lock:
+                    self._send(200, dict(stats))
+            else:
+                self._error(404, "not found")
+
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                return self._error(404, "not found")
+            if args.api_key and self.headers.get("authorization") != f"Bearer {args.api_key}":
+                return self._error(401, "Incorrect API key provided")
+            texts = body.get("input")
+            texts = [texts] if isinstance(texts, str) else list(texts or [])
+            if not texts or any(not t for t in texts):
+                return self._error(400, "'$.input' is invalid: empty string")
+            tokens = sum(count_tokens(t) for t in texts)
+            allowed, headers = quota.take(tokens)
+            if not allowed:
+                return self._error(429, "Rate limit reached", headers)
+            if args.latency_ms:
+                time.sleep(args.latency_ms / 1000 * random.uniform(0.5, 1.5))
+            if random.random() < args.error_rate:
+                return self._error(500, "The server had an error while processing your request", headers)
+            vectors = embedder.embed_texts(texts)
+            if body.get("encoding_format") == "base64":
+                data = [base64.b64encode(v.astype("<f4").tobytes()).decode() for v in vectors]
+            else:
+                data = vectors.tolist()
+            with lock:
+                stats["200"] = stats.get("200", 0) + 1
+                stats["texts"] = stats.get("texts", 0) + len(texts)
+                stats["max_batch_tokens"] = max(stats.get("max_batch_tokens", 0), tokens)
+            self._send(200, {
+                "object": "list",
+                "data": [{"object": "embedding", "index": i, "embedding": e} for i, e in enumerate(data)],
+                "model": body.get("model"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }, headers)
+
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def make_server(argv = None):
+    parser = argparse.ArgumentParser(description="Mock OpenAI embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--rpm", type=int, default=3000, help="requests per minute")
+    parser.add_argument("--tpm", type=int, default=1000000, help="tokens per minute")
+    parser.add_argument("--window", type=float, default=60.0, help="seconds the rpm/tpm limits apply to")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--api-key", default="", help="reject requests without this bearer token")
+    args = parser.parse_args(argv)
+    return ThreadingHTTPServer((args.host, args.port), make_handler(
+        args, Quota(args.rpm, args.tpm, args.window), StubEmbeddings(args.dim), {}
+    ))
+
+
+def main(argv = None):
+    server = make_server(argv)
+    print(f"mock embeddings on http://{server.server_address[0]}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Benchmark suite: synthetic corpus -> ingest -> search latency -> ANN recall -> save/load.
+
+    python -m benchmarks.run --scale small --out benchmarks/results/latest.json
+    python -m benchmarks.run --scale small --baseline benchmarks/results/baseline.json
+
+Results are one JSON file with flat metric names; with --baseline the run exits
+non-zero when a metric regressed by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import faiss
+import numpy as np
+from benchmarks.corpus import FORMATS, SCALES, generate_corpus, sample_queries
+from benchmarks.stub_embedder import StubEmbeddings
+from core.embeddings.embedding_manager import EmbeddingManager
+from core.vectorstores.faiss_client import INDEX_TYPES, FAISSManager
+from core.pipeline import ChunkerPipeline
+
+# recall is compared as an absolute drop, everything else relative to the baseline
+RECALL_TOLERANCE = 0.02
+# changes smaller than this (by metric unit) are timer/scheduler noise, never regressions
+NOISE_FLOOR = {"_ms": 0.5, "_s": 0.01, "_mb": 10.0}
+# sizes of the run, not performance
+NOT_COMPARED = ("corpus.", "ingest.files_", "ingest.chunks")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99))}
+
+
+class StageTimer:
+    """Busy time per ingest stage, measured by wrapping the callables each stage runs."""
+
+    def __init__(self):
+        self.seconds = {}
+
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+        return timed
+
+
+    def wrap_iter(self, stage, fn):
+        # generators do their work in next(), so time that instead of the call
+        def timed(*args, **kwargs):
+            it = fn(*args, **kwargs)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+                yield item
+        return timed
+
+
+def make_pipeline(dim, seed):
+    # no embedding cache: every run embeds everything, like a first ingest
+    embed_mgr = EmbeddingManager(provider="stub", model_name=f"stub-{dim}", use_cache=False, batch_queries=False,
+                                 embedder=StubEmbeddings(dim, seed))
+    return ChunkerPipeline(embed_mgr=embed_mgr)
+
+
+def bench_ingest(pipeline, paths):
+    timer = StageTimer()
+    pipeline.processor.iter_file = timer.wrap_iter("parse", pipeline.processor.iter_file)
+    embedder = pipeline.embed_mgr.embedder
+    embedder.embed_texts = timer.wrap("embed", embedder.embed_texts)
+    pipeline.faiss.add = timer.wrap("index", pipeline.faiss.add)
+    pipeline.bm25.add = timer.wrap("index", pipeline.bm25.add)
+    chunks = 0
+    start = time.perf_counter()
+    for path in paths:
+        chunks += pipeline.ingest_file(path)["ingested"]
+    wall = time.perf_counter() - start
+    out = {"ingest.wall_s": wall, "ingest.chunks": chunks, "ingest.chunks_per_s": chunks / wall if wall else 0.0}
+    for stage in ("parse", "embed", "index"):
+        out[f"ingest.{stage}_s"] = timer.seconds.get(stage, 0.0)
+    for fmt in FORMATS:
+        files = [p for p in paths if p.endswith(fmt)]
+        if files:
+            out[f"ingest.files_{fmt}"] = len(files)
+    return out
+
+
+def bench_search(pipeline, queries, k, faiss_k, warmup = 5):
+    methods = {
+        "query_bm25": lambda q: pipeline.query_bm25(q, top_k=k),
+        "query_faiss": lambda q: pipeline.query_faiss(q, top_k=k),
+        "query_deep": lambda q: pipeline.query_deep(q, faiss_k=faiss_k, rerank_k=k),
+    }
+    out = {}
+    for name, fn in methods.items():
+        for q in queries[:warmup]:
+            fn(q)
+        samples = []
+        for q in queries:
+            start = time.perf_counter()
+            fn(q)
+            samples.append(time.perf_counter() - start)
+        for key, value in percentiles(samples).items():
+            out[f"search.{name}.{key}"] = value
+    return out
+
+
+def bench_recall(pipeline, ids, vectors, queries, k, index_types):
+    """recall@k of each index type against exact inner-product search over the same vectors."""
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    qvecs = np.vstack([pipeline.embed_mgr.embedder.embed_query(q) for q in queries]).astype("float32")
+    _, truth = exact.search(qvecs, k)
+    truth = ids[truth]
+    out = {}
+    for index_type in index_types:
+        if index_type == "ivf_pq" and len(vectors) < 256 * 39:
+            # PQ codebooks need ~39 training points per centroid; fewer only measures noise
+            continue
+        mgr = FAISSManager(pipeline.store, index_type=index_type, train_threshold=min(len(vectors), 50000))
+        start = time.perf_counter()
+        mgr.add(vectors, ids)
+        out[f"build.{index_type}_s"] = time.perf_counter() - start
+        hits = 0
+        for qvec, expected in zip(qvecs, truth):
+            _, found = mgr.search_ids(qvec.reshape(1, -1), k)
+            hits += len(set(found.tolist()) & set(expected.tolist()))
+        out[f"recall.{index_type}@{k}"] = hits / truth.size
+    return out
+
+
+def bench_load(pipeline, dim, seed, index_dir):
+    out = {}
+    pipeline.save(index_dir)
+    start = time.perf_counter()
+    make_pipeline(dim, seed).load(index_dir)
+    out["load.segments_s"] = time.perf_counter() - start
+    pipeline.compact(index_dir)
+    start = time.perf_counter()
+    make_pipeline(dim, seed).load(index_dir)
+    out["load.compacted_s"] = time.perf_counter() - start
+    return out
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(scale = "small", formats = FORMATS, n_queries = 200, k = 10, faiss_k = 200, dim = 64, seed = 0,
+        index_types = INDEX_TYPES, work_dir = None):
+    work_dir = work_dir or tempfile.mkdtemp(prefix="bench-")
+    try:
+        start = time.perf_counter()
+        paths = generate_corpus(os.path.join(work_dir, "corpus"), scale, formats, seed)
+        metrics = {"corpus.generate_s": time.perf_counter() - start}
+        pipeline = make_pipeline(dim, seed)
+        metrics.update(bench_ingest(pipeline, paths))
+        metrics["rss.after_ingest_mb"] = peak_rss_mb()
+        ids, vectors = pipeline.faiss.delta()
+        texts = [pipeline.store.content(i) for i in range(len(pipeline.store))]
+        queries = sample_queries(texts, n_queries, seed)
+        metrics.update(bench_search(pipeline, queries, k, faiss_k))
+        metrics.update(bench_recall(pipeline, ids, np.ascontiguousarray(vectors), queries, k, index_types))
+        metrics.update(bench_load(pipeline, dim, seed, os.path.join(work_dir, "indexes")))
+        metrics["rss.peak_mb"] = peak_rss_mb()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    meta = {
+        "scale": scale, **SCALES[scale], "formats": list(formats), "queries": n_queries, "k": k,
+        "faiss_k": faiss_k, "dim": dim, "seed": seed, "commit": _git_commit(), "created": time.time(),
+        "python": platform.python_version(), "numpy": np.__version__, "faiss": faiss.__version__,
+        "machine": platform.machine(), "cpus": os.cpu_count(),
+    }
+    return {"meta": meta, "metrics": metrics}
+
+
+def higher_is_better(name):
+    return name.startswith("recall.") or name.endswith("_per_s")
+
+
+def compare(metrics, baseline, tolerance):
+    """Rows (name, baseline, current, change, regressed) for the metrics both runs have."""
+    rows = []
+    for name, base in sorted(baseline.items()):
+        if name not in metrics or name.startswith(NOT_COMPARED) and not name.endswith("_per_s"):
+            continue
+        current = metrics[name]
+        if name.startswith("recall."):
+            change = current - base
+            regressed = change < -RECALL_TOLERANCE
+        else:
+            change = (current - base) / base if base else 0.0
+            regressed = change < -tolerance if higher_is_better(name) else change > tolerance
+            floor = next((v for unit, v in NOISE_FLOOR.items() if name.endswith(unit)), 0.0)
+            regressed = regressed and abs(current - base) > floor
+        rows.append((name, base, current, change, regressed))
+    return rows
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Ingest, search and recall benchmarks on a synthetic corpus")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--faiss-k", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index-types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--out", default="benchmarks/results/latest.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    result = run(args.scale, args.formats.split(","), args.queries, args.k, args.faiss_k, args.dim, args.seed,
+                 args.index_types.split(","))
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=1)
+    for name, value in sorted(result["metrics"].items()):
+        print(f"{name:40s} {value:12.4f}")
+    print(f"\nwritten to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(result["metrics"], baseline["metrics"], args.tolerance)
+        print(f"\n{'metric':40s} {'baseline':>12s} {'current':>12s} {'change':>9s}")
+        for name, base, current, change, regressed in rows:
+            mark = "  REGRESSION" if regressed else ""
+            print(f"{name:40s} {base:12.4f} {current:12.4f} {change:+9.1%}{mark}")
+        regressions = [r for r in rows if r[4]]
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed beyond tolerance")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import re
+import zlib
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+
+
+class StubEmbeddings:
+    """
+    Deterministic embedder for benchmarks: the normalized sum of a fixed random
+    vector per token (seeded by the token's crc32). Texts sharing words end up
+    close, so ANN recall and hybrid search behave like with a real model, without
+    a model download or network access.
+    """
+
+    def __init__(self, dim = 64, seed = 0):
+        self.dim = dim
+        self.seed = seed
+        self._vectors = {}
+
+
+    def _token_vector(self, token):
+        vec = self._vectors.get(token)
+        if vec is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode()) ^ self.seed)
+            vec = self._vectors[token] = rng.standard_normal(self.dim).astype("float32")
+        return vec
+
+
+    def embed_texts(self, texts, show_progress=False):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            for token in _WORD.findall(text.lower()):
+                out[i] += self._token_vector(token)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.clip(norms, 1e-12, None)
+
+
+    def embed_query(self, query):
+        return self.embed_texts([query])
@@ -11,3 +11,130 @@ EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "local")
 MODEL_NAME = os.getenv("EMBED_MODEL", "text-embedding-3-small")
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# FAISS index type: flat | hnsw | ivf_flat | ivf_pq | binary | sq8
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+# IVF indexes stay flat until the corpus reaches this size, then get trained and migrated
+FAISS_TRAIN_THRESHOLD = int(os.getenv("FAISS_TRAIN_THRESHOLD", "50000"))
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", "0"))  # 0 -> 4 * sqrt(N)
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "128"))
+
+# Embedding cache keyed by (provider, model, text hash); 0 disables a tier
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "volumes/embedding_cache")
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "10000"))
+EMBED_CACHE_DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "1000000"))
+# new disk entries are written back at most this often (and on save / shutdown)
+EMBED_CACHE_FLUSH_SECONDS = float(os.getenv("EMBED_CACHE_FLUSH_SECONDS", "30"))
+
+# Micro-batching of concurrent query embeddings
+EMBED_BATCH_QUERIES = os.getenv("EMBED_BATCH_QUERIES", "1") == "1"
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+# Worker pools that keep CPU-bound work off the event loop; requests beyond
+# workers + max queue are rejected (429 for search, 503 for ingest)
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", str(os.cpu_count() or 4)))
+SEARCH_MAX_QUEUE = int(os.getenv("SEARCH_MAX_QUEUE", "64"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "4"))
+
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Finished ingest jobs are kept in Redis for this long (seconds)
+JOB_TTL = int(os.getenv("JOB_TTL", str(7 * 24 * 3600)))
+
+# PDF parsing: page ranges are spread over a process pool
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# pages with fewer ruling lines than this skip the pdfplumber table pass
+PDF_TABLE_MIN_LINES = int(os.getenv("PDF_TABLE_MIN_LINES", "4"))
+
+# Chunking: sentences are packed into chunks of up to CHUNK_MAX_TOKENS tokens of the embedding
+# model (capped by its input window), consecutive chunks share up to CHUNK_OVERLAP_TOKENS.
+# Backends that expose no tokenizer are measured in words
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+# Streaming ingest: chunks flow parse -> embed -> index in micro-batches
+# through bounded queues of this depth
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "2"))
+
+# Segment persistence: compact once a snapshot has this many segments,
+# keep this many manifest versions around for rollback
+COMPACT_MIN_SEGMENTS = int(os.getenv("COMPACT_MIN_SEGMENTS", "8"))
+SNAPSHOTS_TO_KEEP = int(os.getenv("SNAPSHOTS_TO_KEEP", "5"))
+
+# Document upserts/deletes: BM25 drops tombstoned postings once they exceed this share of the corpus
+BM25_TOMBSTONE_RATIO = float(os.getenv("BM25_TOMBSTONE_RATIO", "0.1"))
+
+# Sharding: chunks are spread over this many FAISS + BM25 index pairs (by chunk id),
+# queries fan out over a thread pool of SHARD_WORKERS
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "1"))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", os.getenv("INDEX_SHARDS", "1")))
+
+# Serving roles: "standalone" (one process does everything), "writer" (owns ingest and
+# publishes snapshots) or "reader" (read-only replica on memory-mapped snapshots)
+SERVE_ROLE = os.getenv("SERVE_ROLE", "standalone")
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+# readers poll CURRENT for a new snapshot generation this often (seconds)
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "2"))
+# writer saves a snapshot after every ingest job / delete so readers pick it up
+WRITER_AUTOSAVE = os.getenv("WRITER_AUTOSAVE", "1") == "1"
+
+# Search result cache: in-process LRU in front of Redis; waiters on a key being
+# computed elsewhere give up after QUERY_CACHE_LOCK_TTL seconds
+QUERY_CACHE_MEMORY_ITEMS = int(os.getenv("QUERY_CACHE_MEMORY_ITEMS", "1024"))
+QUERY_CACHE_LOCK_TTL = int(os.getenv("QUERY_CACHE_LOCK_TTL", "30"))
+
+# Semantic query cache: paraphrases of a recent query (cosine >= threshold) reuse its
+# results; a sample of hits is re-searched to measure false hits
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_ITEMS = int(os.getenv("SEMANTIC_CACHE_ITEMS", "2048"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SAMPLE_RATE = float(os.getenv("SEMANTIC_CACHE_SAMPLE_RATE", "0.02"))
+
+# Deep search fusion of FAISS and BM25 scores: "minmax", "zscore", "rrf" or "raw"
+FUSION_METHOD = os.getenv("FUSION_METHOD", "minmax")
+
+# ONNX Runtime embedding provider (EMBED_PROVIDER=onnx): exported models are cached here,
+# optionally int8-quantized; a parity check against PyTorch runs once per exported model
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "volumes/onnx")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") == "1"
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", "32"))
+ONNX_PARITY_CHECK = os.getenv("ONNX_PARITY_CHECK", "1") == "1"
+
+# BM25 analyzer: text is lowercased and split on punctuation; stopword removal and light
+# English stemming are optional (changing either rebuilds the saved postings on load)
+BM25_STEM = os.getenv("BM25_STEM", "0") == "1"
+BM25_STOPWORDS = os.getenv("BM25_STOPWORDS", "1") == "1"
+BM25_TOKEN_CACHE = int(os.getenv("BM25_TOKEN_CACHE", "200000"))
+
+# Observability: stage timings of each request in a Server-Timing response header
+# (stage latency histograms and counters are always exported at /metrics)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+# Compressed dense index (FAISS_INDEX_TYPE=binary | sq8): 1-bit or 8-bit codes in RAM for a
+# first pass that fetches top_k * FAISS_RESCORE_FACTOR candidates (at least FAISS_RESCORE_MIN),
+# rescored with the float vectors memory-mapped from the segment files.
+# FAISS_TRUNCATE_DIM > 0 builds the codes from the first N dimensions only (Matryoshka models)
+FAISS_RESCORE_FACTOR = int(os.getenv("FAISS_RESCORE_FACTOR", "4"))
+FAISS_RESCORE_MIN = int(os.getenv("FAISS_RESCORE_MIN", "64"))
+FAISS_TRUNCATE_DIM = int(os.getenv("FAISS_TRUNCATE_DIM", "0"))
+
+# OpenAI embeddings (EMBED_PROVIDER=openai): requests carry at most OPENAI_BATCH_TOKENS tokens
+# and OPENAI_BATCH_MAX_ITEMS inputs; up to OPENAI_MAX_CONCURRENCY run at once, fewer while the
+# rate-limit headers say the quota is short. Failed requests are retried with jittered backoff.
+# OPENAI_BASE_URL points the client at a compatible server (e.g. benchmarks/mock_openai_server.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_BATCH_TOKENS = int(os.getenv("OPENAI_BATCH_TOKENS", "50000"))
+OPENAI_BATCH_MAX_ITEMS = int(os.getenv("OPENAI_BATCH_MAX_ITEMS", "2048"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
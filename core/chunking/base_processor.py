@@ -1,94 +1,136 @@
 import re
 import os
+from collections import deque
 from .docx_processing import DocxProcessor
 from .pdf_processing import PDFProcessor
 from .text_processing import TextProcessor
+from utility.metrics import timed_iter
+from config.settings import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+
+
+def count_words(texts):
+    return [len(t.split()) for t in texts]
 
 
 class BaseProcessor:
-    def __init__(self):
+    def __init__(self, count_tokens = None, model_max_tokens = None, max_tokens = CHUNK_MAX_TOKENS,
+                 overlap = CHUNK_OVERLAP_TOKENS):
+        """
+        count_tokens: texts -> token counts in the embedding model's tokenizer (default: words)
+        model_max_tokens: the model's input window, chunks never exceed it
+        """
         self.processors = {
             "txt": TextProcessor(),
             "docx": DocxProcessor(),
             "pdf": PDFProcessor(),
         }
+        self.count_tokens = count_tokens or count_words
+        self.max_tokens = min(max_tokens, model_max_tokens) if model_max_tokens else max_tokens
+        # every chunk has to add new text beyond the overlap
+        self.overlap = min(overlap, self.max_tokens // 2)
 
 
     def normalize_blocks(self, blocks):
-        normalized = []
         for b in blocks:
-            normalized.append({
+            yield {
                 "heading": b.get("heading", "Document"),
                 "content": b.get("content", ""),
                 "type": b.get("type", "text")
-            })
-        return normalized
+            }
 
 
     def sentence_splitter(self, text):
         return re.split(r'(?<=[.!?])\s+', text.strip())
 
 
-    def chunk_block(self, block, max_words = 150, overlap = 50):
-        if block["type"] != "text":
-            # Non-text content (e.g., table) should be kept as-is
-            return [block]
-
-        sentences = self.sentence_splitter(block["content"])
-        chunks = []
-        current = []
-
-        for sent in sentences:
-            sent_words = sent.split()
-            current_len = sum(len(s.split()) for s in current)
-            if current_len + len(sent_words) <= max_words:
-                current.append(sent)
-            else:
-                # finalize chunk
-                if current:
-                    chunk_text = " ".join(current)
-                    chunks.append({
-                        "heading": block["heading"],
-                        "content": chunk_text,
-                        "type": block["type"]
-                    })
-                    # create overlap (keep last few sentences)
-                    current = current[-(overlap // 15):] + [sent]
-
-        if current:
-            chunks.append({
-                "heading": block["heading"],
-                "content": " ".join(current),
-                "type": block["type"]
-            })
-
-        return chunks
-
-
-    def merge_small_chunks(self, chunks, min_words = 50):
-        merged = []
-        buffer = None
-
-        for c in chunks:
-            word_count = len(c["content"].split())
-            if word_count < min_words and merged:
-                # merge with previous chunk
-                merged[-1]["content"] += " " + c["content"]
-            else:
-                merged.append(c)
-        return merged
-
-
-    def unified_context_chunker(self, blocks, max_words = 150, overlap = 50):
-        normalized = self.normalize_blocks(blocks)
-        all_chunks = []
-
-        for block in normalized:
-            sub_chunks = self.chunk_block(block, max_words=max_words, overlap=overlap)
-            all_chunks.extend(sub_chunks)
-
-        final_chunks = self.merge_small_chunks(all_chunks)
-        return final_chunks
+    def _pieces(self, text):
+        """
+        (text, tokens) per sentence. Sentences longer than a chunk are cut between words
+        into runs of up to `overlap` tokens, so their chunks still overlap.
+        """
+        sentences = [s for s in self.sentence_splitter(text) if s]
+        run_tokens = self.overlap or self.max_tokens
+        for sent, n in zip(sentences, self.count_tokens(sentences)):
+            if n <= self.max_tokens:
+                yield sent, n
+                continue
+            run, size = [], 0
+            words = sent.split()
+            for word, m in zip(words, self.count_tokens(words)):
+                if run and size + m > run_tokens:
+                    yield " ".join(run), size
+                    run, size = [], 0
+                run.append(word)
+                size += m
+            if run:
+                yield " ".join(run), size
+
+
+    def chunk_table(self, block):
+        """Tables longer than a chunk are split between rows, every part repeats the header."""
+        lines = block["content"].split("\n")
+        counts = self.count_tokens(lines)
+        if sum(counts) <= self.max_tokens:
+            yield block
+            return
+        # markdown header: first row, plus the |---| separator when there is one
+        head = 2 if len(lines) > 1 and set(lines[1]) <= set("|-: ") else 1
+        head_size = sum(counts[:head])
+        rows, size = [], head_size
+        for line, n in zip(lines[head:], counts[head:]):
+            if rows and size + n > self.max_tokens:
+                yield {**block, "content": "\n".join(lines[:head] + rows)}
+                rows, size = [], head_size
+            rows.append(line)
+            size += n
+        if rows:
+            yield {**block, "content": "\n".join(lines[:head] + rows)}
+
+
+    def chunk_blocks(self, blocks):
+        """
+        Single pass over the blocks: sentences of consecutive text blocks under one heading
+        are packed into chunks of up to max_tokens, each starting with the last sentences
+        (up to `overlap` tokens) of the previous one. Tables are never mixed with text.
+        """
+        heading, window, size = None, deque(), 0
+        # window holds sentences not emitted yet (beyond the overlap)
+        fresh = False
+
+        def chunk():
+            return {"heading": heading, "content": " ".join(p for p, _ in window), "type": "text"}
+
+        for block in blocks:
+            if block["type"] != "text" or block["heading"] != heading:
+                if fresh:
+                    yield chunk()
+                window.clear()
+                size, fresh = 0, False
+                if block["type"] != "text":
+                    # Non-text content (e.g., table) is only split by rows
+                    yield from self.chunk_table(block)
+                    continue
+                heading = block["heading"]
+            for piece, n in self._pieces(block["content"]):
+                if size + n > self.max_tokens:
+                    if fresh:
+                        yield chunk()
+                        fresh = False
+                        while size > self.overlap:
+                            size -= window.popleft()[1]
+                    while window and size + n > self.max_tokens:
+                        size -= window.popleft()[1]
+                window.append((piece, n))
+                size += n
+                fresh = True
+        if fresh:
+            yield chunk()
+
+
+    def unified_context_chunker(self, blocks):
+        """Generator: processor sections in, model-sized chunks out, without materializing the document."""
+        sections = timed_iter("parse", self.normalize_blocks(blocks))
+        yield from timed_iter("chunk", self.chunk_blocks(sections))
     
     
     def _detect_file_type(self, file_path):
@@ -98,6 +140,11 @@ class BaseProcessor:
     
     
     def process_file(self, file_path):
+        return list(self.iter_file(file_path))
+
+
+    def iter_file(self, file_path):
+        """Yield chunks as the processor produces sections."""
         file_type = self._detect_file_type(file_path)
 
         if file_type not in self.processors:
@@ -106,11 +153,9 @@ class BaseProcessor:
         processor = self.processors[file_type]
 
         try:
-            sections = processor.process_file(file_path)
+            yield from self.unified_context_chunker(processor.iter_file(file_path))
         except Exception as e:
             raise RuntimeError(f"Error processing {file_path}: {e}")
-
-        return sections
     
     
     
@@ -1,4 +1,5 @@
 from docx import Document
+from docx.table import Table
 import re
 
 class DocxProcessor:
@@ -62,21 +63,22 @@ class DocxProcessor:
         Parse DOCX and return structured sections with headings, text, and tables.
         Output: [{heading, content, type}]
         """
+        return list(self.iter_file(file_path))
+
+    def iter_file(self, file_path):
+        """Yield sections as the body is walked."""
         doc = Document(file_path)
         sections, buffer = [], []
         current_heading = "Introduction"
 
-        for element in doc.element.body:
-            tag = element.tag.split("}")[-1]
-            if tag == "p":  # Paragraph
-                para = next((p for p in doc.paragraphs if p._element == element), None)
-                if para:
-                    current_heading = self._handle_paragraph(para, buffer, sections, current_heading)
-
-            elif tag == "tbl":  # Table
-                table = next((t for t in doc.tables if t._element == element), None)
-                if table:
-                    self._handle_table(table, sections, current_heading, buffer)
+        # single pass over the body in document order (paragraphs and tables)
+        for item in doc.iter_inner_content():
+            if isinstance(item, Table):
+                self._handle_table(item, sections, current_heading, buffer)
+            else:
+                current_heading = self._handle_paragraph(item, buffer, sections, current_heading)
+            yield from sections
+            sections.clear()
 
         self._flush_buffer(buffer, sections, current_heading)
-        return sections
+        yield from sections
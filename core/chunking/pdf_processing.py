@@ -1,20 +1,32 @@
 # PDF Processor
-from utility.custom_thread import ThreadWithReturnValue
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import threading
+import logging
 import pdfplumber
 import fitz  # PyMuPDF
-import re
+from utility.metrics import timed_iter
+from config.settings import (
+    PDF_PARSE_WORKERS,
+    PDF_PAGES_PER_TASK,
+    PDF_TABLE_MIN_LINES,
+)
 
-class PDFProcessor:
-    def __init__(self):
-        pass
-    
+logger = logging.getLogger(__name__)
 
-    def extract_text_blocks(self, pdf_path):
-        print("extract text started")
-        """Extract text blocks and detect headings using PyMuPDF."""
-        doc = fitz.open(pdf_path)
-        blocks = []
-        for page_num, page in enumerate(doc, start=1):
+
+# Module-level workers so they can be pickled into the process pool
+
+def _scan_pages(pdf_path, start, end):
+    """
+    Text blocks of pages [start, end) plus the pages likely to hold a table
+    (enough horizontal/vertical ruling lines for pdfplumber's line strategy).
+    """
+    blocks, table_pages = [], []
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(start, end):
+            page = doc[page_num]
             for b in page.get_text("dict")["blocks"]:
                 if "lines" not in b:
                     continue
@@ -24,75 +36,151 @@ class PDFProcessor:
                 font_sizes = [span["size"] for line in b["lines"] for span in line["spans"]]
                 avg_font = sum(font_sizes) / len(font_sizes)
                 blocks.append({
-                    "page": page_num,
+                    "page": page_num + 1,
                     "text": text,
                     "font": avg_font
                 })
-        print("extract text ended")
+            rulings = 0
+            for d in page.get_drawings():
+                for item in d["items"]:
+                    if item[0] == "re":
+                        rulings += 4
+                    elif item[0] == "l" and (item[1].x == item[2].x or item[1].y == item[2].y):
+                        rulings += 1
+            if rulings >= PDF_TABLE_MIN_LINES:
+                table_pages.append(page_num)
+    return blocks, table_pages
+
+
+def _extract_page_tables(pdf_path, pages):
+    tables = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num in pages:
+            for t in pdf.pages[page_num].extract_tables():
+                tables.append((page_num + 1, t))
+    return tables
+
+
+class PDFProcessor:
+    def __init__(self, workers = PDF_PARSE_WORKERS, pages_per_task = PDF_PAGES_PER_TASK):
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: forking a process that runs server threads is not safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+
+    def _map(self, fn, pdf_path, tasks):
+        """
+        Yield fn(pdf_path, *task) for every task in order, running them in the process
+        pool when worthwhile. At most 2 * workers results are in flight at a time.
+        """
+        if len(tasks) <= 1 or self.workers <= 1:
+            for t in tasks:
+                yield fn(pdf_path, *t)
+            return
+        pool = self._get_pool()
+        pending = deque()
+        for t in tasks:
+            pending.append(pool.submit(fn, pdf_path, *t))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+    def _page_count(self, pdf_path):
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+
+
+    def _iter_scan(self, pdf_path):
+        """Yield (blocks, table_pages) per page range, in page order."""
+        n = self._page_count(pdf_path)
+        ranges = [(s, min(s + self.pages_per_task, n)) for s in range(0, n, self.pages_per_task)]
+        yield from self._map(_scan_pages, pdf_path, ranges)
+
+
+    def extract_text_blocks(self, pdf_path):
+        """Extract text blocks and detect headings using PyMuPDF."""
+        blocks = [b for range_blocks, _ in timed_iter("pdf_text", self._iter_scan(pdf_path)) for b in range_blocks]
+        logger.debug("Extracted %d text blocks from %s", len(blocks), pdf_path)
         return blocks
 
 
-    def extract_tables(self, pdf_path):
-        """Extract tables as markdown chunks using pdfplumber."""
-        print("extract table started")
-        tables_md = []
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages, start=1):
-                tables = page.extract_tables()
-                for t in tables:
-                    md = self.table_to_markdown(t)
-                    if md:
-                        tables_md.append({
-                            "heading": f"Table (Page {page_num})",
-                            "content": md,
-                            "type": "table"
-                        })
-        print("extract table ended")
-        return tables_md
-
-
-    def process_file(self, pdf_path, max_words=150, overlap=50):
-        """Combine text + tables into context-aware chunks."""
-        thread1 = ThreadWithReturnValue(target=self.extract_text_blocks, args=(pdf_path,))
-        thread2 = ThreadWithReturnValue(target=self.extract_tables, args=(pdf_path,))
-
-        thread1.start()
-        thread2.start()
-
-        blocks = thread1.join()
-        tables = thread2.join()
-
-        avg_font = sum(b["font"] for b in blocks) / len(blocks)
-        chunks, buffer, heading = [], [], "Introduction"
-
-        def add_chunk():
-            text = " ".join(buffer).strip()
-            if text:
-                words = text.split()
-                for i in range(0, len(words), max_words - overlap):
-                    segment = " ".join(words[i:i + max_words])
-                    chunks.append({
-                        "heading": heading,
-                        "content": segment,
-                        "type": "text"
-                    })
-
-        for blk in blocks:
-            if blk["font"] > avg_font * 1.2:  # detect heading
-                add_chunk()
-                heading = blk["text"]
-                buffer = []
-            else:
-                buffer.append(blk["text"])
-        add_chunk()
-
-        chunks.extend(tables)
-        return chunks
-    
-    
-    def table_to_markdown(self, table_blocks):
+    def extract_tables(self, pdf_path, pages = None):
+        """Extract tables as markdown chunks using pdfplumber (only on `pages` if given, 0-based)."""
+        return list(self.iter_tables(pdf_path, pages))
+
+
+    def iter_tables(self, pdf_path, pages = None):
+        if pages is None:
+            pages = range(self._page_count(pdf_path))
+        pages = list(pages)
+        step = max(1, self.pages_per_task // 4)
+        tasks = [(pages[i:i + step],) for i in range(0, len(pages), step)]
+        found_tables = 0
+        for found in timed_iter("pdf_tables", self._map(_extract_page_tables, pdf_path, tasks)):
+            found_tables += len(found)
+            for page_num, t in found:
+                md = self.table_to_markdown(t)
+                if md:
+                    yield {
+                        "heading": f"Table (Page {page_num})",
+                        "content": md,
+                        "type": "table"
+                    }
+        logger.debug("Extracted %d tables from %d pages of %s", found_tables, len(pages), pdf_path)
+
+
+    def process_file(self, pdf_path):
+        """Text blocks under their headings, then tables."""
+        return list(self.iter_file(pdf_path))
+
+
+    def iter_file(self, pdf_path):
+        """
+        Streaming variant of process_file: text blocks are yielded page range by page range.
+        Headings are blocks larger than 1.2x the running average font size, so only
+        one page range of blocks is held in memory at a time.
+        """
+        heading = "Introduction"
+        font_total, font_count = 0.0, 0
+        table_pages = []
+
+        for blocks, pages in timed_iter("pdf_text", self._iter_scan(pdf_path)):
+            table_pages.extend(pages)
+            font_total += sum(b["font"] for b in blocks)
+            font_count += len(blocks)
+            avg_font = font_total / font_count if font_count else 0.0
+            for blk in blocks:
+                if blk["font"] > avg_font * 1.2:  # detect heading
+                    heading = blk["text"]
+                else:
+                    # blocks of one heading are packed into chunks by BaseProcessor
+                    yield {"heading": heading, "content": blk["text"], "type": "text"}
+        logger.debug("Extracted text of %s, %d pages flagged for the table pass", pdf_path, len(table_pages))
+
+        # table pass only on pages that look like they contain one
+        if table_pages:
+            yield from self.iter_tables(pdf_path, pages=table_pages)
+
+
+    def table_to_markdown(self, table_rows):
+        """pdfplumber table (list of rows of cell strings) -> markdown."""
         rows = []
-        for blk in table_blocks:
-            row = re.split(r'\s{2,}', blk["text"].strip())  # split on large gaps
-            rows.append("| " + " | ".join(row) + " |")
+        for row in table_rows:
+            cells = [(c or "").strip().replace("\n", " ") for c in row]
+            if any(cells):
+                rows.append("| " + " | ".join(cells) + " |")
         return "\n".join(rows)
@@ -3,10 +3,14 @@ import re
 
 class TextProcessor:
     def detect_sections(self, lines):
+        return list(self.iter_sections(lines))
+
+
+    def iter_sections(self, lines):
         """
         Identify sections based on uppercase headings, numbered headings, or blank lines.
+        Yields sections as soon as they are complete.
         """
-        sections = []
         current_heading = "Introduction"
         buffer = []
 
@@ -18,29 +22,29 @@ class TextProcessor:
             if re.match(r"^[A-Z0-9 ._-]{4,}$", clean_line) and len(clean_line.split()) < 10:
                 # Save previous section
                 if buffer:
-                    sections.append({"heading": current_heading, "content": "\n".join(buffer).strip(), "type": "text"})
+                    yield {"heading": current_heading, "content": "\n".join(buffer).strip(), "type": "text"}
                     buffer = []
                 current_heading = clean_line
             elif clean_line == "":
                 if buffer:
-                    sections.append({"heading": current_heading, "content": "\n".join(buffer).strip(), "type": "text"})
+                    yield {"heading": current_heading, "content": "\n".join(buffer).strip(), "type": "text"}
                     buffer = []
             else:
                 buffer.append(clean_line)
 
         # Add remaining text
         if buffer:
-            sections.append({"heading": current_heading, "content": "\n".join(buffer).strip(), "type": "text"})
-        return sections
+            yield {"heading": current_heading, "content": "\n".join(buffer).strip(), "type": "text"}
 
 
     def process_file(self, file_path):
         """
         Perform context-aware chunking for plain text files.
         """
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            
-        sections = self.detect_sections(lines)
+        return list(self.iter_file(file_path))
 
-        return sections
+
+    def iter_file(self, file_path):
+        """Stream sections while reading the file line by line."""
+        with open(file_path, "r", encoding="utf-8") as f:
+            yield from self.iter_sections(f)
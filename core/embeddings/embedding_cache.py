@@ -0,0 +1,153 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from config.settings import (
+    EMBED_CACHE_DIR,
+    EMBED_CACHE_MEMORY_ITEMS,
+    EMBED_CACHE_DISK_ITEMS,
+    EMBED_CACHE_FLUSH_SECONDS,
+)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with two tiers:
+    - memory: LRU of the most recently used vectors
+    - disk: ring buffer of vectors in an mmap'd file plus the key of every slot,
+      the oldest slot is overwritten once the file is full; written back every
+      `flush_seconds` and on flush()
+    """
+
+    def __init__(self, namespace, cache_dir = EMBED_CACHE_DIR, memory_items = EMBED_CACHE_MEMORY_ITEMS,
+                 disk_items = EMBED_CACHE_DISK_ITEMS, flush_seconds = EMBED_CACHE_FLUSH_SECONDS):
+        self.namespace = namespace
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.flush_seconds = flush_seconds
+        self.dir_path = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", namespace))
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # disk tier, opened lazily once the embedding dimension is known
+        self._vectors = None
+        self._keys = None
+        self._slots = {}
+        self._meta = None
+        self._dirty = False
+        self._flushed = time.monotonic()
+        if self.disk_items > 0 and os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json")) as f:
+                self._open_disk(json.load(f))
+
+
+    def _path(self, name):
+        return os.path.join(self.dir_path, name)
+
+
+    def _open_disk(self, meta):
+        capacity, dim = meta["capacity"], meta["dim"]
+        mode = "r+" if os.path.exists(self._path("vectors.f32")) else "w+"
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype="float32", mode=mode, shape=(capacity, dim))
+        self._keys = np.memmap(self._path("keys.bin"), dtype="uint8", mode=mode, shape=(capacity, 16))
+        self._meta = meta
+        self._slots = {self._keys[i].tobytes(): i for i in range(meta["filled"])}
+
+
+    def _write_meta(self):
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._meta, f)
+        os.replace(tmp, self._path("meta.json"))
+
+
+    def key(self, text):
+        return hashlib.blake2b(f"{self.namespace}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+
+    def _remember(self, key, vec):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+
+    def get_many(self, texts):
+        """Cached vector per text, None for misses."""
+        out = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                elif key in self._slots:
+                    vec = np.array(self._vectors[self._slots[key]])
+                    self._remember(key, vec)
+                    self.stats["disk_hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+                out.append(vec)
+        return out
+
+
+    def put_many(self, texts, vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        with self._lock:
+            if self.disk_items > 0 and self._vectors is None:
+                os.makedirs(self.dir_path, exist_ok=True)
+                self._open_disk({"capacity": self.disk_items, "dim": int(vectors.shape[1]), "cursor": 0, "filled": 0})
+            for text, vec in zip(texts, vectors):
+                key = self.key(text)
+                self._remember(key, vec)
+                if self._vectors is None or key in self._slots:
+                    continue
+                slot = self._meta["cursor"]
+                if self._meta["filled"] == self._meta["capacity"]:
+                    self._slots.pop(self._keys[slot].tobytes(), None)
+                    self.stats["disk_evictions"] += 1
+                else:
+                    self._meta["filled"] += 1
+                self._vectors[slot] = vec
+                self._keys[slot] = np.frombuffer(key, dtype="uint8")
+                self._slots[key] = slot
+                self._meta["cursor"] = (slot + 1) % self._meta["capacity"]
+                self._dirty = True
+            if self._dirty and time.monotonic() - self._flushed >= self.flush_seconds:
+                self._flush()
+
+
+    def _flush(self):
+        # vectors and keys first: meta.json never counts slots that are not on disk yet
+        self._vectors.flush()
+        self._keys.flush()
+        self._write_meta()
+        self._dirty = False
+        self._flushed = time.monotonic()
+
+
+    def flush(self):
+        """Write new disk-tier entries back now."""
+        with self._lock:
+            if self._dirty:
+                self._flush()
+
+
+    def info(self):
+        with self._lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hits = lookups - self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": len(self._slots),
+            }
@@ -1,27 +1,99 @@
+import asyncio
 import numpy as np
 from typing import List
 from .local_embeddings import LocalEmbeddings
-from .openai_embeddings import OpenAIEmbeddings
+from .openai_embeddings import OpenAIEmbeddings, PartialEmbeddingError
+from .embedding_cache import EmbeddingCache
+from .query_batcher import QueryBatcher
+from utility.metrics import span, EMBED_BATCH_SIZE
+from config.settings import EMBED_BATCH_QUERIES
 
 
 class EmbeddingManager:
 
-    def __init__(self, provider = "local", model_name = None):
+    def __init__(self, provider = "local", model_name = None, use_cache = True, batch_queries = EMBED_BATCH_QUERIES,
+                 disk_cache = True, embedder = None):
+        """embedder: ready-made backend (embed_texts/embed_query) used instead of the provider's, e.g. in benchmarks."""
         provider = provider.lower().strip()
 
-        if provider == "openai":
+        if embedder is not None:
+            self.embedder = embedder
+        elif provider == "openai":
             model_name = model_name or "text-embedding-3-small"
             self.embedder = OpenAIEmbeddings(model_name)
         elif provider == "local":
             model_name = model_name or "sentence-transformers/all-MiniLM-L6-v2"
             self.embedder = LocalEmbeddings(model_name)
+        elif provider == "onnx":
+            # optional dependencies (onnxruntime, transformers), only imported when selected
+            from .onnx_embeddings import OnnxEmbeddings
+            model_name = model_name or "sentence-transformers/all-MiniLM-L6-v2"
+            self.embedder = OnnxEmbeddings(model_name)
         else:
             raise ValueError(f"Unsupported provider: {provider}")
 
         self.provider = provider
+        self.model_name = model_name
+        # backend calls are network-bound and can be awaited instead of holding a worker thread
+        self.is_async = hasattr(self.embedder, "aembed_query")
+        self.cache = None
+        if use_cache:
+            # onnx reproduces the local model's vectors only approximately, so it gets its own namespace
+            # the disk tier is single-writer; processes sharing a cache dir must not use it
+            self.cache = EmbeddingCache(f"{provider}:{model_name}", **({} if disk_cache else {"disk_items": 0}))
+        # concurrent queries share one encode call
+        self.batcher = QueryBatcher(self.embedder.embed_texts) if batch_queries else None
 
     def embed_texts(self, texts):
-        return self.embedder.embed_texts(texts)
+        if self.cache is None or len(texts) == 0:
+            return self._embed_backend(texts)
+        vectors = self.cache.get_many(texts)
+        # unique misses, embedded by the backend in a single batch
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            try:
+                computed = np.asarray(self._embed_backend(missing), dtype="float32")
+            except PartialEmbeddingError as e:
+                # keep what was embedded, a retry of the ingest only sends the failed texts
+                ok = np.ones(len(missing), dtype=bool)
+                ok[e.failed] = False
+                self.cache.put_many([t for t, keep in zip(missing, ok) if keep], e.vectors[ok])
+                raise
+            self.cache.put_many(missing, computed)
+            by_text = dict(zip(missing, computed))
+            vectors = [by_text[t] if v is None else v for t, v in zip(texts, vectors)]
+        return np.stack(vectors).astype("float32")
+
+    def _embed_backend(self, texts):
+        EMBED_BATCH_SIZE.observe(len(texts), "texts")
+        with span("embed"):
+            return self.embedder.embed_texts(texts)
 
     def embed_query(self, query):
-        return self.embedder.embed_query(query)
+        if self.cache is not None:
+            cached = self.cache.get_many([query])[0]
+            if cached is not None:
+                return cached.reshape(1, -1)
+        # includes the wait for a shared batch, that is what the caller pays
+        with span("embed_query"):
+            if self.batcher is not None:
+                vec = self.batcher.embed(query)
+            else:
+                vec = np.asarray(self.embedder.embed_query(query), dtype="float32")
+        if self.cache is not None:
+            self.cache.put_many([query], vec)
+        return vec
+
+    async def aembed_query(self, query):
+        """embed_query for async callers: awaited on the caller's loop when the backend is async (openai), else in a thread."""
+        if not self.is_async:
+            return await asyncio.to_thread(self.embed_query, query)
+        if self.cache is not None:
+            cached = self.cache.get_many([query])[0]
+            if cached is not None:
+                return cached.reshape(1, -1)
+        with span("embed_query"):
+            vec = np.asarray(await self.embedder.aembed_query(query), dtype="float32")
+        if self.cache is not None:
+            self.cache.put_many([query], vec)
+        return vec
@@ -1,3 +1,5 @@
+import copy
+import threading
 from sentence_transformers import SentenceTransformer
 
 
@@ -5,6 +7,10 @@ class LocalEmbeddings:
 
     def __init__(self, model_name = "sentence-transformers/all-MiniLM-L6-v2"):
         self.model = SentenceTransformer(model_name)
+        # HF fast tokenizers are not re-entrant: the chunker (parse thread) counts with its
+        # own copy instead of sharing the one encode() uses on the embedding threads
+        self._count_tokenizer = copy.deepcopy(self.model.tokenizer)
+        self._count_lock = threading.Lock()
 
 
     def embed_texts(self, texts, show_progress=False):
@@ -19,3 +25,16 @@ class LocalEmbeddings:
 
     def embed_query(self, query):
         return self.model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+
+
+    def count_tokens(self, texts):
+        """Model tokens per text, without the special tokens added around them."""
+        with self._count_lock:
+            encoded = self._count_tokenizer(list(texts), add_special_tokens=False, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+    @property
+    def max_tokens(self):
+        # longer inputs are truncated by encode()
+        return self.model.get_max_seq_length() - self.model.tokenizer.num_special_tokens_to_add()
@@ -0,0 +1,197 @@
+import os
+import re
+import copy
+import json
+import logging
+import threading
+import numpy as np
+from config.settings import (
+    ONNX_CACHE_DIR,
+    ONNX_QUANTIZE,
+    ONNX_INTRA_OP_THREADS,
+    ONNX_BATCH_SIZE,
+    ONNX_PARITY_CHECK,
+)
+
+logger = logging.getLogger(__name__)
+
+# a few representative sentences for the parity check against the PyTorch model
+PARITY_TEXTS = [
+    "How do I reset my password?",
+    "The quarterly report shows a 12% increase in revenue compared to last year.",
+    "Install the package with pip and run the server on port 8000.",
+    "Table 3: Thermal limits of the controller under sustained load",
+    "FAISS builds an inverted file index over product-quantized vectors.",
+    "Ein kurzer deutscher Satz zum Testen.",
+]
+
+
+def _cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+class OnnxEmbeddings:
+    """
+    Sentence-transformers model exported to ONNX (optionally int8 dynamic-quantized)
+    and run with ONNX Runtime. Produces the same normalized, mean/CLS pooled vectors
+    as LocalEmbeddings, so both providers can serve one index.
+
+    The export happens once per model into ONNX_CACHE_DIR; later starts only load
+    the .onnx file and the tokenizer (no PyTorch needed).
+    """
+
+    def __init__(self, model_name = "sentence-transformers/all-MiniLM-L6-v2", quantize = ONNX_QUANTIZE,
+                 cache_dir = ONNX_CACHE_DIR, threads = ONNX_INTRA_OP_THREADS, batch_size = ONNX_BATCH_SIZE):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.dir_path = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        if not os.path.exists(os.path.join(self.dir_path, "meta.json")):
+            self._export()
+        with open(os.path.join(self.dir_path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        model_file = "model.int8.onnx" if quantize else "model.onnx"
+        if not os.path.exists(os.path.join(self.dir_path, model_file)):
+            self._quantize()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # one request at a time per session; parallelism comes from intra-op threads
+        options.intra_op_num_threads = threads or (os.cpu_count() or 1)
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self.session = ort.InferenceSession(
+            os.path.join(self.dir_path, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(self.dir_path)
+        # HF fast tokenizers are not re-entrant: embedding calls (ingest, query batcher) take
+        # turns on this one, the chunker counts with its own copy
+        self._tokenizer_lock = threading.Lock()
+        self._count_tokenizer = copy.deepcopy(self.tokenizer)
+        self._count_lock = threading.Lock()
+        self.parity = self.meta.get("parity", {}).get(model_file)
+        if self.parity is None and ONNX_PARITY_CHECK:
+            self.parity = self.parity_check()
+            self.meta.setdefault("parity", {})[model_file] = self.parity
+            self._write_meta()
+
+
+    def _write_meta(self):
+        tmp = os.path.join(self.dir_path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(tmp, os.path.join(self.dir_path, "meta.json"))
+
+
+    def _export(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        st = SentenceTransformer(self.model_name, device="cpu")
+        transformer = st[0].auto_model.eval()
+        pooling = st[1] if len(st) > 1 else None
+        os.makedirs(self.dir_path, exist_ok=True)
+        st.tokenizer.save_pretrained(self.dir_path)
+
+        sample = st.tokenizer(["export sample"], return_tensors="pt")
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+        dynamic = {n: {0: "batch", 1: "sequence"} for n in names}
+        dynamic["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                tuple(sample[n] for n in names),
+                os.path.join(self.dir_path, "model.onnx"),
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic,
+                opset_version=17,
+                do_constant_folding=True,
+            )
+        self.meta = {
+            "model_name": self.model_name,
+            "max_seq_length": st.max_seq_length,
+            "dim": st.get_sentence_embedding_dimension(),
+            "pooling": "cls" if pooling is not None and getattr(pooling, "pooling_mode_cls_token", False) else "mean",
+        }
+        self._write_meta()
+        logger.info("Exported %s to ONNX in %s", self.model_name, self.dir_path)
+
+
+    def _quantize(self):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        # int8 weights, activations quantized on the fly: ~4x smaller, faster matmuls on CPU
+        quantize_dynamic(
+            os.path.join(self.dir_path, "model.onnx"),
+            os.path.join(self.dir_path, "model.int8.onnx"),
+            weight_type=QuantType.QInt8,
+        )
+
+
+    def _pool(self, hidden, mask):
+        if self.meta["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = mask[..., None].astype("float32")
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+
+    def embed_texts(self, texts, show_progress=False):
+        texts = list(texts)
+        out = np.zeros((len(texts), self.meta["dim"]), dtype="float32")
+        # similar lengths per batch keep padding (wasted compute) low
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        for start in range(0, len(texts), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            with self._tokenizer_lock:
+                enc = self.tokenizer(
+                    [texts[i] for i in rows], padding=True, truncation=True,
+                    max_length=self.meta["max_seq_length"], return_tensors="np",
+                )
+            feed = {k: v.astype("int64") for k, v in enc.items() if k in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            out[rows] = self._pool(hidden, enc["attention_mask"])
+        return out
+
+
+    def embed_query(self, query):
+        return self.embed_texts([query])
+
+
+    def count_tokens(self, texts):
+        """Model tokens per text, without the special tokens added around them."""
+        with self._count_lock:
+            encoded = self._count_tokenizer(list(texts), add_special_tokens=False, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+    @property
+    def max_tokens(self):
+        return self.meta["max_seq_length"] - self.tokenizer.num_special_tokens_to_add()
+
+
+    def parity_check(self, texts = None):
+        """Cosine similarity between these vectors and the PyTorch model's, per text."""
+        from sentence_transformers import SentenceTransformer
+
+        texts = texts or PARITY_TEXTS
+        reference = SentenceTransformer(self.model_name, device="cpu").encode(
+            texts, convert_to_numpy=True, normalize_embeddings=True
+        )
+        cos = _cosine(self.embed_texts(texts), reference)
+        report = {
+            "texts": len(texts),
+            "mean_cosine": float(cos.mean()),
+            "min_cosine": float(cos.min()),
+            "max_drift": float(1 - cos.min()),
+        }
+        logger.info("ONNX parity for %s (quantized=%s): %s", self.model_name, self.quantize, report)
+        return report
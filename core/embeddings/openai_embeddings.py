@@ -1,37 +1,315 @@
-import numpy as np
+import re
+import time
+import random
 import asyncio
-import nest_asyncio
+import logging
+import threading
+import weakref
+import numpy as np
+import openai
 from openai import AsyncOpenAI
-from config.settings import OPENAI_API_KEY
+from config.settings import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_BATCH_TOKENS,
+    OPENAI_BATCH_MAX_ITEMS,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MAX_RETRIES,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_MAX,
+    OPENAI_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# input limit of the embedding models, per text
+MAX_INPUT_TOKENS = 8191
+
+# worth retrying: throttling, timeouts, dropped connections, server errors
+RETRYABLE = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+# the same for every batch (bad key, unknown model): give up on the whole call
+FATAL = (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _duration(value):
+    """Seconds of a rate-limit reset header ("1s", "6m0s", "20ms"); None if missing."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * _UNITS[unit] for n, unit in parts)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers):
+    """Seconds the server asked us to wait, if it said so."""
+    if headers is None:
+        return None
+    ms = _int(headers.get("retry-after-ms"))
+    if ms is not None:
+        return ms / 1000
+    return _duration(headers.get("retry-after"))
+
+
+class PartialEmbeddingError(RuntimeError):
+    """Some inputs could not be embedded; `vectors` has the others (rows listed in `failed` are NaN)."""
+
+    def __init__(self, vectors, failed, cause):
+        super().__init__(f"{len(failed)} of {len(vectors)} texts could not be embedded: {cause}")
+        self.vectors = vectors
+        self.failed = failed
+        self.cause = cause
+
+
+class AdaptiveConcurrency:
+    """
+    Cap on requests in flight, shared by every event loop using the client.
+    Halved on a 429 and lowered to what the rate-limit headers say still fits;
+    grows back by one after `limit` successful requests in a row (AIMD).
+    """
+
+    def __init__(self, maximum, minimum = 1, poll = 0.01):
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.limit = self.maximum
+        self.in_flight = 0
+        # no new requests before this time (monotonic), set by 429s and exhausted budgets
+        self.paused_until = 0.0
+        self._streak = 0
+        self._poll = poll
+        self._lock = threading.Lock()
+
+
+    async def acquire(self):
+        # plain lock + short sleeps: asyncio primitives are bound to one loop
+        while True:
+            with self._lock:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+            await asyncio.sleep(max(wait, self._poll))
+
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+    def on_success(self, headers, tokens):
+        remaining_requests = _int(headers.get("x-ratelimit-remaining-requests"))
+        remaining_tokens = _int(headers.get("x-ratelimit-remaining-tokens"))
+        with self._lock:
+            fits = self.limit
+            pause = 0.0
+            if remaining_requests is not None and remaining_requests < self.limit:
+                fits = remaining_requests
+                pause = _duration(headers.get("x-ratelimit-reset-requests")) or 0.0
+            if remaining_tokens is not None and tokens and remaining_tokens < tokens * self.limit:
+                # another round of batches this size would not fit the token budget
+                fits = min(fits, remaining_tokens // tokens)
+                pause = max(pause, _duration(headers.get("x-ratelimit-reset-tokens")) or 0.0)
+            if fits < self.limit:
+                self.limit = max(self.minimum, fits)
+                self._streak = 0
+                if fits < self.minimum:
+                    self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                return
+            self._streak += 1
+            if self._streak >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._streak = 0
+
+
+    def on_rate_limit(self, wait):
+        with self._lock:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._streak = 0
+            if wait:
+                self.paused_until = max(self.paused_until, time.monotonic() + wait)
+
 
 class OpenAIEmbeddings:
-    def __init__(self, model_name="text-embedding-3-small", batch_size=64):
-        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    """
+    Embeddings API client. Texts are sent in batches of at most `batch_tokens` tokens
+    (and `max_items` inputs), up to `max_concurrency` requests at a time; throttled and
+    failed requests are retried with jittered exponential backoff. `aembed_texts` and
+    `aembed_query` can be awaited from any event loop, the sync methods run on a private one.
+    """
+
+    def __init__(self, model_name="text-embedding-3-small", batch_tokens = OPENAI_BATCH_TOKENS,
+                 max_items = OPENAI_BATCH_MAX_ITEMS, max_concurrency = OPENAI_MAX_CONCURRENCY,
+                 max_retries = OPENAI_MAX_RETRIES, base_url = OPENAI_BASE_URL, api_key = OPENAI_API_KEY):
         self.model = model_name
-        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.max_items = max_items
+        self.max_retries = max_retries
+        self.base_url = base_url
+        self.api_key = api_key
+        self.limiter = AdaptiveConcurrency(max_concurrency)
+        # per input; chunks are sized to fit (see BaseProcessor)
+        self.max_tokens = MAX_INPUT_TOKENS
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failed_texts": 0}
+        # updated from the private loop and from callers' loops (aembed_*)
+        self._stats_lock = threading.Lock()
+        self.count_tokens = self._token_counter()
+        # httpx connection pools belong to the loop that opened them: one client per loop
+        self._clients = weakref.WeakKeyDictionary()
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="openai-embeddings", daemon=True).start()
+
+
+    def _token_counter(self):
+        try:
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            return lambda texts: [len(t) for t in encoding.encode_ordinary_batch(texts)]
+        except Exception:
+            # no tiktoken (or its vocabulary cannot be downloaded): ~4 characters per token
+            logger.info("tiktoken unavailable, estimating embedding batch sizes from text length")
+            return lambda texts: [len(t) // 4 + 1 for t in texts]
+
 
+    def _count(self, name, n = 1):
+        with self._stats_lock:
+            self.stats[name] += n
 
-    async def aembed(self, texts):
-        async def embed_batch(batch):
-            resp = await self.client.embeddings.create(
-                model=self.model,
-                input=batch
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            # retries are ours, so they share the backoff and the concurrency limit
+            client = self._clients[loop] = AsyncOpenAI(
+                api_key=self.api_key or None, base_url=self.base_url, max_retries=0, timeout=OPENAI_TIMEOUT
             )
-            return [item.embedding for item in resp.data]
+        return client
+
+
+    def batches(self, texts):
+        """[(start, end, tokens)]: ranges of consecutive texts within the token and item budgets."""
+        ranges, start, tokens = [], 0, 0
+        counts = self.count_tokens(texts)
+        for i, n in enumerate(counts):
+            if i > start and (tokens + n > self.batch_tokens or i - start >= self.max_items):
+                ranges.append((start, i, tokens))
+                start, tokens = i, 0
+            tokens += n
+        if start < len(texts):
+            ranges.append((start, len(texts), tokens))
+        return ranges
+
+
+    async def _request(self, texts, tokens):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries")
+                wait = retry_after(getattr(getattr(error, "response", None), "headers", None))
+                backoff = random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+                await asyncio.sleep(backoff if wait is None else wait + random.uniform(0, OPENAI_BACKOFF_BASE))
+            await self.limiter.acquire()
+            try:
+                self._count("requests")
+                raw = await self._client().embeddings.with_raw_response.create(model=self.model, input=texts)
+            except RETRYABLE as e:
+                error = e
+                if isinstance(e, openai.RateLimitError):
+                    self._count("rate_limited")
+                    self.limiter.on_rate_limit(retry_after(e.response.headers))
+                continue
+            finally:
+                self.limiter.release()
+            self.limiter.on_success(raw.headers, tokens)
+            data = sorted(raw.parse().data, key=lambda item: item.index)
+            return np.asarray([item.embedding for item in data], dtype="float32")
+        raise error
+
 
-        # Split texts into batches
-        batches = [texts[i:i+self.batch_size] for i in range(0, len(texts), self.batch_size)]
-        results = await asyncio.gather(*[embed_batch(b) for b in batches])
-        vectors = [vec for batch in results for vec in batch]
-        return np.array(vectors, dtype="float32")
+    async def _embed_range(self, texts, tokens, offset, parts, failures):
+        try:
+            parts.append((offset, await self._request(texts, tokens)))
+        except openai.BadRequestError as e:
+            if len(texts) == 1:
+                failures.append((offset, 1, e))
+                return
+            # one bad input (empty, too long) rejects the whole batch: bisect to keep the rest
+            half = len(texts) // 2
+            await self._embed_range(texts[:half], tokens // 2, offset, parts, failures)
+            await self._embed_range(texts[half:], tokens - tokens // 2, offset + half, parts, failures)
+        except FATAL:
+            raise
+        except Exception as e:
+            failures.append((offset, len(texts), e))
+
+
+    async def aembed_texts(self, texts):
+        """
+        Embed `texts` in token-budgeted batches. Batches that still fail after the retries
+        raise PartialEmbeddingError once the others are done, carrying their vectors.
+        """
+        texts = list(texts)
+        ranges = self.batches(texts)
+        parts, failures = [], []
+        pending = iter(ranges)
+
+        async def worker():
+            for start, end, tokens in pending:
+                await self._embed_range(texts[start:end], tokens, start, parts, failures)
+
+        # a worker per allowed request; the limiter decides how many actually run
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.limiter.maximum, len(ranges)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            raise
+        if failures and not parts:
+            raise failures[0][2]
+        out = np.full((len(texts), parts[0][1].shape[1] if parts else 0), np.nan, dtype="float32")
+        for offset, vectors in parts:
+            out[offset:offset + len(vectors)] = vectors
+        if failures:
+            failed = np.concatenate([np.arange(o, o + n) for o, n, _ in failures])
+            self._count("failed_texts", len(failed))
+            raise PartialEmbeddingError(out, failed, failures[0][2])
+        return out
+
+
+    async def aembed_query(self, query):
+        return await self.aembed_texts([query])
+
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
 
 
     def embed_texts(self, texts):
-        nest_asyncio.apply()
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(self.aembed(texts))
-    
+        return self._run(self.aembed_texts(texts))
+
+
     def embed_query(self, query):
-        nest_asyncio.apply()
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(self.aembed([query,]))
+        return self._run(self.aembed_query(query))
+
+
+    def info(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {**stats, "concurrency_limit": self.limiter.limit, "in_flight": self.limiter.in_flight}
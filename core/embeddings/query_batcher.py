@@ -0,0 +1,90 @@
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+from utility.metrics import EMBED_BATCH_SIZE
+from config.settings import (
+    EMBED_BATCH_MAX_SIZE,
+    EMBED_BATCH_MAX_WAIT_MS,
+)
+
+
+class QueryBatcher:
+    """
+    Gathers concurrent query-embedding requests and encodes them in one backend call.
+    A batch is flushed when it reaches max_batch items or when its oldest request
+    has waited max_wait_ms.
+    """
+
+    def __init__(self, embed_fn, max_batch = EMBED_BATCH_MAX_SIZE, max_wait_ms = EMBED_BATCH_MAX_WAIT_MS):
+        self.embed_fn = embed_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "queries": 0, "max_batch_size": 0, "queue_time_ms_total": 0.0, "queue_time_ms_max": 0.0}
+        self.batch_sizes = {}  # batch size -> number of batches
+        self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._worker.start()
+
+
+    def embed(self, query):
+        """Blocks until the batch containing `query` is encoded; returns a (1, D) array."""
+        fut = Future()
+        self._queue.put((query, fut, time.perf_counter()))
+        return fut.result()
+
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                # past the deadline only requests that are already queued join the batch
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+
+    def _record(self, batch, started):
+        with self._lock:
+            size = len(batch)
+            self.stats["batches"] += 1
+            self.stats["queries"] += size
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], size)
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            EMBED_BATCH_SIZE.observe(size, "query")
+            for _, _, enqueued in batch:
+                waited = (started - enqueued) * 1000
+                self.stats["queue_time_ms_total"] += waited
+                self.stats["queue_time_ms_max"] = max(self.stats["queue_time_ms_max"], waited)
+
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self._record(batch, started)
+            try:
+                vectors = np.asarray(self.embed_fn([q for q, _, _ in batch]), dtype="float32")
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            for i, (_, fut, _) in enumerate(batch):
+                fut.set_result(vectors[i:i + 1])
+
+
+    def info(self):
+        with self._lock:
+            batches = self.stats["batches"]
+            return {
+                **self.stats,
+                "avg_batch_size": self.stats["queries"] / batches if batches else 0.0,
+                "avg_queue_time_ms": self.stats["queue_time_ms_total"] / self.stats["queries"] if batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            }
@@ -0,0 +1,147 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from config.settings import JOB_TTL
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("parse", "chunk", "embed", "index")
+
+
+class JobStore:
+    """Ingest job state kept in Redis so it survives restarts."""
+
+    def __init__(self, redis_client, prefix = "job"):
+        self.r = redis_client
+        self.prefix = prefix
+        self.pending_key = f"{prefix}s:pending"
+
+
+    def _key(self, job_id):
+        return f"{self.prefix}:{job_id}"
+
+
+    def put(self, job):
+        job["updated"] = time.time()
+        key = self._key(job["id"])
+        if job["status"] in ("done", "failed"):
+            self.r.set(key, json.dumps(job), ex=JOB_TTL)
+            self.r.srem(self.pending_key, job["id"])
+        else:
+            self.r.set(key, json.dumps(job))
+            self.r.sadd(self.pending_key, job["id"])
+
+
+    def get(self, job_id):
+        data = self.r.get(self._key(job_id))
+        return json.loads(data) if data else None
+
+
+    def pending(self):
+        return sorted(self.r.smembers(self.pending_key))
+
+
+class IngestJobManager:
+    """
+    Runs ingest jobs on a worker pool. A job is a list of uploaded files; each
+    file goes through the parse -> chunk -> embed -> index stages of the pipeline.
+    """
+
+    def __init__(self, pipeline, pool, store, after_job = None):
+        self.pipeline = pipeline
+        self.pool = pool
+        self.store = store
+        # called with the finished job, e.g. to publish a snapshot for read replicas
+        self.after_job = after_job
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+
+    def submit(self, job_id, files, force = False):
+        """files: list of (original file name, path on disk, document id or None for the file name)."""
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "created": time.time(),
+            "files": [
+                {"file": name, "doc_id": doc_id or name, "path": path, "status": "queued", "stage": None,
+                 "chunks": 0, "error": None}
+                for name, path, doc_id in files
+            ],
+        }
+        self.store.put(job)
+        try:
+            self.pool.submit(self._run, job_id, force=force)
+        except Exception as e:
+            job["status"] = "failed"
+            for entry in job["files"]:
+                entry.update({"status": "failed", "error": str(e)})
+            self.store.put(job)
+            raise
+        return job
+
+
+    def _update(self, job):
+        with self._lock:
+            self.store.put(job)
+
+
+    def _run(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        job["status"] = "running"
+        self._update(job)
+        for entry in job["files"]:
+            if entry["status"] == "done":
+                continue
+            entry["status"] = "running"
+
+            def progress(stage, **info):
+                entry["stage"] = stage
+                entry.update(info)
+                self._update(job)
+
+            try:
+                # re-uploads under the same document id replace the document (jobs from before
+                # explicit ids have none: the file name was the id)
+                doc_id = entry.get("doc_id") or entry["file"]
+                result = self.pipeline.ingest_file(entry["path"], progress=progress, doc_id=doc_id)
+                entry["status"] = "done"
+                entry["stage"] = "done"
+                entry["chunks"] = result["ingested"]
+                entry["skipped"] = result.get("skipped", False)
+            except Exception as e:
+                logger.exception("Ingest failed for %s", entry["path"])
+                entry["status"] = "failed"
+                entry["error"] = str(e)
+            self._update(job)
+        if self.after_job is not None:
+            try:
+                self.after_job(job)
+            except Exception as e:
+                logger.exception("Post-ingest hook failed for job %s", job_id)
+                job["error"] = str(e)
+        job["status"] = "failed" if any(f["status"] == "failed" for f in job["files"]) else "done"
+        self._update(job)
+
+
+    def resume(self):
+        """Requeue jobs that were queued or running when the process stopped."""
+        for job_id in self.store.pending():
+            job = self.store.get(job_id)
+            if job is None:
+                continue
+            job["status"] = "queued"
+            for entry in job["files"]:
+                if entry["status"] != "done":
+                    entry.update({"status": "queued", "stage": None})
+            self.store.put(job)
+            self.pool.submit(self._run, job_id, force=True)
+            logger.info("Resumed ingest job %s", job_id)
@@ -1,71 +1,473 @@
 from core.embeddings.embedding_manager import EmbeddingManager
-from core.vectorstores.faiss_client import FAISSManager
-from core.retriever.bm_25_client import BM25Manager
+from core.retriever.sharded_index import ShardedFAISS, ShardedBM25
+from core.retriever.fusion import FUSION_METHODS, fuse, select_top_k
 from core.chunking.base_processor import BaseProcessor
+from core.storage.chunk_store import ChunkStore
+from core.storage import segment_store
+from core.storage.segment_store import SegmentStore, SnapshotConflict
+from core.storage.document_registry import DocumentRegistry, file_hash
+from utility.rw_lock import ReadWriteLock
+from utility.metrics import span
 from config.settings import (
     INDEX_PERSISTENCE_STORAGE_PATH,
+    INGEST_BATCH_SIZE,
+    INGEST_QUEUE_DEPTH,
+    COMPACT_MIN_SEGMENTS,
+    SNAPSHOTS_TO_KEEP,
+    FUSION_METHOD,
 )
 import os
+import queue
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class ReadOnlyPipeline(RuntimeError):
+    pass
+
 
 class ChunkerPipeline:
-    def __init__(self, embed_provider = "local", model_name = None):
-        self.processor = BaseProcessor()
-        self.embed_mgr = EmbeddingManager(provider=embed_provider, model_name=model_name)
-        self.faiss = FAISSManager()
-        self.bm25 = BM25Manager()
+    def __init__(self, embed_provider = "local", model_name = None, read_only = False, embed_mgr = None):
+        # read-only replicas only serve searches from memory-mapped snapshots, several
+        # processes may run side by side, so they keep the embedding cache in memory
+        self.read_only = read_only
+        self.embed_mgr = embed_mgr or EmbeddingManager(provider=embed_provider, model_name=model_name, disk_cache=not read_only)
+        # chunks are sized in the embedding model's own tokens, up to its input window
+        embedder = self.embed_mgr.embedder
+        self.processor = BaseProcessor(getattr(embedder, "count_tokens", None), getattr(embedder, "max_tokens", None))
+        # chunk data is stored once; both indexes refer to chunks by id
+        self.store = ChunkStore()
+        # INDEX_SHARDS dense + lexical index pairs, searched in parallel
+        self.faiss = ShardedFAISS(self.store)
+        self.bm25 = ShardedBM25(self.store)
+        # doc_id -> content hash and chunk ids of the indexed version
+        self.documents = DocumentRegistry()
+        # searches share the indexes, ingest/load mutate them exclusively
+        self.lock = ReadWriteLock()
+        # chunks [0, persisted) are in the active snapshot on disk
+        self.persisted = 0
+        # manifest version currently loaded, None until the first load/save
+        self.generation = None
+        self._save_lock = threading.Lock()
+        self._compacting = threading.Lock()
+
+
+    @staticmethod
+    def _put(q, item, stop):
+        # give up once another stage failed, so nobody blocks on a full queue forever
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+    @staticmethod
+    def _drain(q, stop, idle = None):
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                if idle is not None:
+                    idle()
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ReadOnlyPipeline("Pipeline is a read-only replica")
+
+
+    def ingest_file(self, file_path, progress = None, doc_id = None):
+        """
+        Streams parse -> embed -> index in micro-batches of INGEST_BATCH_SIZE chunks,
+        with bounded queues between the stages so memory stays flat for large files
+        and parsing, embedding and indexing overlap.
+        doc_id: stable document id (defaults to the file name). Re-ingesting an
+        unchanged document is skipped; a changed one replaces its previous chunks.
+        The new chunks stay hidden from search until the whole document is indexed.
+        progress: optional callback(stage, **info), called from this thread only: "parse" once,
+        then "chunk", "embed" and "index" whenever that stage's count moves (the stages overlap).
+        """
+        self._check_writable()
+        progress = progress or (lambda stage, **info: None)
+        doc_id = doc_id or os.path.basename(file_path)
+        content_hash = file_hash(file_path)
+        if self.documents.is_unchanged(doc_id, content_hash):
+            return {"ingested": 0, "doc_id": doc_id, "skipped": True}
+        parsed = queue.Queue(maxsize=INGEST_QUEUE_DEPTH)
+        embedded = queue.Queue(maxsize=INGEST_QUEUE_DEPTH)
+        stop = threading.Event()
+        errors = []
+        counts = {"parsed": 0, "embedded": 0}
+
+        def parse_stage():
+            try:
+                batch = []
+                for chunk in self.processor.iter_file(file_path):
+                    batch.append(chunk)
+                    if len(batch) >= INGEST_BATCH_SIZE:
+                        counts["parsed"] += len(batch)
+                        if not self._put(parsed, batch, stop):
+                            return
+                        batch = []
+                if batch:
+                    counts["parsed"] += len(batch)
+                    self._put(parsed, batch, stop)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                self._put(parsed, _DONE, stop)
+
+        def embed_stage():
+            try:
+                for batch in self._drain(parsed, stop):
+                    embeddings = self.embed_mgr.embed_texts([c["content"] for c in batch])
+                    counts["embedded"] += len(batch)
+                    if not self._put(embedded, (batch, embeddings), stop):
+                        return
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                self._put(embedded, _DONE, stop)
+
+        workers = [
+            threading.Thread(target=parse_stage, name="ingest-parse", daemon=True),
+            threading.Thread(target=embed_stage, name="ingest-embed", daemon=True),
+        ]
+        indexed = 0
+        new_ids = []
+        reported = {}
+
+        def report():
+            # the parse and embed threads only count, their progress is reported from here
+            for stage, key in (("chunk", "parsed"), ("embed", "embedded")):
+                if counts[key] != reported.get(key):
+                    reported[key] = counts[key]
+                    progress(stage, parsed=counts["parsed"], embedded=counts["embedded"], chunks=indexed)
+
+        progress("parse")
+        for w in workers:
+            w.start()
+        try:
+            for batch, embeddings in self._drain(embedded, stop, idle=report):
+                report()
+                with self.lock.write():
+                    ids = self.store.add(batch)
+                    self.store.hide(ids)
+                    new_ids.extend(ids)
+                    with span("faiss_add"):
+                        self.faiss.add(embeddings, ids)
+                    # append only the new chunks to the BM25 inverted index
+                    with span("bm25_add"):
+                        self.bm25.add(ids, [c["content"] for c in batch])
+                indexed += len(batch)
+                progress("index", parsed=counts["parsed"], embedded=counts["embedded"], chunks=indexed)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # stages still blocked on a queue give up once stop is set
+            if errors:
+                stop.set()
+            for w in workers:
+                w.join()
+        with self.lock.write():
+            if errors:
+                # drop the partial version, the previous one stays searchable
+                self._delete_ids(new_ids)
+                self.store.show(new_ids)
+                raise errors[0]
+            # swap versions: the old chunks stop matching in the same step the new ones become visible
+            old = self.documents.put(doc_id, content_hash, os.path.basename(file_path), new_ids)
+            replaced = self._delete_ids(DocumentRegistry.chunk_ids(old))
+            self.store.show(new_ids)
+        return {"ingested": indexed, "doc_id": doc_id, "replaced": int(len(replaced))}
+
+
+    def _delete_ids(self, ids):
+        """Tombstone chunk ids in the store and both indexes; caller holds the write lock."""
+        ids = self.store.delete(ids)
+        self.faiss.remove(ids)
+        self.bm25.delete(ids)
+        return ids
 
 
-    def ingest_file(self, file_path):
-        chunks = self.processor.process_file(file_path)
-        texts = [c["content"] for c in chunks]
-        embeddings = self.embed_mgr.embed_texts(texts)
-        self.faiss.add(embeddings, chunks)
-        # rebuild BM25 from all metadata (simple approach)
-        self.bm25.build(self.faiss.metadata)
-        return {"ingested": len(chunks)}
+    def delete_document(self, doc_id):
+        """Remove a document's chunks from search; returns the number of chunks removed, None if unknown."""
+        self._check_writable()
+        with self.lock.write():
+            old = self.documents.remove(doc_id)
+            if old is None:
+                return None
+            return int(len(self._delete_ids(DocumentRegistry.chunk_ids(old))))
 
 
-    def query_faiss(self, q, top_k = 5):
+    def query_faiss(self, q, top_k = 5, nprobe = None, ef_search = None):
         qvec = self.embed_mgr.embed_query(q)
-        return self.faiss.search(qvec, top_k=top_k)
+        with self.lock.read(), span("faiss_search"):
+            return self.faiss.search(qvec, top_k=top_k, nprobe=nprobe, ef_search=ef_search)
 
 
     def query_bm25(self, q, top_k = 5):
-        return self.bm25.query(q, top_k=top_k)
+        with self.lock.read(), span("bm25_query"):
+            return self.bm25.query(q, top_k=top_k)
 
 
-    def query_deep(self, q, faiss_k = 500, rerank_k = 10, alpha=0.6):
+    def query_deep(self, q, faiss_k = 500, rerank_k = 10, alpha=0.6, nprobe = None, ef_search = None, qvec = None,
+                   fusion = FUSION_METHOD):
         """
         Deep flow: FAISS retrieve faiss_k -> BM25 rerank on those candidates -> return top rerank_k
         alpha: weight for FAISS score (0..1), (1-alpha) for BM25
+        nprobe / ef_search: per-request recall/latency knobs for IVF / HNSW indexes
+        qvec: query embedding, when the caller already has it
+        fusion: how the two score lists are combined, see core.retriever.fusion
         """
-        qvec = self.embed_mgr.embed_query(q)
-        dense = self.faiss.index.search(qvec.astype("float32"), faiss_k)
-        D, I = dense  # squared similarities (IP since normalized)
-        candidate_idxs = [int(i) for i in I[0] if i != -1]
-        # Build local subset for BM25 scoring
-        subset_meta = [self.faiss.metadata[i] for i in candidate_idxs]
-        # BM25 on subset
-        tmp_bm25 = BM25Manager()
-        tmp_bm25.build(subset_meta)
-        bm25_results = tmp_bm25.query(q, top_k=len(subset_meta))
-        # Merge scores: find bm25 score map (by content)
-        bm25_score_map = { (r["content"]): r["score"] for r in bm25_results }
-        merged = []
-        for idx_pos, (idx, sim) in enumerate(zip(candidate_idxs, D[0])):
-            meta = self.faiss.metadata[idx]
-            bm25_score = bm25_score_map.get(meta["content"], 0.0)
-            combined = alpha * float(sim) + (1 - alpha) * float(bm25_score)
-            merged.append({"heading": meta["heading"], "content": meta["content"], "type": meta["type"], "score": combined})
-        merged_sorted = sorted(merged, key=lambda x: x["score"], reverse=True)[:rerank_k]
-        return merged_sorted
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unsupported fusion method: {fusion}")
+        if qvec is None:
+            qvec = self.embed_mgr.embed_query(q)
+        with self.lock.read():
+            return self._query_deep(q, qvec, faiss_k, rerank_k, alpha, nprobe, ef_search, fusion)
+
+
+    def _query_deep(self, q, qvec, faiss_k, rerank_k, alpha, nprobe, ef_search, fusion):
+        # similarities (IP since normalized)
+        with span("faiss_search"):
+            D, I = self.faiss.search_ids(qvec, faiss_k, nprobe=nprobe, ef_search=ef_search)
+        # BM25 on the candidates, scored against the global corpus statistics
+        with span("bm25_query"):
+            bm25_scores = self.bm25.score_candidates(q, I)
+        with span("fusion"):
+            combined = fuse([D, bm25_scores], [alpha, 1 - alpha], fusion)
+            ids, scores = select_top_k(I, combined, rerank_k)
+        # result dicts only for the survivors
+        return [{**self.store.get(idx), "score": float(score)} for idx, score in zip(ids, scores)]
 
 
     def save(self, dir_path=INDEX_PERSISTENCE_STORAGE_PATH):
-        self.faiss.save(dir_path)
-        self.bm25.save(os.path.join(dir_path, "bm25.pkl"))
+        """
+        Write the chunks, deletions and document changes since the last save as one
+        new segment and activate a snapshot that includes it. Cost is proportional to the delta.
+        Raises SnapshotConflict when the snapshot on disk is not the one this pipeline extends.
+        """
+        self._check_writable()
+        if self.embed_mgr.cache is not None:
+            self.embed_mgr.cache.flush()
+        segments = SegmentStore(dir_path)
+        with self._save_lock:
+            with self.lock.read():
+                start, end = self.persisted, len(self.store)
+                deleted = self.store.deleted_delta()
+                documents = self.documents.delta()
+                manifest = segments.current()
+                if (manifest["chunks"] if manifest else 0) != start:
+                    # someone else saved meanwhile, or this pipeline never loaded the snapshot:
+                    # appending would give the manifest overlapping segments
+                    raise SnapshotConflict(
+                        f"Snapshot on disk has {manifest['chunks'] if manifest else 0} chunks, "
+                        f"this pipeline has {start} saved; load the snapshot first"
+                    )
+                if manifest is not None and manifest["chunks"] == end and not len(deleted) and not documents:
+                    return manifest
+                name, tmp = segments.new_segment_dir()
+                self.store.write(tmp, start, end)
+                vectors = self.faiss.delta()
+                if vectors is None:
+                    vectors = (np.zeros(0, dtype="int64"), np.zeros((0, 0), dtype="float32"))
+                segment_store.write_vectors(tmp, *vectors)
+                segment_store.write_postings(tmp, self.bm25.delta() or segment_store.empty_postings())
+                segment_store.write_deleted(tmp, deleted)
+                segment_store.write_documents(tmp, documents)
+                entry = segments.publish(name, tmp, start, end - start, analyzer=self.bm25.analyzer.version)
+                manifest = segments.append(entry)
+                self.faiss.clear_delta()
+                self.bm25.clear_delta()
+                self.store.clear_deleted_delta()
+                self.documents.clear_delta()
+                self.persisted = end
+                self.generation = manifest["version"]
+            if self.faiss.rescoring:
+                # rescore from the segment file from now on, the in-memory copies are released;
+                # only mmaps, but searches must not see the swap half done
+                with self.lock.write():
+                    self.faiss.vectors.add(*segment_store.read_vectors(segments.segment_path(name)))
+            segments.prune(SNAPSHOTS_TO_KEEP)
+        if len(manifest["segments"]) >= COMPACT_MIN_SEGMENTS:
+            threading.Thread(target=self._background_compact, args=(dir_path,), daemon=True).start()
+        return manifest
+
+
+    @staticmethod
+    def _open_segments(segments, manifest):
+        """Chunk store, document registry and per-segment deletions of a snapshot."""
+        store = ChunkStore()
+        documents = DocumentRegistry()
+        paths, deleted = [], []
+        for seg in manifest["segments"]:
+            path = segments.segment_path(seg["name"])
+            store.attach(path)
+            documents.apply(segment_store.read_documents(path))
+            paths.append(path)
+            deleted.append(segment_store.read_deleted(path))
+        # tombstones may point into any earlier segment, apply them once every part is attached
+        for ids in deleted:
+            store.delete(ids)
+        store.clear_deleted_delta()
+        documents.clear_delta()
+        return store, documents, paths, deleted
+
+
+    def load(self, dir_path=INDEX_PERSISTENCE_STORAGE_PATH, mmap = None):
+        """
+        Open the active snapshot: chunk columns, postings and the compacted BM25 index are
+        memory-mapped, nothing is re-tokenized unless the postings were written by a
+        different analyzer version.
+        mmap: also map the compacted FAISS indexes read-only (default for read-only replicas),
+        so processes serving the same snapshot share one copy in the page cache.
+        """
+        mmap = self.read_only if mmap is None else mmap
+        segments = SegmentStore(dir_path)
+        manifest = segments.current()
+        if manifest is None:
+            raise FileNotFoundError("No saved snapshot found")
+        store, documents, paths, deleted = self._open_segments(segments, manifest)
+        faiss_mgr = ShardedFAISS(store)
+        bm25 = ShardedBM25(store)
+        stale = self._stale_postings(manifest, bm25)
+        vector_parts, index_dir, base_vectors = [], None, None
+        for i, (seg, path) in enumerate(zip(manifest["segments"], paths)):
+            # saved indexes are only reusable with the shard layout they were built for
+            reusable = i == 0 and seg.get("shards", 1) == faiss_mgr.n_shards
+            if stale:
+                pass
+            elif reusable and seg.get("bm25_index"):
+                bm25.load(path)
+            else:
+                bm25.load_segment(segment_store.read_postings(path))
+            if reusable and seg.get("faiss_index"):
+                index_dir = path
+                # compressed indexes rescore with the segment's float vectors (mapped, not read)
+                base_vectors = segment_store.read_vectors(path) if faiss_mgr.rescoring else None
+            else:
+                vector_parts.append(segment_store.read_vectors(path))
+        faiss_mgr.load_segments(vector_parts, index_dir, mmap=mmap, base_vectors=base_vectors)
+        if index_dir:
+            # the saved index predates deletions recorded in later segments
+            faiss_mgr.remove(np.concatenate(deleted[1:] + [np.zeros(0, dtype="int64")]))
+        if stale:
+            logger.info("BM25 postings were written by another analyzer, re-tokenizing %d chunks", len(store))
+            bm25.build()
+            # already saved as chunks; compaction rewrites the postings
+            bm25.clear_delta()
+        else:
+            bm25.delete(store.deleted_ids())
+            bm25.compact()
+        with self.lock.write():
+            self.store, self.faiss, self.bm25, self.documents = store, faiss_mgr, bm25, documents
+            self.persisted = len(store)
+            self.generation = manifest["version"]
+        if stale and not self.read_only:
+            threading.Thread(target=self._background_compact, args=(dir_path,), daemon=True).start()
+        return manifest
+
+
+    @staticmethod
+    def _stale_postings(manifest, bm25):
+        return any(seg.get("analyzer") != bm25.analyzer.version for seg in manifest["segments"])
+
+
+    def compact(self, dir_path=INDEX_PERSISTENCE_STORAGE_PATH):
+        """
+        Merge the segments of the active snapshot into one segment that also carries
+        a ready-to-load FAISS index; deleted chunks are physically dropped from the
+        postings, vectors and chunk content. Only reads immutable files, so it can
+        run while the pipeline keeps serving and ingesting.
+        """
+        self._check_writable()
+        segments = SegmentStore(dir_path)
+        manifest = segments.current()
+        first = manifest["segments"][0] if manifest else {}
+        if manifest is None or (len(manifest["segments"]) == 1 and first.get("faiss_index")
+                                and first.get("bm25_index") and first.get("shards", 1) == self.faiss.n_shards
+                                and not self._stale_postings(manifest, self.bm25)):
+            return manifest
+        store, documents, paths, _ = self._open_segments(segments, manifest)
+        name, tmp = segments.new_segment_dir()
+        store.write(tmp, drop_deleted=True)
+        parts = []
+        for ids, v in (segment_store.read_vectors(p) for p in paths):
+            live = store.is_live(ids)
+            if live.any():
+                parts.append((ids[live], v[live]))
+        dim = parts[0][1].shape[1] if parts else 0
+        vectors = np.lib.format.open_memmap(
+            os.path.join(tmp, "vectors.npy"), mode="w+", dtype="float32",
+            shape=(sum(len(ids) for ids, _ in parts), dim),
+        )
+        offset = 0
+        for _, v in parts:
+            vectors[offset:offset + len(v)] = v
+            offset += len(v)
+        vectors.flush()
+        vector_ids = np.concatenate([ids for ids, _ in parts] + [np.zeros(0, dtype="int64")])
+        np.save(os.path.join(tmp, "vectors.ids.npy"), vector_ids)
+        bm25 = ShardedBM25(store)
+        if self._stale_postings(manifest, bm25):
+            bm25.build()
+            postings = bm25.delta() or segment_store.empty_postings()
+        else:
+            postings = segment_store.merge_postings([segment_store.read_postings(p) for p in paths])
+            postings = segment_store.drop_postings(postings, store.is_live)
+            bm25.load_segment(postings)
+        segment_store.write_postings(tmp, postings)
+        bm25.save(tmp)
+        # ids stay reserved, so the tombstones are carried over (they no longer cost index space)
+        segment_store.write_deleted(tmp, store.deleted_ids())
+        segment_store.write_documents(tmp, documents.docs)
+        has_index = len(vectors) > 0
+        if has_index:
+            faiss_mgr = ShardedFAISS(store)
+            faiss_mgr.load_segments([(vector_ids, vectors)])
+            faiss_mgr.save(tmp)
+        entry = segments.publish(name, tmp, 0, len(store), faiss_index=has_index, bm25_index=True,
+                                 shards=self.faiss.n_shards, analyzer=bm25.analyzer.version)
+        manifest = segments.replace_prefix([seg["name"] for seg in manifest["segments"]], entry)
+        segments.prune(SNAPSHOTS_TO_KEEP)
+        return manifest
+
+
+    def _background_compact(self, dir_path):
+        if not self._compacting.acquire(blocking=False):
+            return
+        try:
+            self.compact(dir_path)
+        except Exception:
+            logger.exception("Segment compaction failed")
+        finally:
+            self._compacting.release()
+
+
+    def snapshots(self, dir_path=INDEX_PERSISTENCE_STORAGE_PATH):
+        return SegmentStore(dir_path).snapshots()
 
 
-    def load(self, dir_path=INDEX_PERSISTENCE_STORAGE_PATH):
-        self.faiss.load(dir_path)
-        self.bm25.load(os.path.join(dir_path, "bm25.pkl"))
+    def rollback(self, version, dir_path=INDEX_PERSISTENCE_STORAGE_PATH):
+        """Activate an older snapshot and load it; unsaved chunks are dropped."""
+        self._check_writable()
+        SegmentStore(dir_path).rollback(version)
+        return self.load(dir_path)
@@ -0,0 +1,72 @@
+import re
+from functools import lru_cache
+from config.settings import BM25_STEM, BM25_STOPWORDS, BM25_TOKEN_CACHE
+
+# bump when the tokenization rules change: saved postings with another version get rebuilt
+ANALYZER_VERSION = 1
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it its me my no not
+of on or our she so than that the their them then there these they this to too was we were what
+when where which who will with you your
+""".split())
+
+_WORD = re.compile(r"\w+")
+_VOWEL = re.compile(r"[aeiouy]")
+
+
+def light_stem(term):
+    """Conservative English suffix stripping (plurals, -ing, -ed, -ly); never touches short terms."""
+    if len(term) <= 3 or not term.isalpha():
+        return term
+    if term.endswith("sses"):
+        return term[:-2]
+    if term.endswith("ies") and len(term) > 4:
+        return term[:-3] + "y"
+    if term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        return term[:-1]
+    for suffix, min_len in (("ing", 6), ("ed", 5), ("ly", 6)):
+        if term.endswith(suffix) and len(term) >= min_len:
+            stem = term[:-len(suffix)]
+            if not _VOWEL.search(stem):
+                return term
+            # running -> run, stopped -> stop
+            if suffix != "ly" and len(stem) > 3 and stem[-1] == stem[-2] and stem[-1] not in "lsz":
+                stem = stem[:-1]
+            return stem
+    return term
+
+
+class Analyzer:
+    """
+    BM25 text analysis: lowercase, split on anything that is not a word character
+    (punctuation never sticks to terms), optionally drop stopwords and stem.
+    Per-token normalization is cached, most tokens of a corpus repeat.
+    """
+
+    def __init__(self, stem = BM25_STEM, stopwords = BM25_STOPWORDS, cache_size = BM25_TOKEN_CACHE):
+        self.stem = stem
+        self.stopwords = stopwords
+        self.version = f"{ANALYZER_VERSION}:{'stem' if stem else 'nostem'}:{'stop' if stopwords else 'nostop'}"
+        # raw token -> term, or None for a dropped stopword
+        self._normalize = lru_cache(maxsize=cache_size)(self._normalize_token)
+
+
+    def _normalize_token(self, token):
+        if self.stopwords and token in STOPWORDS:
+            return None
+        return light_stem(token) if self.stem else token
+
+
+    def tokenize(self, text):
+        normalize = self._normalize
+        return [t for t in map(normalize, _WORD.findall(text.lower())) if t is not None]
+
+
+    def info(self):
+        hits = self._normalize.cache_info()
+        return {"version": self.version, "token_cache_hits": hits.hits, "token_cache_misses": hits.misses}
+
+
+# shared by every BM25 shard, so they also share the token cache
+ANALYZER = Analyzer()
@@ -1,51 +1,314 @@
-from rank_bm25 import BM25Okapi
-import numpy as np
-import pickle
 import os
+import json
+import numpy as np
+import scipy.sparse as sp
+import threading
+from core.retriever.analyzer import ANALYZER
+from utility.metrics import span
+from config.settings import BM25_TOMBSTONE_RATIO
+
+# arrays of a saved index (see save/load); the CSR arrays are memory-mapped on load
+INDEX_ARRAYS = ("indptr", "indices", "tf", "weights", "idf", "doc_lens", "indexed")
 
 class BM25Manager:
 
-    def __init__(self):
-        self.corpus = []     # texts
-        self.meta = []      # metadata parallel to corpus
-        self.bm25 = None
+    def __init__(self, store, k1 = 1.5, b = 0.75, analyzer = ANALYZER):
+        self.k1 = k1
+        self.b = b
+        self.analyzer = analyzer
+        # chunk data lives in the shared ChunkStore; matrix column i is chunk id i
+        self.store = store
+        self.doc_count = 0      # documents indexed
+        self.n_cols = 0         # matrix width: highest chunk id + 1
+        self.total_len = 0
+        self.vocab = {}     # term -> row in the term-document matrix
+        self.terms = []     # row -> term
+        self.doc_lens = np.zeros(0, dtype="float32")
+        self.idf = np.zeros(0, dtype="float32")
+        # chunk ids whose postings are in the matrix
+        self._indexed = np.zeros(0, dtype=bool)
+        # deleted chunk ids still in the postings until compact(); queries skip them
+        self.tombstones = 0
+        self._tombstoned = []
+        # blocks (rows, cols, tfs, doc ids, doc lens) appended since the last refresh
+        self._pending = []
+        # blocks added since the last save, see delta()
+        self._unsaved = []
+        # term-document matrix of raw term frequencies (terms x docs, CSR)
+        self._tf = sp.csr_matrix((0, 0), dtype="float32")
+        # BM25 weights sharing the sparsity structure of self._tf
+        self._weights = None
+        # concurrent readers may trigger the lazy refresh at the same time
+        self._refresh_lock = threading.Lock()
+
+
+    def _tokenize(self, text):
+        return self.analyzer.tokenize(text)
+
+
+    def _term_id(self, term):
+        tid = self.vocab.get(term)
+        if tid is None:
+            tid = self.vocab[term] = len(self.terms)
+            self.terms.append(term)
+        return tid
+
+
+    def _append_block(self, block):
+        rows, cols, tfs, doc_ids, lens = block
+        if not len(doc_ids):
+            return
+        self._pending.append(block)
+        self.doc_count += len(doc_ids)
+        self.total_len += int(lens.sum())
+        self.n_cols = max(self.n_cols, int(doc_ids.max()) + 1)
+        self._weights = None
+
+
+    def add(self, ids, texts):
+        """Append new chunks to the index; cost grows with the new chunks only."""
+        rows, cols, tfs, lens = [], [], [], []
+        for doc_idx, text in zip(ids, texts):
+            tokens = self._tokenize(text)
+            counts = {}
+            for t in tokens:
+                tid = self._term_id(t)
+                counts[tid] = counts.get(tid, 0) + 1
+            rows.extend(counts.keys())
+            cols.extend([doc_idx] * len(counts))
+            tfs.extend(counts.values())
+            lens.append(len(tokens))
+        block = (
+            np.asarray(rows, dtype="int64"),
+            np.asarray(cols, dtype="int64"),
+            np.asarray(tfs, dtype="float32"),
+            np.asarray(ids, dtype="int64"),
+            np.asarray(lens, dtype="float32"),
+        )
+        self._append_block(block)
+        self._unsaved.append(block)
+
+
+    def delta(self):
+        """
+        Postings of the chunks added since the last save, with row ids re-numbered
+        against the returned `terms` list so the delta is self-contained.
+        """
+        if not self._unsaved:
+            return None
+        rows, cols, tfs, doc_ids, lens = (np.concatenate(c) for c in zip(*self._unsaved))
+        used, local_rows = np.unique(rows, return_inverse=True)
+        return {
+            "terms": [self.terms[i] for i in used],
+            "rows": local_rows.astype("int32"),
+            "cols": cols,
+            "tfs": tfs,
+            "doc_ids": doc_ids,
+            "doc_lens": lens,
+        }
+
+
+    def clear_delta(self):
+        self._unsaved = []
+
+
+    def load_segment(self, data):
+        """Append postings written from `delta()` without re-tokenizing."""
+        mapping = np.array([self._term_id(t) for t in data["terms"]], dtype="int64")
+        rows = mapping[data["rows"]] if len(mapping) else np.zeros(0, dtype="int64")
+        self._append_block((
+            rows,
+            np.asarray(data["cols"], dtype="int64"),
+            np.asarray(data["tfs"], dtype="float32"),
+            np.asarray(data["doc_ids"], dtype="int64"),
+            np.asarray(data["doc_lens"], dtype="float32"),
+        ))
+
 
+    def build(self):
+        """Full rebuild from the chunk store."""
+        self.__init__(self.store, k1=self.k1, b=self.b, analyzer=self.analyzer)
+        ids = np.flatnonzero(self.store.is_live(np.arange(len(self.store))))
+        self.add(ids, (self.store.content(i) for i in ids))
 
-    def build(self, metadata):
-        self.meta = metadata.copy()
-        self.corpus = [m["content"] for m in self.meta]
-        tokenized = [c.split() for c in self.corpus]
-        self.bm25 = BM25Okapi(tokenized)
+
+    def _refresh(self):
+        """Fold pending chunks into the CSR matrix and recompute the BM25 weights."""
+        if self._weights is not None:
+            return
+        with self._refresh_lock:
+            if self._weights is None:
+                with span("bm25_build"):
+                    self._rebuild_weights()
+
+
+    def _rebuild_weights(self):
+        shape = (len(self.vocab), self.n_cols)
+        self._tf.resize(shape)
+        doc_lens = np.zeros(self.n_cols, dtype="float32")
+        doc_lens[:len(self.doc_lens)] = self.doc_lens
+        indexed = np.zeros(self.n_cols, dtype=bool)
+        indexed[:len(self._indexed)] = self._indexed
+        if self._pending:
+            rows, cols, tfs, doc_ids, lens = (np.concatenate(c) for c in zip(*self._pending))
+            delta = sp.csr_matrix((tfs, (rows, cols)), shape=shape)
+            self._tf = (self._tf + delta).tocsr()
+            doc_lens[doc_ids] = lens
+            indexed[doc_ids] = True
+        self.doc_lens = doc_lens
+        self._indexed = indexed
+        self._pending = []
+
+        n = self.doc_count
+        avgdl = self.total_len / n if n else 0.0
+        df = np.diff(self._tf.indptr).astype("float32")
+        idf = self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype("float32")
+        term_of_entry = np.repeat(np.arange(len(df)), np.diff(self._tf.indptr))
+        tf = self._tf.data
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lens[self._tf.indices] / (avgdl or 1.0))
+        data = idf[term_of_entry] * tf * (self.k1 + 1) / (tf + norm)
+        self._weights = sp.csr_matrix((data.astype("float32"), self._tf.indices, self._tf.indptr), shape=shape)
+
+
+    def delete(self, ids):
+        """
+        Tombstone chunk ids: they stop matching right away, their postings are
+        dropped by compact(), which runs once tombstones exceed BM25_TOMBSTONE_RATIO.
+        """
+        ids = np.asarray(ids, dtype="int64")
+        if not len(ids):
+            return
+        self._tombstoned.append(ids)
+        self.tombstones += len(ids)
+        if self.tombstones > BM25_TOMBSTONE_RATIO * self.doc_count:
+            self.compact()
+
+
+    def compact(self):
+        """Physically remove the postings of tombstoned chunks and update corpus statistics."""
+        if not self._tombstoned:
+            return
+        self._refresh()
+        ids = np.unique(np.concatenate(self._tombstoned))
+        ids = ids[ids < self.n_cols]
+        removed = ids[self._indexed[ids]]
+        self._tombstoned = []
+        self.tombstones = 0
+        if not len(removed):
+            # e.g. tombstones a loaded index had already dropped; keep the mapped arrays
+            return
+        self.doc_count -= len(removed)
+        self.total_len -= int(self.doc_lens[removed].sum())
+        self.doc_lens[removed] = 0
+        self._indexed[removed] = False
+        dead = np.zeros(self.n_cols, dtype=bool)
+        dead[removed] = True
+        self._tf.data[dead[self._tf.indices]] = 0
+        self._tf.eliminate_zeros()
+        self._weights = None
+
+
+    def save(self, dir_path):
+        """
+        Write the compacted index (CSR term frequencies and BM25 weights, IDF, document
+        lengths) as plain .npy arrays plus the term list, so `load` maps it without
+        re-tokenizing or rebuilding anything.
+        """
+        self.compact()
+        self._refresh()
+        os.makedirs(dir_path, exist_ok=True)
+        index_dtype = "int32" if max(self._tf.nnz, self.n_cols) < 2 ** 31 else "int64"
+        arrays = {
+            "indptr": self._tf.indptr.astype(index_dtype),
+            "indices": self._tf.indices.astype(index_dtype),
+            "tf": self._tf.data.astype("float32"),
+            "weights": self._weights.data.astype("float32"),
+            "idf": self.idf,
+            "doc_lens": self.doc_lens,
+            "indexed": self._indexed,
+        }
+        for key, value in arrays.items():
+            np.save(os.path.join(dir_path, f"{key}.npy"), value)
+        with open(os.path.join(dir_path, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f)
+        meta = {
+            "doc_count": self.doc_count, "n_cols": self.n_cols, "total_len": self.total_len,
+            "k1": self.k1, "b": self.b, "analyzer": self.analyzer.version,
+        }
+        with open(os.path.join(dir_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+
+    def load(self, dir_path):
+        """
+        Replace the index with one written by `save`. Arrays are mapped copy-on-write:
+        pages are shared with other processes until a later add/delete touches them.
+        """
+        with open(os.path.join(dir_path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["analyzer"] != self.analyzer.version:
+            raise ValueError(f"Index built with analyzer {meta['analyzer']}, expected {self.analyzer.version}")
+        with open(os.path.join(dir_path, "terms.json"), encoding="utf-8") as f:
+            terms = json.load(f)
+        a = {key: np.load(os.path.join(dir_path, f"{key}.npy"), mmap_mode="c") for key in INDEX_ARRAYS}
+        self.__init__(self.store, k1=meta["k1"], b=meta["b"], analyzer=self.analyzer)
+        self.terms = terms
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.doc_count, self.n_cols, self.total_len = meta["doc_count"], meta["n_cols"], meta["total_len"]
+        self.doc_lens, self.idf, self._indexed = a["doc_lens"], a["idf"], a["indexed"]
+        shape = (len(terms), self.n_cols)
+        self._tf = sp.csr_matrix((a["tf"], a["indices"], a["indptr"]), shape=shape, copy=False)
+        self._weights = sp.csr_matrix((a["weights"], a["indices"], a["indptr"]), shape=shape, copy=False)
+
+
+    def _query_vector(self, q):
+        tids = [self.vocab[t] for t in self._tokenize(q) if t in self.vocab]
+        if not tids:
+            return None
+        counts = np.bincount(tids, minlength=len(self.vocab)).astype("float32")
+        return sp.csr_matrix(counts.reshape(1, -1))
+
+
+    def query_ids(self, q, top_k = 10):
+        """Raw (scores, chunk ids) arrays of the top_k matches, best first."""
+        empty = np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+        if not self.doc_count:
+            return empty
+        self._refresh()
+        qv = self._query_vector(q)
+        if qv is None:
+            return empty
+        # sparse row gather + sum: only documents sharing a term are touched
+        res = (qv @ self._weights).tocsr()
+        scores, docs = res.data, res.indices
+        if self.tombstones or self.store.hidden_count:
+            live = self.store.is_visible(docs)
+            scores, docs = scores[live], docs[live]
+        if len(scores) > top_k:
+            part = np.argpartition(-scores, top_k - 1)[:top_k]
+            scores, docs = scores[part], docs[part]
+        order = np.argsort(-scores)
+        return scores[order], docs[order].astype("int64")
 
 
     def query(self, q, top_k = 10):
-        if self.bm25 is None:
-            return []
-        scores = self.bm25.get_scores(q.split())
-        idxs = np.argsort(scores)[::-1][:top_k]
-        results = []
-        for i in idxs:
-            results.append({
-                "heading": self.meta[i].get("heading"),
-                "content": self.meta[i].get("content"),
-                "type": self.meta[i].get("type"),
-                "score": float(scores[i])
-            })
-        return results
-
-
-    def save(self, path):
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "wb") as f:
-            pickle.dump({"meta": self.meta, "corpus": self.corpus}, f)
-
-
-    def load(self, path):
-        if not os.path.exists(path):
-            raise FileNotFoundError("bm25 not found")
-        with open(path, "rb") as f:
-            data = pickle.load(f)
-        self.meta = data["meta"]
-        self.corpus = data["corpus"]
-        tokenized = [c.split() for c in self.corpus]
-        self.bm25 = BM25Okapi(tokenized)
+        scores, docs = self.query_ids(q, top_k)
+        return [{**self.store.get(idx), "score": float(score)} for score, idx in zip(scores, docs)]
+
+
+    def score_candidates(self, q, doc_idxs):
+        """
+        BM25 scores for the given doc indices only, using corpus-wide statistics.
+        Returns a float32 array aligned with doc_idxs.
+        """
+        doc_idxs = np.asarray(doc_idxs, dtype="int64")
+        if not self.doc_count or len(doc_idxs) == 0:
+            return np.zeros(len(doc_idxs), dtype="float32")
+        self._refresh()
+        tids = [self.vocab[t] for t in self._tokenize(q) if t in self.vocab]
+        if not tids:
+            return np.zeros(len(doc_idxs), dtype="float32")
+        terms, counts = np.unique(tids, return_counts=True)
+        # gather the query-term rows first, then restrict to the candidate columns
+        sub = self._weights[terms][:, doc_idxs]
+        return np.asarray(sub.T @ counts.astype("float32"), dtype="float32").ravel()
@@ -0,0 +1,66 @@
+import numpy as np
+
+FUSION_METHODS = ("rrf", "minmax", "zscore", "raw")
+
+
+def minmax(scores):
+    scores = np.asarray(scores, dtype="float32")
+    if not len(scores):
+        return scores
+    lo, hi = scores.min(), scores.max()
+    if hi - lo < 1e-12:
+        # all equal: no signal to rank by
+        return np.zeros_like(scores) if hi <= 0 else np.ones_like(scores)
+    return (scores - lo) / (hi - lo)
+
+
+def zscore(scores):
+    scores = np.asarray(scores, dtype="float32")
+    if not len(scores):
+        return scores
+    std = scores.std()
+    if std < 1e-12:
+        return np.zeros_like(scores)
+    return (scores - scores.mean()) / std
+
+
+def ranks(scores):
+    """1-based rank of every score, best (highest) first."""
+    scores = np.asarray(scores)
+    out = np.empty(len(scores), dtype="float32")
+    out[np.argsort(-scores, kind="stable")] = np.arange(1, len(scores) + 1, dtype="float32")
+    return out
+
+
+def rrf(score_lists, weights = None, k = 60):
+    """Weighted reciprocal-rank fusion: sum of w / (k + rank)."""
+    weights = weights or [1.0] * len(score_lists)
+    return sum(w / (k + ranks(s)) for w, s in zip(weights, score_lists)).astype("float32")
+
+
+def linear(score_lists, weights, norm = "minmax"):
+    """Weighted sum of per-list normalized scores (norm: "minmax", "zscore" or "raw")."""
+    normalize = {"minmax": minmax, "zscore": zscore, "raw": lambda s: np.asarray(s, dtype="float32")}[norm]
+    return sum(w * normalize(s) for w, s in zip(weights, score_lists)).astype("float32")
+
+
+def fuse(score_lists, weights, method = "minmax"):
+    """
+    Combine aligned score arrays (one per retriever, same candidate order).
+    method: "rrf", "minmax", "zscore" or "raw" (unnormalized weighted sum).
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unsupported fusion method: {method}")
+    if method == "rrf":
+        return rrf(score_lists, weights)
+    return linear(score_lists, weights, method)
+
+
+def select_top_k(ids, scores, k):
+    """(ids, scores) of the k best, best first; only the survivors get sorted."""
+    ids, scores = np.asarray(ids), np.asarray(scores)
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[part], scores[part]
+    order = np.argsort(-scores, kind="stable")
+    return ids[order], scores[order]
@@ -0,0 +1,112 @@
+import random
+import threading
+import faiss
+import numpy as np
+from collections import OrderedDict
+from config.settings import (
+    SEMANTIC_CACHE_ITEMS,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_SAMPLE_RATE,
+)
+
+
+def normalize_query(q):
+    """
+    Whitespace insensitive form of a query, searched and cached as is. Case and
+    punctuation are kept: they can change the meaning ("C++ error" vs "C error").
+    """
+    return " ".join(q.split())
+
+
+class SemanticQueryCache:
+    """
+    Results of recent queries, looked up by embedding similarity so paraphrases of a
+    cached query are answered without searching. One small flat inner-product index
+    per namespace (endpoint + parameters + index generation); entries are evicted
+    least recently used across all namespaces.
+
+    A sample of hits is re-computed to measure how often the threshold lets a
+    different-meaning query through (false hits).
+    """
+
+    def __init__(self, capacity = SEMANTIC_CACHE_ITEMS, threshold = SEMANTIC_CACHE_THRESHOLD,
+                 sample_rate = SEMANTIC_CACHE_SAMPLE_RATE):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.stats = {"lookups": 0, "hits": 0, "evictions": 0, "sampled": 0, "false_hits": 0}
+        self._indexes = {}
+        # entry id -> (namespace, query, result), in LRU order
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def _unit(vec):
+        vec = np.asarray(vec, dtype="float32").reshape(1, -1)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+
+    def lookup(self, namespace, query_vec):
+        """(cached query, result, similarity) of the closest cached query above the threshold, else None."""
+        with self._lock:
+            self.stats["lookups"] += 1
+            index = self._indexes.get(namespace)
+            if index is None or index.ntotal == 0:
+                return None
+            D, I = index.search(self._unit(query_vec), 1)
+            if I[0][0] < 0 or D[0][0] < self.threshold:
+                return None
+            entry_id = int(I[0][0])
+            self._entries.move_to_end(entry_id)
+            self.stats["hits"] += 1
+            _, query, result = self._entries[entry_id]
+            return query, result, float(D[0][0])
+
+
+    def insert(self, namespace, query, query_vec, result):
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                vec = self._unit(query_vec)
+                index = self._indexes[namespace] = faiss.IndexIDMap2(faiss.IndexFlatIP(vec.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(self._unit(query_vec), np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (namespace, query, result)
+            while len(self._entries) > self.capacity:
+                old_id, (old_ns, _, _) = self._entries.popitem(last=False)
+                old_index = self._indexes[old_ns]
+                old_index.remove_ids(np.array([old_id], dtype="int64"))
+                if old_index.ntotal == 0:
+                    del self._indexes[old_ns]
+                self.stats["evictions"] += 1
+
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+
+    def record_check(self, cached_results, fresh_results):
+        """Compare a served hit with a fresh search; little overlap counts as a false hit."""
+        cached = {r["content"] for r in cached_results}
+        fresh = {r["content"] for r in fresh_results}
+        overlap = len(cached & fresh) / max(len(cached | fresh), 1)
+        with self._lock:
+            self.stats["sampled"] += 1
+            if overlap < 0.5:
+                self.stats["false_hits"] += 1
+        return overlap
+
+
+    def info(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0,
+                "false_hit_rate": self.stats["false_hits"] / self.stats["sampled"] if self.stats["sampled"] else 0.0,
+                "items": len(self._entries),
+                "namespaces": len(self._indexes),
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,269 @@
+import os
+import heapq
+import threading
+import numpy as np
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from core.vectorstores.faiss_client import FAISSManager
+from core.vectorstores.float_vectors import FloatVectors
+from core.retriever.bm_25_client import BM25Manager
+from core.storage import segment_store
+from config.settings import INDEX_SHARDS, SHARD_WORKERS
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+        return _executor
+
+
+def fan_out(fn, shards, *args):
+    """fn(shard, *args) on every shard in parallel (FAISS and NumPy release the GIL), results in shard order."""
+    if len(shards) == 1:
+        return [fn(shards[0], *args)]
+    return [f.result() for f in [_pool().submit(fn, shard, *args) for shard in shards]]
+
+
+def merge_top_k(results, top_k):
+    """Heap-merge per-shard (scores, ids) lists that are sorted best first."""
+    if len(results) == 1:
+        return results[0][0][:top_k], results[0][1][:top_k]
+    merged = list(islice(heapq.merge(*(zip(-s, i) for s, i in results)), top_k))
+    if not merged:
+        return np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+    neg, ids = zip(*merged)
+    return -np.asarray(neg, dtype="float32"), np.asarray(ids, dtype="int64")
+
+
+def shard_of(ids, n_shards):
+    """Routing: chunk id modulo the shard count, balanced and stable across restarts."""
+    return np.asarray(ids, dtype="int64") % n_shards
+
+
+def index_file(shard, n_shards):
+    return "faiss.index" if n_shards == 1 else f"faiss.{shard}.index"
+
+
+def bm25_dir(shard, n_shards):
+    return "bm25" if n_shards == 1 else f"bm25.{shard}"
+
+
+class ShardedFAISS:
+    """N FAISSManager shards over the shared ChunkStore, searched in parallel."""
+
+    def __init__(self, store, n_shards = INDEX_SHARDS, **kwargs):
+        self.store = store
+        self.n_shards = n_shards
+        # one full-precision vector store for all shards, so segment files are mapped once
+        self.vectors = FloatVectors()
+        self.shards = [FAISSManager(store, vectors=self.vectors, **kwargs) for _ in range(n_shards)]
+        self.rescoring = self.shards[0].rescoring
+
+
+    def ntotal(self):
+        return sum(s.ntotal() for s in self.shards)
+
+
+    def _split(self, ids):
+        ids = np.asarray(ids, dtype="int64")
+        route = shard_of(ids, self.n_shards)
+        return [np.flatnonzero(route == i) for i in range(self.n_shards)]
+
+
+    def add(self, embeddings, ids):
+        ids = np.asarray(ids, dtype="int64")
+        parts = [(shard, embeddings[rows], ids[rows]) for shard, rows in zip(self.shards, self._split(ids)) if len(rows)]
+        fan_out(lambda part: part[0].add(part[1], part[2]), parts)
+
+
+    def remove(self, ids):
+        ids = np.asarray(ids, dtype="int64")
+        for shard, rows in zip(self.shards, self._split(ids)):
+            shard.remove(ids[rows])
+
+
+    def migrate(self, index_type = None):
+        fan_out(FAISSManager.migrate, self.shards, index_type)
+
+
+    def delta(self):
+        parts = [d for d in (s.delta() for s in self.shards) if d is not None]
+        if not parts:
+            return None
+        ids = np.concatenate([p[0] for p in parts])
+        vectors = np.concatenate([p[1] for p in parts])
+        order = np.argsort(ids, kind="stable")
+        return ids[order], vectors[order]
+
+
+    def clear_delta(self):
+        for s in self.shards:
+            s.clear_delta()
+
+
+    def load_segments(self, vector_parts, index_dir = None, mmap = False, base_vectors = None):
+        """
+        vector_parts: (ids, vectors) per segment, routed to the owning shard.
+        index_dir: directory with one saved index per shard (see save).
+        mmap: map the saved indexes read-only, see FAISSManager.load_segments.
+        base_vectors: (ids, vectors) the saved indexes were built from, for rescoring.
+        """
+        if self.rescoring:
+            # whole segment files, still mapped; the shards only add the codes
+            for ids, vectors in ([base_vectors] if base_vectors else []) + list(vector_parts):
+                self.vectors.add(ids, vectors)
+        per_shard = [[] for _ in self.shards]
+        for ids, vectors in vector_parts:
+            for i, rows in enumerate(self._split(ids)):
+                if len(rows):
+                    per_shard[i].append((ids[rows], vectors[rows]))
+        paths = [
+            os.path.join(index_dir, index_file(i, self.n_shards)) if index_dir else None
+            for i in range(self.n_shards)
+        ]
+        paths = [p if p and os.path.exists(p) else None for p in paths]
+        fan_out(lambda i: self.shards[i].load_segments(per_shard[i], paths[i], mmap), list(range(self.n_shards)))
+
+
+    def memory_info(self):
+        info = {"index_type": self.shards[0].index_type, "code_bytes": sum(s.memory_info()["code_bytes"] for s in self.shards)}
+        if self.rescoring:
+            info.update(self.vectors.info())
+        return info
+
+
+    def search_ids(self, query_vec, top_k = 5, nprobe = None, ef_search = None):
+        results = fan_out(FAISSManager.search_ids, self.shards, query_vec, top_k, nprobe, ef_search)
+        return merge_top_k(results, top_k)
+
+
+    def search(self, query_vec, top_k = 5, nprobe = None, ef_search = None):
+        D, I = self.search_ids(query_vec, top_k, nprobe, ef_search)
+        return [{**self.store.get(idx), "score": float(score)} for score, idx in zip(D, I)]
+
+
+    def save(self, dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+        for i, shard in enumerate(self.shards):
+            if shard.index is not None:
+                shard.save(dir_path, index_file(i, self.n_shards))
+        return dir_path
+
+
+class ShardedBM25:
+    """
+    N BM25Manager shards over the shared ChunkStore. Each shard scores with its
+    own corpus statistics, which stay close to the global ones since routing by
+    chunk id spreads every document evenly over the shards.
+    """
+
+    def __init__(self, store, n_shards = INDEX_SHARDS):
+        self.store = store
+        self.n_shards = n_shards
+        self.shards = [BM25Manager(store) for _ in range(n_shards)]
+
+
+    @property
+    def doc_count(self):
+        return sum(s.doc_count for s in self.shards)
+
+
+    @property
+    def analyzer(self):
+        return self.shards[0].analyzer
+
+
+    def _split(self, ids):
+        route = shard_of(ids, self.n_shards)
+        return [np.flatnonzero(route == i) for i in range(self.n_shards)]
+
+
+    def add(self, ids, texts):
+        ids = np.asarray(ids, dtype="int64")
+        texts = list(texts)
+        for shard, rows in zip(self.shards, self._split(ids)):
+            if len(rows):
+                shard.add(ids[rows], [texts[r] for r in rows])
+
+
+    def delete(self, ids):
+        ids = np.asarray(ids, dtype="int64")
+        for shard, rows in zip(self.shards, self._split(ids)):
+            shard.delete(ids[rows])
+
+
+    def compact(self):
+        for s in self.shards:
+            s.compact()
+
+
+    def build(self):
+        for s in self.shards:
+            s.__init__(self.store, k1=s.k1, b=s.b)
+        ids = np.flatnonzero(self.store.is_live(np.arange(len(self.store))))
+        self.add(ids, [self.store.content(i) for i in ids])
+
+
+    def delta(self):
+        parts = [d for d in (s.delta() for s in self.shards) if d is not None]
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else segment_store.merge_postings(parts)
+
+
+    def clear_delta(self):
+        for s in self.shards:
+            s.clear_delta()
+
+
+    def load_segment(self, data):
+        if self.n_shards == 1:
+            self.shards[0].load_segment(data)
+            return
+        entries = self._split(data["cols"])
+        docs = self._split(data["doc_ids"])
+        for shard, rows, doc_rows in zip(self.shards, entries, docs):
+            # only the terms this shard's postings use
+            used, local_rows = np.unique(np.asarray(data["rows"])[rows], return_inverse=True)
+            shard.load_segment({
+                "terms": [data["terms"][t] for t in used],
+                "rows": local_rows,
+                "cols": np.asarray(data["cols"])[rows],
+                "tfs": np.asarray(data["tfs"])[rows],
+                "doc_ids": np.asarray(data["doc_ids"])[doc_rows],
+                "doc_lens": np.asarray(data["doc_lens"])[doc_rows],
+            })
+
+
+    def save(self, dir_path):
+        for i, s in enumerate(self.shards):
+            s.save(os.path.join(dir_path, bm25_dir(i, self.n_shards)))
+
+
+    def load(self, dir_path):
+        for i, s in enumerate(self.shards):
+            s.load(os.path.join(dir_path, bm25_dir(i, self.n_shards)))
+
+
+    def query_ids(self, q, top_k = 10):
+        return merge_top_k(fan_out(BM25Manager.query_ids, self.shards, q, top_k), top_k)
+
+
+    def query(self, q, top_k = 10):
+        scores, docs = self.query_ids(q, top_k)
+        return [{**self.store.get(idx), "score": float(score)} for score, idx in zip(scores, docs)]
+
+
+    def score_candidates(self, q, doc_idxs):
+        doc_idxs = np.asarray(doc_idxs, dtype="int64")
+        out = np.zeros(len(doc_idxs), dtype="float32")
+        split = [(shard, rows) for shard, rows in zip(self.shards, self._split(doc_idxs)) if len(rows)]
+        scores = fan_out(lambda part: part[0].score_candidates(q, doc_idxs[part[1]]), split)
+        for (_, rows), s in zip(split, scores):
+            out[rows] = s
+        return out
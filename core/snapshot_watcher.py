@@ -0,0 +1,58 @@
+import logging
+import threading
+from core.storage.segment_store import SegmentStore
+from config.settings import INDEX_PERSISTENCE_STORAGE_PATH, SNAPSHOT_POLL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotWatcher:
+    """
+    Keeps a read-only pipeline on the newest snapshot: polls CURRENT and, when the
+    writer activated a new generation, loads it. `pipeline.load` builds the new
+    indexes aside and swaps them in under the write lock, so searches see either
+    the old or the new generation, never a mix.
+    """
+
+    def __init__(self, pipeline, dir_path = INDEX_PERSISTENCE_STORAGE_PATH, interval = SNAPSHOT_POLL_SECONDS):
+        self.pipeline = pipeline
+        self.segments = SegmentStore(dir_path)
+        self.dir_path = dir_path
+        self.interval = interval
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def check(self):
+        """Load the active snapshot if it is newer than the loaded one; True when it reloaded."""
+        version = self.segments.current_version()
+        if version is None or version == self.pipeline.generation:
+            return False
+        self.pipeline.load(self.dir_path)
+        self.reloads += 1
+        logger.info("Loaded snapshot generation %s", version)
+        return True
+
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # e.g. segments pruned while loading; the next poll picks up the newer snapshot
+                logger.exception("Snapshot reload failed")
+
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="snapshot-watcher", daemon=True)
+            self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+
+
+    def info(self):
+        return {"generation": self.pipeline.generation, "reloads": self.reloads, "interval": self.interval}
@@ -0,0 +1,272 @@
+import os
+import json
+import numpy as np
+from array import array
+from bisect import bisect_right
+
+
+class _Part:
+    """
+    A contiguous range of chunk ids [start, start + len) stored column-wise:
+    content as one UTF-8 blob plus offsets, headings and types as ids into
+    small interned string tables.
+    """
+
+    def __init__(self, start, offsets, blob, heading_ids, headings, type_ids, types):
+        self.start = start
+        self.offsets = offsets
+        self.blob = blob
+        self.heading_ids = heading_ids
+        self.headings = headings
+        self.type_ids = type_ids
+        self.types = types
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, i):
+        return {
+            "heading": self.headings[self.heading_ids[i]],
+            "content": bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8"),
+            "type": self.types[self.type_ids[i]],
+        }
+
+
+class _TailPart(_Part):
+    """Growable in-memory part that receives new chunks."""
+
+    def __init__(self, start):
+        super().__init__(start, array("q", [0]), bytearray(), array("i"), [], array("b"), [])
+        self._heading_idx = {}
+        self._type_idx = {}
+
+    def _intern(self, value, table, idx):
+        i = idx.get(value)
+        if i is None:
+            i = idx[value] = len(table)
+            table.append(value)
+        return i
+
+    def append(self, chunk):
+        data = chunk.get("content", "").encode("utf-8")
+        self.blob.extend(data)
+        self.offsets.append(len(self.blob))
+        self.heading_ids.append(self._intern(chunk.get("heading", "Document"), self.headings, self._heading_idx))
+        self.type_ids.append(self._intern(chunk.get("type", "text"), self.types, self._type_idx))
+
+
+class ChunkStore:
+    """
+    Single source of chunk data shared by the FAISS and BM25 indexes, which
+    refer to chunks by integer id (position in the store). Persisted parts are
+    memory-mapped on load; new chunks are appended to an in-memory tail.
+    Ids are never reused: deleted chunks keep their id and are tombstoned.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._starts = []
+        self._tail = _TailPart(0)
+        # tombstones by chunk id, grown on demand
+        self._deleted = np.zeros(0, dtype=bool)
+        self.deleted_count = 0
+        # ids deleted since the last save, see deleted_delta()
+        self._unsaved_deleted = []
+        # chunks of a document still being ingested: indexed, but kept out of search results
+        self._hidden = np.zeros(0, dtype=bool)
+        self.hidden_count = 0
+
+
+    def __len__(self):
+        return self._tail.start + len(self._tail)
+
+
+    def add(self, chunks):
+        """Append chunks, returns their ids."""
+        first = len(self)
+        for c in chunks:
+            self._tail.append(c)
+        return list(range(first, len(self)))
+
+
+    def _locate(self, chunk_id):
+        if chunk_id < 0 or chunk_id >= len(self):
+            raise IndexError(f"chunk id {chunk_id} out of range")
+        if chunk_id >= self._tail.start:
+            return self._tail, chunk_id - self._tail.start
+        part = self._parts[bisect_right(self._starts, chunk_id) - 1]
+        return part, chunk_id - part.start
+
+
+    def get(self, chunk_id):
+        part, i = self._locate(int(chunk_id))
+        return part.get(i)
+
+
+    def content(self, chunk_id):
+        return self.get(chunk_id)["content"]
+
+
+    def delete(self, ids):
+        """Tombstone chunk ids; returns the ids that were live."""
+        ids = np.unique(np.asarray(ids, dtype="int64"))
+        ids = ids[self.is_live(ids)]
+        if not len(ids):
+            return ids
+        self._deleted = self._grown(self._deleted, ids[-1])
+        self._deleted[ids] = True
+        self.deleted_count += len(ids)
+        self._unsaved_deleted.append(ids)
+        return ids
+
+
+    def _grown(self, mask, max_id):
+        if max_id < len(mask):
+            return mask
+        grown = np.zeros(max(len(self), 2 * len(mask)), dtype=bool)
+        grown[:len(mask)] = mask
+        return grown
+
+
+    def hide(self, ids):
+        """Keep chunk ids out of search results until show(); they are live otherwise."""
+        ids = np.unique(np.asarray(ids, dtype="int64"))
+        if not len(ids):
+            return
+        self._hidden = self._grown(self._hidden, ids[-1])
+        self.hidden_count += int(len(ids) - np.count_nonzero(self._hidden[ids]))
+        self._hidden[ids] = True
+
+
+    def show(self, ids):
+        ids = np.unique(np.asarray(ids, dtype="int64"))
+        ids = ids[ids < len(self._hidden)]
+        self.hidden_count -= int(np.count_nonzero(self._hidden[ids]))
+        self._hidden[ids] = False
+
+
+    def is_live(self, ids):
+        """Boolean mask: chunk id exists and is not deleted."""
+        ids = np.asarray(ids, dtype="int64")
+        live = (ids >= 0) & (ids < len(self))
+        known = live & (ids < len(self._deleted))
+        live[known] = ~self._deleted[ids[known]]
+        return live
+
+
+    def is_visible(self, ids):
+        """is_live without the hidden chunks: what a search may return."""
+        live = self.is_live(ids)
+        if self.hidden_count:
+            ids = np.asarray(ids, dtype="int64")
+            known = live & (ids < len(self._hidden))
+            live[known] = ~self._hidden[ids[known]]
+        return live
+
+
+    def live_count(self):
+        return len(self) - self.deleted_count
+
+
+    def deleted_ids(self, start = 0, end = None):
+        end = len(self) if end is None else end
+        return np.flatnonzero(self._deleted[start:end]) + start
+
+
+    def deleted_delta(self):
+        """Ids deleted since the last save."""
+        if not self._unsaved_deleted:
+            return np.zeros(0, dtype="int64")
+        return np.concatenate(self._unsaved_deleted)
+
+
+    def clear_deleted_delta(self):
+        self._unsaved_deleted = []
+
+
+    def _columns(self, start, end):
+        """Columns for ids [start, end) re-encoded against fresh string tables."""
+        offsets, blobs, heading_ids, type_ids = [np.zeros(1, dtype="int64")], [], [], []
+        headings, types, heading_idx, type_idx = [], [], {}, {}
+        base = 0
+        for part in self._parts + [self._tail]:
+            lo, hi = max(start, part.start), min(end, part.start + len(part))
+            if lo >= hi:
+                continue
+            a, b = lo - part.start, hi - part.start
+            part_offsets = np.asarray(part.offsets[a:b + 1], dtype="int64")
+            blobs.append(bytes(part.blob[part_offsets[0]:part_offsets[-1]]))
+            offsets.append(part_offsets[1:] - part_offsets[0] + base)
+            base += int(part_offsets[-1] - part_offsets[0])
+            heading_map = np.array([heading_idx.setdefault(h, len(heading_idx)) for h in part.headings], dtype="int32")
+            type_map = np.array([type_idx.setdefault(t, len(type_idx)) for t in part.types], dtype="int8")
+            heading_ids.append(heading_map[np.asarray(part.heading_ids[a:b], dtype="int64")] if b > a else np.zeros(0, "int32"))
+            type_ids.append(type_map[np.asarray(part.type_ids[a:b], dtype="int64")] if b > a else np.zeros(0, "int8"))
+        headings = list(heading_idx)
+        types = list(type_idx)
+        return {
+            "offsets": np.concatenate(offsets),
+            "blob": b"".join(blobs),
+            "heading_ids": np.concatenate(heading_ids) if heading_ids else np.zeros(0, "int32"),
+            "type_ids": np.concatenate(type_ids) if type_ids else np.zeros(0, "int8"),
+            "headings": headings,
+            "types": types,
+        }
+
+
+    def write(self, dir_path, start = 0, end = None, drop_deleted = False):
+        """
+        Write ids [start, end) as a columnar part into dir_path. With drop_deleted
+        the content of tombstoned chunks is left out (their ids stay reserved).
+        """
+        end = len(self) if end is None else end
+        cols = self._columns(start, end)
+        if drop_deleted and self.deleted_count:
+            live = self.is_live(np.arange(start, end))
+            lengths = np.diff(cols["offsets"])
+            cols["blob"] = np.frombuffer(cols["blob"], dtype="uint8")[np.repeat(live, lengths)].tobytes()
+            lengths[~live] = 0
+            cols["offsets"] = np.concatenate([[0], np.cumsum(lengths)]).astype("int64")
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, "chunks.blob"), "wb") as f:
+            f.write(cols["blob"])
+        np.save(os.path.join(dir_path, "chunks.offsets.npy"), cols["offsets"])
+        np.save(os.path.join(dir_path, "chunks.headings.npy"), cols["heading_ids"])
+        np.save(os.path.join(dir_path, "chunks.types.npy"), cols["type_ids"])
+        with open(os.path.join(dir_path, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"start": start, "count": end - start, "headings": cols["headings"], "types": cols["types"]}, f)
+
+
+    def attach(self, dir_path):
+        """Memory-map a part written by `write`; it must start where the store currently ends."""
+        with open(os.path.join(dir_path, "chunks.json"), encoding="utf-8") as f:
+            info = json.load(f)
+        if len(self._tail):
+            raise RuntimeError("Cannot attach a part after unsaved chunks")
+        if info["start"] != len(self):
+            raise RuntimeError(f"Part starts at {info['start']}, store ends at {len(self)}")
+        blob_path = os.path.join(dir_path, "chunks.blob")
+        blob = np.memmap(blob_path, dtype="uint8", mode="r") if os.path.getsize(blob_path) else b""
+        part = _Part(
+            info["start"],
+            np.load(os.path.join(dir_path, "chunks.offsets.npy"), mmap_mode="r"),
+            blob,
+            np.load(os.path.join(dir_path, "chunks.headings.npy"), mmap_mode="r"),
+            info["headings"],
+            np.load(os.path.join(dir_path, "chunks.types.npy"), mmap_mode="r"),
+            info["types"],
+        )
+        self._parts.append(part)
+        self._starts.append(part.start)
+        self._tail = _TailPart(part.start + len(part))
+
+
+    def save(self, dir_path):
+        self.write(dir_path)
+
+
+    def load(self, dir_path):
+        if not os.path.exists(os.path.join(dir_path, "chunks.json")):
+            raise FileNotFoundError("chunk store not found")
+        self.__init__()
+        self.attach(dir_path)
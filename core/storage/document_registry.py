@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import numpy as np
+
+
+def file_hash(file_path, block_size = 1 << 20):
+    """sha256 of a file, read in blocks."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DocumentRegistry:
+    """
+    Maps a stable document id to the content hash and the chunk ids of its
+    current version. Chunk ids are kept as [start, end) ranges since an
+    ingest appends its chunks in a few contiguous batches.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        # doc_id -> entry (or None for deletions) changed since the last save
+        self._unsaved = {}
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        return len(self.docs)
+
+
+    def get(self, doc_id):
+        return self.docs.get(doc_id)
+
+
+    def is_unchanged(self, doc_id, content_hash):
+        entry = self.docs.get(doc_id)
+        return entry is not None and entry["hash"] == content_hash
+
+
+    @staticmethod
+    def ranges(ids):
+        """Sorted chunk ids -> list of [start, end) ranges."""
+        ids = np.asarray(ids, dtype="int64")
+        if not len(ids):
+            return []
+        breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+        starts = np.concatenate([[ids[0]], ids[breaks]])
+        ends = np.concatenate([ids[breaks - 1], [ids[-1]]]) + 1
+        return [[int(a), int(b)] for a, b in zip(starts, ends)]
+
+
+    @staticmethod
+    def chunk_ids(entry):
+        if not entry or not entry["ranges"]:
+            return np.zeros(0, dtype="int64")
+        return np.concatenate([np.arange(a, b, dtype="int64") for a, b in entry["ranges"]])
+
+
+    def put(self, doc_id, content_hash, file_name, ids):
+        """Record the new version of a document; returns the previous entry."""
+        entry = {"hash": content_hash, "file": file_name, "ranges": self.ranges(sorted(ids)), "chunks": len(ids)}
+        with self._lock:
+            old = self.docs.get(doc_id)
+            self.docs[doc_id] = entry
+            self._unsaved[doc_id] = entry
+        return old
+
+
+    def remove(self, doc_id):
+        with self._lock:
+            old = self.docs.pop(doc_id, None)
+            if old is not None:
+                self._unsaved[doc_id] = None
+        return old
+
+
+    def delta(self):
+        with self._lock:
+            return dict(self._unsaved)
+
+
+    def clear_delta(self):
+        with self._lock:
+            self._unsaved = {}
+
+
+    def apply(self, changes):
+        """Replay the changes of a persisted segment."""
+        for doc_id, entry in changes.items():
+            if entry is None:
+                self.docs.pop(doc_id, None)
+            else:
+                self.docs[doc_id] = entry
+
+
+    def list(self):
+        with self._lock:
+            items = list(self.docs.items())
+        return [{"doc_id": doc_id, "file": e["file"], "hash": e["hash"], "chunks": e["chunks"]} for doc_id, e in items]
@@ -0,0 +1,306 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# one lock per index directory, shared by every SegmentStore of the process
+_ROOT_LOCKS = {}
+_ROOT_LOCKS_GUARD = threading.Lock()
+
+
+def _root_lock(root):
+    with _ROOT_LOCKS_GUARD:
+        return _ROOT_LOCKS.setdefault(os.path.realpath(root), threading.Lock())
+
+
+class SnapshotConflict(RuntimeError):
+    """The active snapshot does not end where the segment being saved starts."""
+
+
+def _fsync_write(path, text):
+    # unique, so concurrent writers never share (and rename away) each other's temp file
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+POSTING_ARRAYS = ("rows", "cols", "tfs", "doc_ids", "doc_lens")
+
+
+def empty_postings():
+    return {
+        "terms": [], "rows": np.zeros(0, "int32"), "cols": np.zeros(0, "int64"),
+        "tfs": np.zeros(0, "float32"), "doc_ids": np.zeros(0, "int64"), "doc_lens": np.zeros(0, "float32"),
+    }
+
+
+def write_postings(seg_dir, data):
+    """BM25 postings of a segment: one .npy per array plus the term list."""
+    for key in POSTING_ARRAYS:
+        np.save(os.path.join(seg_dir, f"bm25.{key}.npy"), data[key])
+    with open(os.path.join(seg_dir, "bm25.terms.json"), "w", encoding="utf-8") as f:
+        json.dump(data["terms"], f)
+
+
+def read_postings(seg_dir):
+    with open(os.path.join(seg_dir, "bm25.terms.json"), encoding="utf-8") as f:
+        data = {"terms": json.load(f)}
+    for key in POSTING_ARRAYS:
+        data[key] = np.load(os.path.join(seg_dir, f"bm25.{key}.npy"), mmap_mode="r")
+    return data
+
+
+def merge_postings(parts):
+    """Merge the postings of several segments over a common term list."""
+    vocab = {}
+    merged = {key: [] for key in POSTING_ARRAYS}
+    for data in parts:
+        mapping = np.array([vocab.setdefault(t, len(vocab)) for t in data["terms"]], dtype="int32")
+        merged["rows"].append(mapping[data["rows"]] if len(mapping) else np.zeros(0, dtype="int32"))
+        for key in POSTING_ARRAYS[1:]:
+            merged[key].append(np.asarray(data[key]))
+    out = {key: np.concatenate(v) for key, v in merged.items()}
+    out["terms"] = list(vocab)
+    return out
+
+
+def drop_postings(data, is_live):
+    """Postings without the documents `is_live` rejects (tombstoned chunks)."""
+    keep, keep_docs = is_live(data["cols"]), is_live(data["doc_ids"])
+    out = {key: np.asarray(data[key])[keep] for key in ("rows", "cols", "tfs")}
+    out.update({key: np.asarray(data[key])[keep_docs] for key in ("doc_ids", "doc_lens")})
+    out["terms"] = data["terms"]
+    return out
+
+
+def write_vectors(seg_dir, ids, vectors):
+    """Vectors of a segment with the chunk id of every row."""
+    np.save(os.path.join(seg_dir, "vectors.ids.npy"), np.asarray(ids, dtype="int64"))
+    np.save(os.path.join(seg_dir, "vectors.npy"), vectors)
+
+
+def read_vectors(seg_dir):
+    vectors = np.load(os.path.join(seg_dir, "vectors.npy"), mmap_mode="r")
+    ids_path = os.path.join(seg_dir, "vectors.ids.npy")
+    if os.path.exists(ids_path):
+        return np.load(ids_path), vectors
+    # older segments: rows are the segment's chunk ids in order
+    with open(os.path.join(seg_dir, "chunks.json"), encoding="utf-8") as f:
+        start = json.load(f)["start"]
+    return np.arange(start, start + len(vectors), dtype="int64"), vectors
+
+
+def write_deleted(seg_dir, ids):
+    """Chunk ids tombstoned up to this segment (they may belong to older segments)."""
+    np.save(os.path.join(seg_dir, "deleted.npy"), np.asarray(ids, dtype="int64"))
+
+
+def read_deleted(seg_dir):
+    path = os.path.join(seg_dir, "deleted.npy")
+    return np.load(path) if os.path.exists(path) else np.zeros(0, dtype="int64")
+
+
+def write_documents(seg_dir, documents):
+    """Document registry changes of a segment: doc_id -> entry, or None when deleted."""
+    with open(os.path.join(seg_dir, "documents.json"), "w", encoding="utf-8") as f:
+        json.dump(documents, f)
+
+
+def read_documents(seg_dir):
+    path = os.path.join(seg_dir, "documents.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class SegmentStore:
+    """
+    On-disk index as immutable segments plus versioned manifests.
+
+    root/
+      segments/<name>/   chunk columns, vectors, bm25 postings, tombstones, document
+                         registry changes (+ one faiss and one bm25 index per shard
+                         when compacted)
+      manifests/manifest-<version>.json   ordered list of segments = one snapshot
+      CURRENT            name of the active manifest, swapped atomically
+
+    Every save appends one segment with the chunks added since the previous save,
+    so a crash can never leave a half-written snapshot active.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.segments_dir = os.path.join(root, "segments")
+        self.manifests_dir = os.path.join(root, "manifests")
+        # serializes read-modify-write of CURRENT (saves vs background compaction) across
+        # every SegmentStore of this process; a file lock extends it to other processes
+        self._lock = _root_lock(root)
+
+
+    @contextmanager
+    def _exclusive(self):
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, "LOCK"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def segment_path(self, name):
+        return os.path.join(self.segments_dir, name)
+
+
+    def _manifest_path(self, version):
+        return os.path.join(self.manifests_dir, f"manifest-{version:06d}.json")
+
+
+    def versions(self):
+        if not os.path.isdir(self.manifests_dir):
+            return []
+        found = (re.match(r"manifest-(\d+)\.json$", f) for f in os.listdir(self.manifests_dir))
+        return sorted(int(m.group(1)) for m in found if m)
+
+
+    def read_manifest(self, version):
+        with open(self._manifest_path(version), encoding="utf-8") as f:
+            return json.load(f)
+
+
+    def current_version(self):
+        """Version of the active snapshot (the generation readers follow), None before the first save."""
+        path = os.path.join(self.root, "CURRENT")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return int(f.read().strip())
+
+
+    def current(self):
+        version = self.current_version()
+        return None if version is None else self.read_manifest(version)
+
+
+    def _activate(self, version):
+        _fsync_write(os.path.join(self.root, "CURRENT"), str(version))
+
+
+    def _commit(self, segments):
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        version = (self.versions() or [0])[-1] + 1
+        while True:
+            manifest = {
+                "format": FORMAT_VERSION,
+                "version": version,
+                "created": time.time(),
+                "segments": segments,
+                "chunks": sum(s["count"] for s in segments),
+            }
+            tmp = os.path.join(self.manifests_dir, f".manifest-{uuid.uuid4().hex}.tmp")
+            _fsync_write(tmp, json.dumps(manifest, indent=1))
+            try:
+                # link() fails if the file exists, so a version is only ever taken once
+                os.link(tmp, self._manifest_path(version))
+                break
+            except FileExistsError:
+                version += 1
+            finally:
+                os.remove(tmp)
+        self._activate(version)
+        return manifest
+
+
+    def new_segment_dir(self):
+        """Temporary directory to write a segment into; publish it with `publish`."""
+        name = f"seg-{int(time.time() * 1000)}-{uuid.uuid4().hex[:6]}"
+        tmp = self.segment_path(name + ".tmp")
+        os.makedirs(tmp)
+        return name, tmp
+
+
+    def publish(self, name, tmp_dir, start, count, **info):
+        os.replace(tmp_dir, self.segment_path(name))
+        return {"name": name, "start": start, "count": count, **info}
+
+
+    def append(self, segment):
+        """
+        Activate a new snapshot = current snapshot + segment. The segment has to start
+        where the current snapshot ends, otherwise SnapshotConflict is raised.
+        """
+        with self._exclusive():
+            manifest = self.current()
+            chunks = manifest["chunks"] if manifest else 0
+            if segment["start"] != chunks:
+                raise SnapshotConflict(
+                    f"Snapshot has {chunks} chunks, the segment starts at {segment['start']}; load the snapshot first"
+                )
+            segments = (manifest["segments"] if manifest else []) + [segment]
+            return self._commit(segments)
+
+
+    def replace_prefix(self, replaced, segment):
+        """
+        Activate a snapshot where the segments named in `replaced` (a prefix of the
+        current snapshot) are swapped for `segment`. Segments appended meanwhile are kept.
+        """
+        with self._exclusive():
+            current = self.current()["segments"]
+            names = [s["name"] for s in current[:len(replaced)]]
+            if names != replaced:
+                raise RuntimeError("Snapshot changed underneath compaction")
+            return self._commit([segment] + current[len(replaced):])
+
+
+    def snapshots(self):
+        current = self.current()
+        out = []
+        for v in self.versions():
+            m = self.read_manifest(v)
+            out.append({
+                "version": v,
+                "created": m["created"],
+                "segments": len(m["segments"]),
+                "chunks": m["chunks"],
+                "current": bool(current and current["version"] == v),
+            })
+        return out
+
+
+    def rollback(self, version):
+        with self._exclusive():
+            if version not in self.versions():
+                raise FileNotFoundError(f"Snapshot {version} not found")
+            self._activate(version)
+            return self.read_manifest(version)
+
+
+    def prune(self, keep):
+        """Drop manifests beyond the newest `keep` (never the active one) and unreferenced segments."""
+        with self._exclusive():
+            current = self.current()
+            versions = self.versions()
+            kept = set(versions[-keep:]) | ({current["version"]} if current else set())
+            for v in versions:
+                if v not in kept:
+                    os.remove(self._manifest_path(v))
+            referenced = {s["name"] for v in kept for s in self.read_manifest(v)["segments"]}
+            if os.path.isdir(self.segments_dir):
+                for name in os.listdir(self.segments_dir):
+                    # .tmp dirs may belong to a save that is still being written
+                    if name not in referenced and not name.endswith(".tmp"):
+                        shutil.rmtree(self.segment_path(name), ignore_errors=True)
@@ -1,67 +1,390 @@
 import os
+import math
 import faiss
 import numpy as np
 from sklearn.preprocessing import normalize
+from core.vectorstores.float_vectors import FloatVectors
+from config.settings import (
+    FAISS_INDEX_TYPE,
+    FAISS_TRAIN_THRESHOLD,
+    FAISS_NLIST,
+    FAISS_PQ_M,
+    FAISS_HNSW_M,
+    FAISS_NPROBE,
+    FAISS_EF_SEARCH,
+    FAISS_RESCORE_FACTOR,
+    FAISS_RESCORE_MIN,
+    FAISS_TRUNCATE_DIM,
+)
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "binary", "sq8")
+# compressed codes searched first, candidates rescored with the float vectors
+RESCORED_TYPES = ("binary", "sq8")
+# sq8 only needs per-dimension value ranges, a small sample is enough to train them
+SQ_TRAIN_MIN = 1000
+
+# read a saved index without copying it: vectors/codes stay in the (shared) page cache
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+# IO_FLAG_MMAP_IFC maps flat codes too, but IVF inverted lists reject it
+_MMAP_IFC = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def _read_index(path, flags = 0):
+    # binary indexes have their own reader; their fourcc starts with "IB"
+    with open(path, "rb") as f:
+        binary = f.read(2) == b"IB"
+    read = faiss.read_index_binary if binary else faiss.read_index
+    try:
+        return read(path, flags)
+    except RuntimeError:
+        if not flags & _MMAP_IFC:
+            raise
+        return read(path, flags & ~_MMAP_IFC)
+
 
 class FAISSManager:
-    def __init__(self):
+    def __init__(self, store, index_type = FAISS_INDEX_TYPE, train_threshold = FAISS_TRAIN_THRESHOLD,
+                 vectors = None, truncate_dim = FAISS_TRUNCATE_DIM):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported FAISS index type: {index_type}")
+        self.index_type = index_type
+        self.train_threshold = train_threshold
+        self.rescoring = index_type in RESCORED_TYPES
+        # dimensions the codes are built from (0: all)
+        self.truncate_dim = truncate_dim
+        # full-precision vectors for rescoring; shared by the shards of a ShardedFAISS,
+        # which then registers the segment files itself
+        self.owns_vectors = vectors is None
+        self.vectors = FloatVectors() if vectors is None else vectors
         self.index = None
-        self.metadata = []
+        # dimension of the vectors (the index may hold fewer when truncated)
+        self._dim = None
+        # read-only memory-mapped index of a compacted segment; new vectors go to self.index
+        self.base = None
+        # chunk data lives in the shared ChunkStore; vectors are stored under their chunk id
+        self.store = store
+        # deleted chunks the index could not drop (HNSW), filtered out at search time
+        self.soft_deleted = 0
+        # (ids, normalized vectors) added since the last save, see delta()
+        self._unsaved = []
+
+    def _code_dim(self, dim):
+        d = min(self.truncate_dim or dim, dim)
+        # binary codes are whole bytes
+        return d - d % 8 if self.index_type == "binary" and d >= 8 else d
+
+
+    def _encode(self, vectors, index = None):
+        """What `index` (default: the one being built) stores/searches for these normalized vectors."""
+        if index is None:
+            d = self._code_dim(vectors.shape[1])
+            binary = self.index_type == "binary"
+        else:
+            d, binary = index.d, isinstance(index, faiss.IndexBinary)
+        if binary:
+            return np.packbits(vectors[:, :d] > 0, axis=1)
+        if d < vectors.shape[1]:
+            # truncated Matryoshka prefix, renormalized so inner products stay cosines
+            return normalize(vectors[:, :d], axis=1).astype("float32")
+        return vectors
+
 
     def _make_index(self, dim: int):
+        if self.index_type == "binary":
+            self.index = faiss.IndexBinaryIDMap2(faiss.IndexBinaryFlat(self._code_dim(dim)))
+            return
+        if self.index_type == "sq8":
+            # float (truncated) vectors until there are enough to train the quantizer
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self._code_dim(dim)))
+            return
         # Using IP index for cosine similarity; ensure we store normalized embeddings
-        self.index = faiss.IndexFlatIP(dim)
+        if self.index_type == "hnsw":
+            inner = faiss.IndexHNSWFlat(dim, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # IVF types start flat and are trained once the corpus is large enough
+            inner = faiss.IndexFlatIP(dim)
+        # id-mapped so chunks can be removed by chunk id
+        self.index = faiss.IndexIDMap2(inner)
+
+
+    def _make_trained_index(self, vectors):
+        n, dim = vectors.shape
+        if self.index_type == "sq8":
+            codes = self._encode(vectors)
+            index = faiss.IndexScalarQuantizer(codes.shape[1], faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            index.train(codes)
+            return faiss.IndexIDMap2(index)
+        nlist = FAISS_NLIST or max(1, int(4 * math.sqrt(n)))
+        quantizer = faiss.IndexFlatIP(dim)
+        if self.index_type == "ivf_pq":
+            # number of sub-quantizers has to divide the dimension
+            m = max(d for d in range(1, min(FAISS_PQ_M, dim) + 1) if dim % d == 0)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        # IVF stores ids natively; the hashtable direct map allows reconstruct/remove by id
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+
+
+    def _inner(self, index = None):
+        index = self.index if index is None else index
+        if isinstance(index, faiss.IndexIDMap2):
+            return faiss.downcast_index(index.index)
+        if isinstance(index, faiss.IndexBinaryIDMap2):
+            return faiss.downcast_IndexBinary(index.index)
+        return index
+
+
+    def ntotal(self):
+        return sum(i.ntotal for i in (self.base, self.index) if i is not None)
+
+
+    def _all_vectors(self):
+        """(ids, vectors) of everything in the index."""
+        if self.rescoring and not self._is_full_flat() and hasattr(self.index, "id_map"):
+            # codes cannot be decoded back to the original vectors
+            ids = faiss.vector_to_array(self.index.id_map)
+            return ids, self.vectors.get(ids)
+        if isinstance(self.index, faiss.IndexIVF):
+            invlists = self.index.invlists
+            ids = [np.zeros(0, dtype="int64")]
+            for l in range(invlists.nlist):
+                size = invlists.list_size(l)
+                if size:
+                    ids.append(faiss.rev_swig_ptr(invlists.get_ids(l), size).copy())
+            ids = np.concatenate(ids)
+            return ids, self.index.reconstruct_batch(ids)
+        ids = faiss.vector_to_array(self.index.id_map)
+        return ids, self._inner().reconstruct_n(0, self.index.ntotal)
+
+
+    def _is_flat(self):
+        return isinstance(self._inner(), faiss.IndexFlat)
+
+
+    def _is_full_flat(self):
+        """Float vectors of the original dimension (reconstructable as they were added)."""
+        return self._is_flat() and self.index.d == self._dim
+
+
+    def _needs_rebuild(self):
+        """A compressed type whose current index has a different form (e.g. loaded from another type)."""
+        inner = self._inner()
+        if self.index_type == "binary":
+            return not isinstance(inner, faiss.IndexBinaryFlat) or inner.d != self._code_dim(self._dim)
+        if isinstance(inner, faiss.IndexScalarQuantizer):
+            return inner.d != self._code_dim(self._dim)
+        # sq8 before training: truncated flat vectors, trained once SQ_TRAIN_MIN are in
+        return not isinstance(inner, faiss.IndexFlat) or inner.d != self._code_dim(self._dim) \
+            or self.index.ntotal >= SQ_TRAIN_MIN
+
+
+    def migrate(self, index_type = None):
+        """
+        Rebuild the current index as `index_type` (defaults to the configured type),
+        e.g. to move an existing flat index to HNSW or IVF. Deleted chunks are dropped.
+        """
+        self.index_type = index_type or self.index_type
+        if self.index is None or self.index.ntotal == 0:
+            self.index = None
+            return
+        ids, vectors = self._all_vectors()
+        live = self.store.is_live(ids)
+        ids, vectors = ids[live], vectors[live]
+        if self.index_type in ("ivf_flat", "ivf_pq") or (self.index_type == "sq8" and len(ids) >= SQ_TRAIN_MIN):
+            index = self._make_trained_index(vectors)
+        else:
+            self._make_index(vectors.shape[1])
+            index = self.index
+        index.add_with_ids(self._encode(vectors, self._inner(index)) if self.rescoring else vectors, ids)
+        self.index = index
+        self.soft_deleted = 0
+
+
+    def _maybe_migrate(self):
+        if self.index is None:
+            return
+        if self.rescoring:
+            if self._needs_rebuild():
+                self.migrate()
+        elif self.index_type == "hnsw" and self._is_flat():
+            self.migrate()
+        elif self.index_type in ("ivf_flat", "ivf_pq") and self._is_flat() \
+                and self.index.ntotal >= self.train_threshold:
+            # training phase: corpus crossed the threshold
+            self.migrate()
 
 
-    def add(self, embeddings, metadata):
+    def add(self, embeddings, ids):
         """
         embeddings: (N, D) float32
-        metadata: list of dict with same length
+        ids: chunk ids of the rows
         """
         if embeddings.ndim == 1:
             embeddings = embeddings.reshape(1, -1)
         # normalize for cosine similarity
         embeddings = normalize(embeddings, axis=1).astype("float32")
+        ids = np.asarray(ids, dtype="int64")
 
+        self._dim = self._dim or embeddings.shape[1]
         if self.index is None:
-            self._make_index(embeddings.shape[1])
-        self.index.add(embeddings)
-        self.metadata.extend(metadata)
+            self._make_index(self._dim)
+        if self.rescoring:
+            self.vectors.add(ids, embeddings)
+            self.index.add_with_ids(self._encode(embeddings, self._inner()), ids)
+        else:
+            self.index.add_with_ids(embeddings, ids)
+        self._unsaved.append((ids, embeddings))
+        self._maybe_migrate()
 
 
-    def search(self, query_vec: np.ndarray, top_k: int = 5):
-        q = query_vec.astype("float32")
-        # normalize for IP to cosine similarity
-        q = normalize(q, axis=1)
+    def remove(self, ids):
+        """
+        Drop chunk ids from the index. HNSW cannot remove vectors; those stay in the
+        graph and are filtered against the store's tombstones until the next rebuild.
+        """
+        if not len(ids):
+            return
+        if self.base is not None:
+            # the mapped index is read-only
+            self.soft_deleted += len(ids)
         if self.index is None:
-            return []
-        D, I = self.index.search(q, top_k)
-        results = []
-        for score, idx in zip(D[0], I[0]):
-            if idx < len(self.metadata):
-                m = self.metadata[idx]
-                results.append({
-                    "heading": m.get("heading"),
-                    "content": m.get("content"),
-                    "type": m.get("type"),
-                    "score": float(score)
-                })
-        return results
-
-
-    def save(self, dir_path = "volumes/indexes"):
+            return
+        try:
+            self.index.remove_ids(np.asarray(ids, dtype="int64"))
+        except RuntimeError:
+            self.soft_deleted += len(ids)
+
+
+    def delta(self):
+        """(ids, vectors) added since the last save, in insertion order."""
+        if not self._unsaved:
+            return None
+        ids, vectors = zip(*self._unsaved)
+        return np.concatenate(ids), np.concatenate(vectors)
+
+
+    def clear_delta(self):
+        self._unsaved = []
+
+
+    def load_segments(self, vector_parts, index_path = None, mmap = False, base_vectors = None):
+        """
+        Rebuild from persisted segments: start from a saved index when there is one
+        (compacted segments carry it) and add the (ids, vectors) of the segments after it.
+        Chunks deleted in the store are skipped.
+        mmap: map the saved index read-only instead of reading it into memory; the
+        vectors of later segments then go to a separate in-memory index.
+        base_vectors: (ids, vectors) the saved index was built from, for rescoring.
+        """
+        self.base = _read_index(index_path, MMAP_FLAGS) if index_path and mmap else None
+        self.index = _read_index(index_path) if index_path and not mmap else None
+        self.soft_deleted = 0
+        self._unsaved = []
+        if self.rescoring and self.owns_vectors:
+            for ids, vectors in ([base_vectors] if base_vectors else []) + list(vector_parts):
+                self.vectors.add(ids, vectors)
+        self._dim = self.vectors.dim or next((v.shape[1] for _, v in vector_parts if v.size), None)
+        for ids, vectors in vector_parts:
+            live = self.store.is_live(ids)
+            if not live.any():
+                continue
+            vectors = np.ascontiguousarray(vectors[live], dtype="float32")
+            if self.index is None:
+                self._make_index(vectors.shape[1])
+            self.index.add_with_ids(self._encode(vectors, self._inner()) if self.rescoring else vectors, ids[live])
+        if self._dim is not None:
+            self._maybe_migrate()
+
+
+    def _search_params(self, index, top_k, nprobe = None, ef_search = None):
+        if isinstance(index, faiss.IndexBinary):
+            return None
+        inner = self._inner(index)
+        if isinstance(inner, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF()
+            params.nprobe = min(nprobe or FAISS_NPROBE, inner.nlist)
+            return params
+        if isinstance(inner, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(ef_search or FAISS_EF_SEARCH, top_k)
+            return params
+        return None
+
+
+    def _search_one(self, index, q, k, nprobe, ef_search):
+        params = self._search_params(index, k, nprobe, ef_search)
+        if self.rescoring:
+            q = self._encode(q, self._inner(index))
+        D, I = index.search(q, min(k, index.ntotal), params=params)
+        return D[0], I[0]
+
+
+    def search_ids(self, query_vec: np.ndarray, top_k: int = 5, nprobe = None, ef_search = None):
+        """Raw (scores, chunk ids) arrays for a single query, without deleted or hidden chunks."""
+        indexes = [i for i in (self.base, self.index) if i is not None and i.ntotal]
+        if not indexes:
+            return np.zeros(0, dtype="float32"), np.zeros(0, dtype="int64")
+        q = normalize(query_vec.reshape(1, -1).astype("float32"), axis=1)
+        if self.rescoring:
+            return self._search_rescored(indexes, q, top_k)
+        # over-fetch to make up for tombstoned and hidden vectors still in the index
+        k = top_k + self.soft_deleted + self.store.hidden_count
+        hits = [self._search_one(index, q, k, nprobe, ef_search) for index in indexes]
+        D, I = (np.concatenate(x) for x in zip(*hits))
+        if len(hits) > 1:
+            order = np.argsort(-D, kind="stable")
+            D, I = D[order], I[order]
+        keep = I != -1
+        if self.soft_deleted or self.store.deleted_count or self.store.hidden_count:
+            keep[keep] = self.store.is_visible(I[keep])
+        return D[keep][:top_k], I[keep][:top_k]
+
+
+    def _search_rescored(self, indexes, q, top_k):
+        """Codes pick top_k * FAISS_RESCORE_FACTOR candidates, exact inner products with the float vectors rank them."""
+        k = max(top_k * FAISS_RESCORE_FACTOR, FAISS_RESCORE_MIN, top_k) + self.soft_deleted + self.store.hidden_count
+        I = np.concatenate([self._search_one(index, q, k, None, None)[1] for index in indexes])
+        I = I[I != -1]
+        if self.soft_deleted or self.store.deleted_count or self.store.hidden_count:
+            I = I[self.store.is_visible(I)]
+        D = self.vectors.get(I) @ q[0]
+        order = np.argsort(-D, kind="stable")[:top_k]
+        return D[order].astype("float32"), I[order]
+
+
+    def memory_info(self):
+        """Bytes of codes held by the index(es) and of the float vectors kept for rescoring."""
+        code_bytes = 0
+        for index in (self.base, self.index):
+            if index is None:
+                continue
+            inner = self._inner(index)
+            if isinstance(index, faiss.IndexBinary):
+                code_bytes += index.ntotal * inner.code_size
+            elif hasattr(inner, "sa_code_size"):
+                code_bytes += index.ntotal * inner.sa_code_size()
+        info = {"index_type": self.index_type, "code_bytes": int(code_bytes)}
+        if self.rescoring and self.owns_vectors:
+            info.update(self.vectors.info())
+        return info
+
+
+    def search(self, query_vec: np.ndarray, top_k: int = 5, nprobe = None, ef_search = None):
+        D, I = self.search_ids(query_vec, top_k, nprobe, ef_search)
+        return [{**self.store.get(idx), "score": float(score)} for score, idx in zip(D, I)]
+
+
+    def save(self, dir_path = "volumes/indexes", file_name = "faiss.index"):
         os.makedirs(dir_path, exist_ok=True)
+        if self.base is not None:
+            raise RuntimeError("Index is memory-mapped read-only")
         if self.index is None:
             raise RuntimeError("No index to save")
-        faiss.write_index(self.index, os.path.join(dir_path, "faiss.index"))
-        np.save(os.path.join(dir_path, "metadata.npy"), np.array(self.metadata, dtype=object))
+        if isinstance(self.index, faiss.IndexBinary):
+            faiss.write_index_binary(self.index, os.path.join(dir_path, file_name))
+        else:
+            faiss.write_index(self.index, os.path.join(dir_path, file_name))
         return dir_path
-
-
-    def load(self, dir_path = "volumes/indexes"):
-        idx_path = os.path.join(dir_path, "faiss.index")
-        meta_path = os.path.join(dir_path, "metadata.npy")
-        if not os.path.exists(idx_path) or not os.path.exists(meta_path):
-            raise FileNotFoundError("Index or metadata not found")
-        self.index = faiss.read_index(idx_path)
-        self.metadata = np.load(meta_path, allow_pickle=True).tolist()
@@ -0,0 +1,73 @@
+import threading
+import numpy as np
+
+
+class FloatVectors:
+    """
+    Full-precision vectors by chunk id, for rescoring the candidates of a compressed
+    index. Segment files are registered as they are (memory-mapped), so only vectors
+    added since the last save take RAM; the page cache holds the hot rows.
+    Shards add from their own threads while searches read, so the id maps are
+    only touched under a lock.
+    """
+
+    def __init__(self):
+        self.parts = []
+        # chunk id -> part index (-1: unknown) and row within the part
+        self._part = np.full(0, -1, dtype="int32")
+        self._row = np.zeros(0, dtype="int64")
+        self._lock = threading.Lock()
+
+
+    def add(self, ids, vectors):
+        """Register rows of `vectors` (not copied) for `ids`; replaces earlier registrations."""
+        ids = np.asarray(ids, dtype="int64")
+        if not len(ids):
+            return
+        with self._lock:
+            n = int(ids.max()) + 1
+            if n > len(self._part):
+                size = max(n, 2 * len(self._part))
+                self._part = np.concatenate([self._part, np.full(size - len(self._part), -1, dtype="int32")])
+                self._row = np.concatenate([self._row, np.zeros(size - len(self._row), dtype="int64")])
+            replaced = np.unique(self._part[ids])
+            self._part[ids] = len(self.parts)
+            self._row[ids] = np.arange(len(ids))
+            self.parts.append(vectors)
+            # release parts nothing points to anymore (e.g. in-memory rows now saved to a segment)
+            for p in replaced[replaced >= 0]:
+                if not (self._part == p).any():
+                    self.parts[p] = None
+
+
+    @property
+    def dim(self):
+        with self._lock:
+            parts = list(self.parts)
+        return next((p.shape[1] for p in parts if p is not None and p.size), None)
+
+
+    def get(self, ids):
+        ids = np.asarray(ids, dtype="int64")
+        dim = self.dim
+        # a consistent view of the maps; the rows are read outside the lock from parts held here
+        with self._lock:
+            if len(ids) and (ids.max() >= len(self._part) or (self._part[ids] < 0).any()):
+                raise KeyError("No full-precision vector for some chunk ids")
+            part, row = self._part[ids], self._row[ids]
+            parts = list(self.parts)
+        out = np.empty((len(ids), dim or 0), dtype="float32")
+        for p in np.unique(part):
+            mask = part == p
+            # sorted rows read the mapped file sequentially
+            rows = row[mask]
+            order = np.argsort(rows)
+            out[np.flatnonzero(mask)[order]] = parts[p][rows[order]]
+        return out
+
+
+    def info(self):
+        with self._lock:
+            live = [p for p in self.parts if p is not None]
+        mapped = sum(p.nbytes for p in live if isinstance(p, np.memmap))
+        return {"parts": len(live), "mapped_bytes": mapped, "memory_bytes": sum(p.nbytes for p in live) - mapped}
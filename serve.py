@@ -0,0 +1,19 @@
+"""
+Server entry point: python serve.py
+
+Importing this module has no side effects. Processes started with the "spawn" method
+(the PDF parsing pool, uvicorn's reloader and workers) re-import the main module, and
+app.py would build a whole pipeline in each of them.
+"""
+import uvicorn
+from config.settings import SERVE_ROLE, SERVE_WORKERS
+
+
+def main():
+    # several workers only make sense for read replicas; each would otherwise hold its own index
+    workers = SERVE_WORKERS if SERVE_ROLE == "reader" else 1
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=workers, reload=SERVE_ROLE == "standalone")
+
+
+if __name__ == "__main__":
+    main()
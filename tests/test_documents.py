@@ -0,0 +1,72 @@
+import os
+import shutil
+from benchmarks.corpus import generate_corpus
+from benchmarks.run import make_pipeline
+from core.storage.document_registry import DocumentRegistry
+
+
+def corpus(tmp_path):
+    return generate_corpus(str(tmp_path / "corpus"), "small", ["txt"], 0)
+
+
+def test_unchanged_upload_is_skipped(tmp_path):
+    path = corpus(tmp_path)[0]
+    pipeline = make_pipeline(32, 0)
+    first = pipeline.ingest_file(path)
+
+    again = pipeline.ingest_file(path)
+
+    assert first["ingested"] > 0
+    assert again == {"ingested": 0, "doc_id": os.path.basename(path), "skipped": True}
+    assert pipeline.store.live_count() == first["ingested"]
+
+
+def test_changed_upload_replaces_the_document(tmp_path):
+    a, b = corpus(tmp_path)[:2]
+    doc = str(tmp_path / "doc.txt")
+    shutil.copy(a, doc)
+    pipeline = make_pipeline(32, 0)
+    first = pipeline.ingest_file(doc)
+    old_ids = DocumentRegistry.chunk_ids(pipeline.documents.get("doc.txt"))
+    shutil.copy(b, doc)
+
+    second = pipeline.ingest_file(doc)
+
+    assert second["replaced"] == first["ingested"] == len(old_ids)
+    assert not pipeline.store.is_live(old_ids).any()
+    assert pipeline.store.live_count() == second["ingested"]
+    assert len(pipeline.documents) == 1
+    ids = pipeline.faiss.search_ids(pipeline.embed_mgr.embed_query(open(a).read()[:200]), top_k=10)[1]
+    assert not set(ids) & set(old_ids)
+
+
+def test_same_file_name_with_distinct_doc_ids_keeps_both(tmp_path):
+    a, b = corpus(tmp_path)[:2]
+    os.makedirs(tmp_path / "x")
+    os.makedirs(tmp_path / "y")
+    shutil.copy(a, tmp_path / "x" / "doc.txt")
+    shutil.copy(b, tmp_path / "y" / "doc.txt")
+    pipeline = make_pipeline(32, 0)
+
+    first = pipeline.ingest_file(str(tmp_path / "x" / "doc.txt"), doc_id="x/doc.txt")
+    second = pipeline.ingest_file(str(tmp_path / "y" / "doc.txt"), doc_id="y/doc.txt")
+
+    assert second["replaced"] == 0
+    assert len(pipeline.documents) == 2
+    assert pipeline.store.live_count() == first["ingested"] + second["ingested"]
+
+
+def test_delete_document(tmp_path):
+    a, b = corpus(tmp_path)[:2]
+    pipeline = make_pipeline(32, 0)
+    first = pipeline.ingest_file(a)
+    second = pipeline.ingest_file(b)
+
+    removed = pipeline.delete_document(os.path.basename(a))
+
+    assert removed == first["ingested"]
+    assert pipeline.delete_document(os.path.basename(a)) is None
+    assert len(pipeline.documents) == 1
+    assert pipeline.store.live_count() == second["ingested"]
+    ids = pipeline.faiss.search_ids(pipeline.embed_mgr.embed_query(open(a).read()[:200]), top_k=10)[1]
+    assert all(i >= first["ingested"] for i in ids)
@@ -0,0 +1,12 @@
+from utility.metrics import Histogram
+
+
+def test_label_values_are_escaped():
+    h = Histogram("t_seconds", "test", labels=("path",), buckets=(1.0,))
+    h.observe(0.5, 'C:\\tmp\\"x"\nnext')
+
+    lines = h.render()
+
+    assert 't_seconds_count{path="C:\\\\tmp\\\\\\"x\\"\\nnext"} 1' in lines
+    # one sample per line, nothing leaks from the newline
+    assert all(line.startswith(("#", "t_seconds_")) for line in lines)
@@ -0,0 +1,79 @@
+import json
+import time
+import threading
+import urllib.request
+import numpy as np
+import openai
+import pytest
+from benchmarks.mock_openai_server import make_server
+from benchmarks.stub_embedder import StubEmbeddings
+from core.embeddings.openai_embeddings import OpenAIEmbeddings, PartialEmbeddingError
+
+DIM = 16
+
+
+@pytest.fixture
+def mock_server():
+    """Start a mock embeddings server with the given flags; yields a factory returning its base URL."""
+    servers = []
+
+    def start(*argv):
+        server = make_server(["--port", "0", "--dim", str(DIM), "--latency-ms", "0", *argv])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/v1"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.load(response)
+
+
+def test_rate_limited_requests_wait_for_retry_after(mock_server):
+    # two requests per 0.4s window, five single-text batches: the last one lands in the third window,
+    # at least one whole window after the first request
+    base_url = mock_server("--rpm", "2", "--window", "0.4")
+    client = OpenAIEmbeddings(base_url=base_url, api_key="test", max_items=1, max_retries=10)
+    texts = [f"text number {i}" for i in range(5)]
+
+    start = time.monotonic()
+    vectors = client.embed_texts(texts)
+
+    assert time.monotonic() - start >= 0.4
+    np.testing.assert_allclose(vectors, StubEmbeddings(DIM).embed_texts(texts), atol=1e-6)
+    assert client.stats["rate_limited"] > 0
+    assert client.stats["retries"] == client.stats["rate_limited"]
+    assert server_stats(base_url)["429"] == client.stats["rate_limited"]
+
+
+def test_poisoned_input_is_bisected_out(mock_server):
+    base_url = mock_server()
+    client = OpenAIEmbeddings(base_url=base_url, api_key="test")
+    texts = ["alpha", "beta", "", "delta", "epsilon"]
+
+    with pytest.raises(PartialEmbeddingError) as e:
+        client.embed_texts(texts)
+
+    assert list(e.value.failed) == [2]
+    assert isinstance(e.value.cause, openai.BadRequestError)
+    assert np.isnan(e.value.vectors[2]).all()
+    good = [0, 1, 3, 4]
+    np.testing.assert_allclose(e.value.vectors[good], StubEmbeddings(DIM).embed_texts([texts[i] for i in good]), atol=1e-6)
+    assert client.stats["failed_texts"] == 1
+    assert client.stats["retries"] == 0
+
+
+def test_auth_error_is_fatal(mock_server):
+    base_url = mock_server("--api-key", "secret")
+    client = OpenAIEmbeddings(base_url=base_url, api_key="wrong", max_items=1)
+
+    with pytest.raises(openai.AuthenticationError):
+        client.embed_texts(["one", "two", "three"])
+
+    assert client.stats["retries"] == 0
+    assert server_stats(base_url)["401"] == client.stats["requests"]
@@ -0,0 +1,86 @@
+import sys
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.corpus import generate_corpus, sample_queries
+from benchmarks.run import make_pipeline
+from core.retriever import sharded_index
+from core.retriever.sharded_index import ShardedFAISS
+from core.storage.chunk_store import ChunkStore
+
+DIM = 64
+
+
+@pytest.fixture(autouse=True)
+def shard_threads(monkeypatch):
+    # a thread per shard regardless of SHARD_WORKERS, as with INDEX_SHARDS=8
+    executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="shard")
+    monkeypatch.setattr(sharded_index, "_executor", executor)
+    yield
+    executor.shutdown()
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return generate_corpus(str(tmp_path_factory.mktemp("corpus")), "small", ["txt"], 0)
+
+
+@pytest.fixture
+def fast_switching():
+    # switch threads as often as possible so the shards' concurrent adds interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def ingest(corpus, n_shards, index_type):
+    pipeline = make_pipeline(DIM, 0)
+    pipeline.faiss = ShardedFAISS(pipeline.store, n_shards=n_shards, index_type=index_type)
+    for path in corpus:
+        pipeline.ingest_file(path)
+    return pipeline
+
+
+def results(pipeline, queries):
+    return [[r["content"] for r in pipeline.query_faiss(q, top_k=5)] for q in queries]
+
+
+@pytest.mark.parametrize("index_type", ["sq8", "binary"])
+def test_concurrent_shard_adds_keep_the_right_vectors(fast_switching, index_type):
+    rng = np.random.default_rng(0)
+    store = ChunkStore()
+    faiss = ShardedFAISS(store, n_shards=8, index_type=index_type)
+    batches = []
+    for _ in range(200):
+        vectors = rng.standard_normal((64, 32)).astype("float32")
+        faiss.add(vectors, store.add([{"content": "x"}] * len(vectors)))
+        batches.append(vectors)
+    vectors = np.concatenate(batches)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    np.testing.assert_allclose(faiss.vectors.get(np.arange(len(vectors))), vectors, atol=1e-6)
+    for q in vectors[:20]:
+        scores, ids = faiss.search_ids(q, top_k=5)
+        # rescored against each id's own vector; the query itself ranks first
+        np.testing.assert_allclose(scores, vectors[ids] @ q, atol=1e-5)
+        assert scores[0] == pytest.approx(1.0, abs=1e-5)
+
+
+@pytest.mark.parametrize("index_type", ["sq8", "binary"])
+def test_sharded_rescoring_matches_flat(corpus, fast_switching, tmp_path, index_type):
+    flat = ingest(corpus, 1, "flat")
+    sharded = ingest(corpus, 8, index_type)
+    queries = sample_queries([flat.store.content(i) for i in range(len(flat.store))], 20, 0)
+    expected = results(flat, queries)
+
+    assert results(sharded, queries) == expected
+    assert sharded.faiss.vectors.info()["memory_bytes"] > 0
+
+    sharded.save(str(tmp_path / "index"))
+
+    # the unsaved in-memory copies were swapped for the mapped segment file
+    info = sharded.faiss.vectors.info()
+    assert info["memory_bytes"] == 0
+    assert info["mapped_bytes"] > 0
+    assert results(sharded, queries) == expected
@@ -0,0 +1,185 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# seconds; covers sub-millisecond index lookups up to multi-second ingest stages
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _escape(value):
+    # text exposition format: backslash, double quote and line feed are escaped in label values
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _le(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels = (), buckets = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # label values -> [bucket counts, sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: ([*v[0]], v[1], v[2]) for k, v in self._series.items()}
+        for values, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _labels(self.label_names + ("le",), values + (_le(bound),))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {count}")
+        return lines
+
+
+class Collected:
+    """Gauge or counter whose values are read from a callback at scrape time."""
+
+    def __init__(self, name, help, fn, kind = "gauge", label = None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        # fn returns a number, or {label value: number} when a label name is given
+        self.label = label
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        value = self.fn()
+        if self.label is None:
+            value = {None: value}
+        for key, v in value.items():
+            if v is None:
+                continue
+            labels = "" if key is None else _labels((self.label,), (key,))
+            lines.append(f"{self.name}{labels} {float(v)}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+
+    def histogram(self, name, help, labels = (), buckets = LATENCY_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+
+    def collect(self, name, help, fn, kind = "gauge", label = None):
+        self.metrics[name] = Collected(name, help, fn, kind, label)
+
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # one broken callback must not take down the whole scrape
+                continue
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Time spent in a pipeline stage, excluding nested stages", ("stage",)
+)
+REQUEST_SECONDS = REGISTRY.histogram("rag_request_seconds", "HTTP request latency", ("method", "route", "status"))
+EMBED_BATCH_SIZE = REGISTRY.histogram(
+    "rag_embed_batch_texts", "Texts per embedding backend call", ("kind",), buckets=SIZE_BUCKETS
+)
+
+# time already attributed to nested spans of the innermost open span
+_open_span = contextvars.ContextVar("open_span", default=None)
+# stage -> seconds of the current request, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _record(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    """Time a block; nested spans are subtracted so the stages of a request add up to its total."""
+    nested = [0.0]
+    parent = _open_span.get()
+    token = _open_span.set(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _open_span.reset(token)
+        if parent is not None:
+            parent[0] += elapsed
+        _record(stage, elapsed - nested[0])
+
+
+def timed_iter(stage, iterable):
+    """Iterate, timing only the work done inside the iterator (not the consumer's)."""
+    it = iter(iterable)
+    while True:
+        with span(stage):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def start_request():
+    """Collect the spans of this request (and of the pool threads it submits work to)."""
+    return _request_timings.set({})
+
+
+def end_request(token):
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def server_timing(timings, total = None):
+    """Server-Timing header value: one metric per stage, in milliseconds."""
+    parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
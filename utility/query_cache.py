@@ -0,0 +1,207 @@
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from utility.metrics import span
+from config.settings import QUERY_CACHE_MEMORY_ITEMS, QUERY_CACHE_LOCK_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    Two-tier cache for search results with request coalescing:
+    - memory: per-process LRU with TTL, no network round trip for hot queries
+    - redis: shared between processes; one process computes a missing key under a
+      SETNX lock and publishes on a channel when done, so waiters in other processes
+      wake up right away instead of polling
+    Keys carry an index generation that `bump` increments (after ingest/delete), so
+    results computed against an older index are never served again.
+    """
+
+    def __init__(self, redis_client, prefix = "qc", memory_items = QUERY_CACHE_MEMORY_ITEMS, lock_ttl = QUERY_CACHE_LOCK_TTL):
+        self.r = redis_client
+        self.memory_items = memory_items
+        self.lock_ttl = lock_ttl
+        self.done_channel = f"{prefix}:done"
+        self.generation_channel = f"{prefix}:generation"
+        self.generation_key = f"{prefix}:generation"
+        self.generation = 0
+        self.stats = {"memory_hits": 0, "redis_hits": 0, "coalesced": 0, "computed": 0, "wakeups": 0, "timeouts": 0}
+        self._memory = OrderedDict()
+        # key -> future of the computation running in this process
+        self._inflight = {}
+        # key -> futures of local waiters for a computation in another process
+        self._waiters = {}
+        self._loop = None
+        self._listener = None
+
+
+    async def start(self):
+        """Read the current generation and subscribe to completion/generation messages."""
+        self._loop = asyncio.get_running_loop()
+        self.generation = int(await self.r.get(self.generation_key) or 0)
+        pubsub = self.r.pubsub()
+        await pubsub.subscribe(self.done_channel, self.generation_channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if message["channel"] == self.generation_channel:
+                        self.generation = max(self.generation, int(message["data"]))
+                    else:
+                        for fut in self._waiters.pop(message["data"], []):
+                            if not fut.done():
+                                fut.set_result(None)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # waiters fall back to their timeout while the subscription is re-established
+                logger.exception("Query cache subscription failed")
+                await asyncio.sleep(1)
+
+
+    def key(self, *parts):
+        return ":".join([str(self.generation), *map(str, parts)])
+
+
+    async def bump(self):
+        """Invalidate every cached result by moving to a new index generation."""
+        generation = await self.r.incr(self.generation_key)
+        self.generation = max(self.generation, generation)
+        await self.r.publish(self.generation_channel, generation)
+        return generation
+
+
+    def bump_threadsafe(self):
+        """`bump` from a worker thread (e.g. after an ingest job)."""
+        if self._loop is None:
+            return None
+        return asyncio.run_coroutine_threadsafe(self.bump(), self._loop).result()
+
+
+    def _memory_get(self, key):
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+
+    def _memory_put(self, key, value, ttl):
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = (time.monotonic() + ttl, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+
+    async def get_or_compute(self, key, ttl, compute_coro):
+        value = self._memory_get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        # same key already being fetched/computed in this process
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(inflight)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            value = await self._fetch_or_compute(key, ttl, compute_coro)
+            fut.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # mark retrieved, local followers (if any) still get the exception
+            fut.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+
+    async def _redis_get(self, key, ttl):
+        with span("redis_get"):
+            cached = await self.r.get(key)
+        if not cached:
+            return None
+        value = json.loads(cached)
+        self._memory_put(key, value, ttl)
+        return value
+
+
+    async def _wait_for_peer(self, key, ttl):
+        """Wait for another process computing `key`; returns its result, None if it failed."""
+        # register for the completion message first, then re-check so a result
+        # published in between is not missed
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append(waiter)
+        try:
+            value = await self._redis_get(key, ttl)
+            if value is not None:
+                return value
+            try:
+                with span("lock_wait"):
+                    await asyncio.wait_for(waiter, timeout=self.lock_ttl)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise TimeoutError("Timeout waiting for cached result")
+            self.stats["wakeups"] += 1
+            return await self._redis_get(key, ttl)
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[key]
+
+
+    async def _fetch_or_compute(self, key, ttl, compute_coro):
+        value = await self._redis_get(key, ttl)
+        if value is not None:
+            self.stats["redis_hits"] += 1
+            return value
+        lock_key = f"lock:{key}"
+        with span("redis_lock"):
+            locked = await self.r.set(lock_key, "1", nx=True, ex=self.lock_ttl)
+        if not locked and self._listener is not None:
+            value = await self._wait_for_peer(key, ttl)
+            if value is not None:
+                self.stats["redis_hits"] += 1
+                return value
+            # the other computation failed, compute here
+        try:
+            self.stats["computed"] += 1
+            value = await compute_coro()
+            with span("redis_set"):
+                await self.r.set(key, json.dumps(value), ex=ttl)
+            self._memory_put(key, value, ttl)
+            return value
+        finally:
+            if locked:
+                await self.r.delete(lock_key)
+                await self.r.publish(self.done_channel, key)
+
+
+    def info(self):
+        return {**self.stats, "generation": self.generation, "memory_items": len(self._memory)}
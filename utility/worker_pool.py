@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class BoundedWorkerPool:
+    """
+    Thread pool with admission control: at most `workers` running jobs plus
+    `max_queue` waiting ones, further submissions raise PoolSaturated.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+
+    def _release(self, _fut):
+        with self._lock:
+            self._pending -= 1
+
+
+    def has_capacity(self):
+        with self._lock:
+            return self._pending < self.max_pending
+
+
+    def submit(self, fn, *args, force = False, **kwargs):
+        """force: bypass the admission limit (e.g. for jobs resumed at startup)."""
+        with self._lock:
+            if self._pending >= self.max_pending and not force:
+                raise PoolSaturated(f"{self.name} pool is saturated ({self._pending} pending)")
+            self._pending += 1
+        # run in a copy of the caller's context so contextvars carry over
+        ctx = contextvars.copy_context()
+        try:
+            fut = self._executor.submit(ctx.run, fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        fut.add_done_callback(self._release)
+        return fut
+
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+
+    def info(self):
+        with self._lock:
+            pending = self._pending
+        return {
+            "workers": self.workers,
+            "running": min(pending, self.workers),
+            "queued": max(pending - self.workers, 0),
+            "max_pending": self.max_pending,
+        }
+
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)